@@ -1,7 +1,10 @@
 import argparse
+import itertools
 import json
 import os
-from typing import Literal
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator, Literal
 
 from halo import Halo
 
@@ -13,12 +16,26 @@ from bibles import (
     get_dbl_text,
     get_timings,
 )
-from constants import bible_chapters, mms_languages, translations
-from model import load_model
-from timestamp_types import ChapterInfo, ChapterText
+from chapter_state import ChapterState
+from constants import bible_chapters, model_name, translations
+from http_client import get_client
+from languages import can_align
+from model import BACKENDS, PRECISIONS, load_model
+from timestamp_types import ChapterInfo, ChapterText, TranslationIds
+from tuning import load_emission_config
 
 parser = argparse.ArgumentParser()
 
+parser.add_argument(
+    "command",
+    help=(
+        "`align` (the default) downloads and aligns the bible. `status` reports "
+        "how many chapters have been downloaded and aligned so far."
+    ),
+    nargs="?",
+    choices=["align", "status"],
+    default="align",
+)
 parser.add_argument(
     "-o",
     "--output",
@@ -32,39 +49,177 @@ parser.add_argument(
     required=True,
     type=str,
 )
+parser.add_argument(
+    "-b",
+    "--batch-size",
+    help=(
+        "The number of audio windows to run through the model at once. Default "
+        "is 1, or the batch size from this machine's tuning profile."
+    ),
+    default=None,
+    type=int,
+)
+parser.add_argument(
+    "--no-tuning",
+    help=(
+        "Ignore this machine's tuning profile (see autotune.py) and use the "
+        "default window length, batch size and thread counts."
+    ),
+    action="store_true",
+)
+parser.add_argument(
+    "--precision",
+    help=(
+        "The numeric precision to run the models in. `int8` quantizes the "
+        "models' linear layers, which is faster on CPU but can move timestamps "
+        "slightly. Default is `fp32`."
+    ),
+    choices=PRECISIONS,
+    default="fp32",
+)
+parser.add_argument(
+    "--backend",
+    help=(
+        "How to run the alignment model: `eager` PyTorch, `torchscript`, "
+        "`compile` (torch.compile) or `onnx` (ONNX Runtime, needs onnxruntime "
+        "and onnxscript). Exported models are cached next to the checkpoint. "
+        "Only supported with fp32 precision. Default is `eager`."
+    ),
+    choices=BACKENDS,
+    default="eager",
+)
+parser.add_argument(
+    "--prefetch",
+    help=(
+        "The number of chapters to download ahead of the one being aligned, so "
+        "downloading and aligning overlap. Downloads never get further ahead "
+        "than this. 0 downloads and aligns one chapter at a time. Default is 2."
+    ),
+    default=2,
+    type=int,
+)
+parser.add_argument(
+    "--download-workers",
+    help="The number of chapters to download at once. Default is 2.",
+    default=2,
+    type=int,
+)
+parser.add_argument(
+    "--verify-audio",
+    help=(
+        "Check chapter audio downloaded by an earlier run instead of assuming "
+        "it is complete, downloading only the bytes missing from truncated "
+        "files."
+    ),
+    action="store_true",
+)
+parser.add_argument(
+    "--cache-dir",
+    help=(
+        "A folder to cache model emissions in, so re-aligning the same audio "
+        "skips the model. Default is `emission_cache`."
+    ),
+    default="emission_cache",
+)
+parser.add_argument(
+    "--cache-size-mb",
+    help=(
+        "The maximum size of the emission cache in MB. The least recently used "
+        "entries are removed past this size. 0 disables the cache. Default is 1024."
+    ),
+    default=1024,
+    type=float,
+)
 
 
-def get_audio(chapter_info: ChapterInfo, source: Literal["bb", "dbl"], b_id: str):
+def get_audio(
+    chapter_info: ChapterInfo,
+    source: Literal["bb", "dbl"],
+    b_id: str,
+    verify: bool = False,
+    state: ChapterState | None = None,
+):
+    """
+    Download a chapter's audio. Downloads are only moved into place once
+    they are complete, so existing audio is skipped unless `verify` is set.
+    Then it is treated as a partial download and resumed, which fetches
+    nothing if it is already complete.
+    """
     spinner = Halo()
-    if os.path.exists(chapter_info["paths"]["audio"]):
-        spinner.info(f"({chapter_info['chapter_id']}) Audio already exists. Skipping.")
-        return
+    chapter_id = chapter_info["chapter_id"]
+    audio_path = chapter_info["paths"]["audio"]
+    resumed = False
+    if os.path.exists(audio_path):
+        if not verify:
+            spinner.info(f"({chapter_id}) Audio already exists. Skipping.")
+            # Audio downloaded before there was a state index, or replaced
+            # since.
+            if state is not None:
+                status = state.get(chapter_id)
+                if status is None or not state.is_current(status, "audio", audio_path):
+                    state.mark_audio(chapter_id, audio_path)
+            return
+        if not os.path.exists(f"{audio_path}.part"):
+            os.replace(audio_path, f"{audio_path}.part")
+            resumed = True
 
-    if source == "bb":
-        get_bb_audio(
-            b_id, chapter_info["chapter_id"], output=chapter_info["paths"]["audio"]
-        )
-    elif source == "dbl":
-        get_dbl_audio(
-            b_id, chapter_info["chapter_id"], output=chapter_info["paths"]["audio"]
-        )
-    else:
-        print("Invalid source")
-        exit(0)
+    try:
+        if source == "bb":
+            get_bb_audio(
+                b_id, chapter_info["chapter_id"], output=chapter_info["paths"]["audio"]
+            )
+        elif source == "dbl":
+            get_dbl_audio(
+                b_id, chapter_info["chapter_id"], output=chapter_info["paths"]["audio"]
+            )
+        else:
+            print("Invalid source")
+            exit(0)
+    finally:
+        # If the download didn't finish (e.g. the API lookup failed), put the
+        # existing audio back rather than leave the chapter without any.
+        if (
+            resumed
+            and not os.path.exists(audio_path)
+            and os.path.exists(f"{audio_path}.part")
+        ):
+            os.replace(f"{audio_path}.part", audio_path)
+
+    if state is not None and os.path.exists(audio_path):
+        state.mark_audio(chapter_id, audio_path)
 
 
-def get_text(chapter_info: ChapterInfo, source: Literal["bb", "dbl"], b_id: str):
+def get_text(
+    chapter_info: ChapterInfo,
+    source: Literal["bb", "dbl"],
+    b_id: str,
+    state: ChapterState | None = None,
+):
     spinner = Halo()
+    chapter_id = chapter_info["chapter_id"]
+    text_path = chapter_info["paths"]["text"]
 
-    if (
-        os.path.exists(chapter_info["paths"]["text"])
-        and len(
-            json.load(open(chapter_info["paths"]["text"], encoding="utf-8"))["verses"]
-        )
-        > 0
-    ):
-        spinner.info(f"({chapter_info['chapter_id']}) Text already exists. Skipping.")
-        return
+    status = state.get(chapter_id) if state is not None else None
+    if state is not None and status is not None and status["verses"]:
+        # Once the chapter is aligned, its text file has the timings in it.
+        if state.is_current(status, "text", text_path) or state.is_current(
+            status, "aligned", text_path
+        ):
+            spinner.info(f"({chapter_id}) Text already exists. Skipping.")
+            return
+        # The text file was removed or changed, so check it again (or
+        # download it again) and align the chapter again.
+        state.clear(chapter_id, "text", "aligned")
+
+    if os.path.exists(text_path):
+        with open(text_path, encoding="utf-8") as f:
+            verses = len(json.load(f)["verses"])
+        if verses > 0:
+            spinner.info(f"({chapter_id}) Text already exists. Skipping.")
+            # Text downloaded before there was a state index.
+            if state is not None:
+                state.mark_text(chapter_id, text_path, verses)
+            return
 
     # Start with an empty chapter text object that we will fill in.
     chapter_text: ChapterText = {
@@ -93,20 +248,108 @@ def get_text(chapter_info: ChapterInfo, source: Literal["bb", "dbl"], b_id: str)
         print("Invalid source")
         exit(0)
 
+    if state is not None and chapter_text["verses"] and os.path.exists(text_path):
+        state.mark_text(chapter_id, text_path, len(chapter_text["verses"]))
+
+
+def download_chapter(
+    chapter_info: ChapterInfo,
+    source: Literal["bb", "dbl"],
+    b_ids: TranslationIds,
+    verify_audio: bool = False,
+    state: ChapterState | None = None,
+) -> ChapterInfo:
+    os.makedirs(chapter_info["paths"]["book"], exist_ok=True)
+    get_audio(chapter_info, source, b_ids["audio"], verify_audio, state)
+    get_text(chapter_info, source, b_ids["text"], state)
+    return chapter_info
+
+
+def prefetch_chapters(
+    chapters: list[tuple[ChapterInfo, TranslationIds]],
+    source: Literal["bb", "dbl"],
+    prefetch: int,
+    workers: int,
+    verify_audio: bool = False,
+    state: ChapterState | None = None,
+) -> Iterator[ChapterInfo]:
+    """
+    Download chapters on background threads and yield them in order once
+    they are downloaded. While the caller aligns a chapter, at most the next
+    `prefetch` chapters are downloaded or being downloaded, so downloads can't
+    run arbitrarily far ahead of alignment and fill the disk.
+    """
+    if prefetch <= 0:
+        for chapter_info, b_ids in chapters:
+            yield download_chapter(chapter_info, source, b_ids, verify_audio, state)
+        return
+
+    executor = ThreadPoolExecutor(max(1, workers))
+    remaining = iter(chapters)
+    downloads: deque[Future[ChapterInfo]] = deque(
+        executor.submit(
+            download_chapter, chapter_info, source, b_ids, verify_audio, state
+        )
+        for chapter_info, b_ids in itertools.islice(remaining, prefetch + 1)
+    )
+    try:
+        while downloads:
+            yield downloads.popleft().result()
+
+            # The caller has finished with that chapter, so there is room to
+            # download another.
+            for chapter_info, b_ids in itertools.islice(remaining, 1):
+                downloads.append(
+                    executor.submit(
+                        download_chapter,
+                        chapter_info,
+                        source,
+                        b_ids,
+                        verify_audio,
+                        state,
+                    )
+                )
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def print_status(chapters: list[ChapterInfo], state: ChapterState):
+    """
+    Print how many of the bible's chapters have their audio and text and
+    have been aligned, per testament.
+    """
+    statuses = state.get_all()
+    rows = [f"{'':<10} {'chapters':>9} {'audio':>9} {'text':>9} {'aligned':>9}"]
+    for testament in ["ot", "nt", None]:
+        chapter_ids = [
+            chapter_info["chapter_id"]
+            for chapter_info in chapters
+            if testament is None or chapter_info["testament"] == testament
+        ]
+        if not chapter_ids:
+            continue
+        found = [statuses[i] for i in chapter_ids if i in statuses]
+        audio = sum(status["audio_sha256"] is not None for status in found)
+        text = sum(bool(status["verses"]) for status in found)
+        aligned = sum(status["aligned_sha256"] is not None for status in found)
+        name = testament.upper() if testament is not None else "Total"
+        rows.append(
+            f"{name:<10} {len(chapter_ids):>9} {audio:>9} {text:>9} {aligned:>9}"
+        )
+    print("\n".join(rows))
+
 
 def main():
     args = parser.parse_args()
+    if args.precision != "fp32" and args.backend != "eager":
+        parser.error("--backend only supports fp32 precision.")
     language = args.language
     output = args.output
     os.makedirs(output, exist_ok=True)
 
     if language is not None:
         # Check if language is valid.
-        language_match = next(
-            (item for item in mms_languages if item["iso"] == language), None
-        )
-
-        if language_match is None or not language_match["align"]:
+        if not can_align(language):
             print("Provided language is not supported by mms.")
             exit(0)
 
@@ -118,22 +361,79 @@ def main():
         print("Translation not added to translations.json.")
         exit(0)
 
-    model, dictionary = load_model()
+    if b_match["source"] not in ("bb", "dbl"):
+        print("Invalid source")
+        exit(0)
 
+    chapters = []
     for chapter_id in bible_chapters:
         chapter_info = get_chapter_info(chapter_id, output)
 
         b_ids = b_match["nt"] if chapter_info["testament"] == "nt" else b_match["ot"]
         if b_ids is None:
             continue
+        chapters.append((chapter_info, b_ids))
 
-        os.makedirs(chapter_info["paths"]["book"], exist_ok=True)
+    state = ChapterState(output)
+    if args.command == "status":
+        print_status([chapter_info for chapter_info, _ in chapters], state)
+        return
 
-        get_audio(chapter_info, b_match["source"], b_ids["audio"])
+    # Skip chapters that are already aligned without opening their files.
+    aligned = state.get_aligned(
+        {
+            chapter_info["chapter_id"]: chapter_info["paths"]["text"]
+            for chapter_info, _ in chapters
+        }
+    )
+    if aligned:
+        Halo().info(f"Skipping {len(aligned)} chapters that are already aligned.")
+        chapters = [
+            (chapter_info, b_ids)
+            for chapter_info, b_ids in chapters
+            if chapter_info["chapter_id"] not in aligned
+        ]
+
+    from emission_cache import EmissionCache
 
-        get_text(chapter_info, b_match["source"], b_ids["text"])
+    emission_cache = (
+        EmissionCache(
+            args.cache_dir,
+            args.cache_size_mb,
+            model_name,
+            args.precision,
+            args.backend,
+        )
+        if args.cache_size_mb > 0
+        else None
+    )
+
+    emission_config = load_emission_config(args.batch_size, not args.no_tuning)
+
+    # Download the next few chapters while each one is aligned.
+    for chapter_info in prefetch_chapters(
+        chapters,
+        b_match["source"],
+        args.prefetch,
+        args.download_workers,
+        args.verify_audio,
+        state,
+    ):
+        # The model is only loaded for the first chapter and reused after that.
+        model, dictionary = load_model(args.precision, args.backend)
+        if get_timings(
+            language,
+            chapter_info,
+            model,
+            dictionary,
+            emission_config,
+            emission_cache,
+        ):
+            state.mark_aligned(chapter_info["chapter_id"], chapter_info["paths"]["text"])
 
-        get_timings(language, chapter_info, model, dictionary)
+    print(get_client().summary())
 
 
-main()
+# Only run when started directly, so the tests can import this module.
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Decode audio files to PCM samples without intermediate wav files.
+"""
+
+import re
+import subprocess
+import tempfile
+from dataclasses import dataclass
+
+import ffmpeg
+import numpy as np
+import torch
+
+SAMPLING_FREQ = 16000
+
+
+@dataclass
+class DecodedAudio:
+    """
+    Mono 16-bit PCM samples decoded from an audio file.
+    """
+
+    path: str
+    samples: np.ndarray  # int16, either in memory or memory-mapped
+    sample_rate: int
+
+    @property
+    def num_samples(self) -> int:
+        return len(self.samples)
+
+    @property
+    def duration(self) -> float:
+        """Duration in seconds."""
+        return self.num_samples / self.sample_rate
+
+    def array(self, start: int = 0, end: int | None = None) -> np.ndarray:
+        """
+        Get samples [start, end) as float32 in [-1, 1).
+        """
+        return self.samples[start:end].astype(np.float32) / 32768.0
+
+    def waveform(self, start: int = 0, end: int | None = None) -> torch.Tensor:
+        """
+        Get samples [start, end) as a 1 x T float32 tensor, the same layout
+        `torchaudio.load` returns for a mono file.
+        """
+        return torch.from_numpy(self.array(start, end)).unsqueeze(0)
+
+
+def decode_audio(
+    path: str,
+    sample_rate: int = SAMPLING_FREQ,
+    start: float = 0,
+    duration: float | None = None,
+    low_memory: bool = False,
+) -> DecodedAudio:
+    """
+    Decode an audio file to mono PCM at `sample_rate` by reading ffmpeg's
+    stdout. `start` and `duration` (in seconds) can be used to only decode
+    part of the file.
+
+    By default the samples are kept in memory. With `low_memory`, they are
+    streamed to an anonymous temporary file and memory-mapped instead, so
+    only the parts being worked on need to be resident.
+    """
+    input_args = {}
+    if start > 0:
+        input_args["ss"] = start
+    if duration is not None:
+        input_args["t"] = duration
+
+    stream = ffmpeg.input(path, **input_args)
+    stream = ffmpeg.output(
+        stream, "pipe:", format="s16le", acodec="pcm_s16le", ac=1, ar=sample_rate
+    )
+
+    if not low_memory:
+        out, _ = ffmpeg.run(
+            stream,
+            capture_stdout=True,
+            cmd=["ffmpeg", "-loglevel", "error"],  # type: ignore
+        )
+        samples = np.frombuffer(out, dtype=np.int16)
+    else:
+        process = ffmpeg.run_async(
+            stream,
+            pipe_stdout=True,
+            pipe_stderr=True,
+            cmd=["ffmpeg", "-loglevel", "error"],  # type: ignore
+        )
+        # The file is unlinked as soon as it's closed, the mapping keeps the
+        # data alive until the samples are garbage collected.
+        with tempfile.TemporaryFile() as pcm_file:
+            try:
+                for chunk in iter(lambda: process.stdout.read(1024 * 1024), b""):
+                    pcm_file.write(chunk)
+                # Only errors are logged, so stderr is small enough to read
+                # once stdout is done.
+                err = process.stderr.read()
+                if process.wait() != 0:
+                    raise ffmpeg.Error("ffmpeg", None, err)
+            finally:
+                # Don't leave ffmpeg running if reading or writing failed.
+                process.kill()
+                process.wait()
+                process.stdout.close()
+                process.stderr.close()
+            pcm_file.flush()
+            num_samples = pcm_file.tell() // 2
+            samples = (
+                np.memmap(pcm_file, dtype=np.int16, mode="r", shape=(num_samples,))
+                if num_samples
+                else np.zeros(0, dtype=np.int16)
+            )
+
+    return DecodedAudio(path=path, samples=samples, sample_rate=sample_rate)
+
+
+def probe_duration(path: str) -> float:
+    """
+    Get an audio file's duration in seconds from its headers, without
+    decoding it. Uses `ffmpeg -i` rather than ffprobe, which isn't always
+    installed alongside ffmpeg. Raises if ffmpeg can't read the file.
+    """
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-i", path],
+        capture_output=True,
+        text=True,
+    )
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if match is None:
+        raise ValueError(f"Can't read the duration of {path}.")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
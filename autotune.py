@@ -0,0 +1,247 @@
+"""
+Find the fastest emission settings for this machine and save them as its
+tuning profile, which `main.py` and `align_bible.py` then use automatically.
+Runs on synthetic audio with a randomly initialised model, which has the same
+architecture (and so the same speed) as the real one.
+
+Trying every combination would take hours on a CPU, so the settings are tuned
+one stage at a time, each stage keeping the best result of the one before:
+
+1. torch intra-op and inter-op threads, with the default window
+2. window length and context
+3. batch size
+
+    python autotune.py
+    python autotune.py --duration 300 --intervals 20 30 45 --batch-sizes 1 2 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import time
+
+import torch
+from halo import Halo
+
+from mms.align_utils import EMISSION_CONTEXT, EMISSION_INTERVAL
+from tuning import (
+    TUNING_DIR,
+    TuningProfile,
+    apply_threads,
+    get_profile_path,
+    save_profile,
+)
+
+
+def get_default_threads() -> list[int]:
+    cpu_count = os.cpu_count() or 1
+    threads = {cpu_count}
+    n = 1
+    while n < cpu_count:
+        threads.add(n)
+        n *= 2
+    return sorted(threads)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--duration",
+    help="Duration (in seconds) of the synthetic audio each setting is timed on.",
+    type=float,
+    default=120,
+)
+parser.add_argument(
+    "--threads",
+    help="torch intra-op thread counts to try. Default is powers of 2 up to the CPU count.",
+    nargs="+",
+    type=int,
+    default=get_default_threads(),
+)
+parser.add_argument(
+    "--interop-threads",
+    help="torch inter-op thread counts to try.",
+    nargs="+",
+    type=int,
+    default=[1, 2],
+)
+parser.add_argument(
+    "--intervals",
+    help="Window lengths (in seconds) to try.",
+    nargs="+",
+    type=float,
+    default=[15, 20, 30, 45, 60],
+)
+parser.add_argument(
+    "--contexts",
+    help="Context on each side of a window, as a fraction of its length, to try.",
+    nargs="+",
+    type=float,
+    default=[0.05, 0.1, 0.2],
+)
+parser.add_argument(
+    "--min-context",
+    help=(
+        "The smallest context the profile may use. Less context is always faster "
+        f"but makes emissions near window edges less accurate. Default is "
+        f"{EMISSION_CONTEXT}."
+    ),
+    type=float,
+    default=EMISSION_CONTEXT,
+)
+parser.add_argument(
+    "--batch-sizes",
+    help="Batch sizes to try.",
+    nargs="+",
+    type=int,
+    default=[1, 2, 4, 8],
+)
+parser.add_argument(
+    "--seed",
+    help="Seed for the random model weights and synthetic audio.",
+    type=int,
+    default=0,
+)
+parser.add_argument(
+    "-o",
+    "--output",
+    help=f"The folder to save the profile in. Default is `{TUNING_DIR}`.",
+    default=TUNING_DIR,
+)
+
+# (interval, context, batch size)
+Setting = tuple[float, float, int]
+
+
+def measure(
+    settings: list[Setting],
+    threads: int,
+    interop_threads: int,
+    duration: float,
+    seed: int,
+) -> list[float]:
+    """
+    Get the real-time factor of each setting. Runs in a fresh child process,
+    because inter-op threads can only be set before torch first uses them.
+    """
+    from mms.align_utils import EmissionConfig, generate_emissions
+    from synthetic import get_random_model, get_synthetic_audio
+
+    apply_threads(threads, interop_threads)
+    model = get_random_model(seed)
+    audio = get_synthetic_audio(duration, seed)
+
+    # Warm up so one-off allocations aren't counted against the first setting.
+    generate_emissions(model, get_synthetic_audio(5, seed))
+
+    real_time_factors = []
+    for interval, context, batch_size in settings:
+        start_time = time.perf_counter()
+        generate_emissions(model, audio, EmissionConfig(interval, context, batch_size))
+        real_time_factors.append((time.perf_counter() - start_time) / duration)
+    return real_time_factors
+
+
+def main():
+    args = parser.parse_args()
+    if args.duration < max(args.intervals):
+        parser.error("--duration must be at least as long as the longest interval.")
+    if not any(context >= args.min_context for context in args.contexts):
+        parser.error("At least one of --contexts must be at least --min-context.")
+
+    # Fork before torch has done anything so every child can set its threads.
+    mp_context = multiprocessing.get_context("fork")
+    results = []
+
+    def run(stage: str, settings: list[Setting], threads: int, interop_threads: int):
+        spinner = Halo(f"Tuning {stage}...").start()
+        with mp_context.Pool(1) as pool:
+            real_time_factors = pool.apply(
+                measure, (settings, threads, interop_threads, args.duration, args.seed)
+            )
+        spinner.stop()
+
+        stage_results = []
+        for (interval, context, batch_size), real_time_factor in zip(
+            settings, real_time_factors
+        ):
+            result = {
+                "stage": stage,
+                "threads": threads,
+                "interop_threads": interop_threads,
+                "interval": interval,
+                "context": context,
+                "batch_size": batch_size,
+                "real_time_factor": real_time_factor,
+            }
+            Halo().succeed(
+                f"{threads} threads, {interop_threads} inter-op, {interval:g}s "
+                f"windows, {context:g} context, batch size {batch_size}: "
+                f"RTF {real_time_factor:.3f}."
+            )
+            stage_results.append(result)
+        results.extend(stage_results)
+        return stage_results
+
+    # 1. Threads
+    threads_results = []
+    for threads in args.threads:
+        for interop_threads in args.interop_threads:
+            threads_results += run(
+                "threads",
+                [(EMISSION_INTERVAL, EMISSION_CONTEXT, 1)],
+                threads,
+                interop_threads,
+            )
+    best = min(threads_results, key=lambda result: result["real_time_factor"])
+    threads, interop_threads = best["threads"], best["interop_threads"]
+
+    # 2. Windows
+    window_results = run(
+        "windows",
+        [
+            (interval, context, 1)
+            for interval in args.intervals
+            for context in args.contexts
+        ],
+        threads,
+        interop_threads,
+    )
+    best = min(
+        (result for result in window_results if result["context"] >= args.min_context),
+        key=lambda result: result["real_time_factor"],
+    )
+    interval, context = best["interval"], best["context"]
+
+    # 3. Batch size
+    batch_results = run(
+        "batch size",
+        [(interval, context, batch_size) for batch_size in args.batch_sizes],
+        threads,
+        interop_threads,
+    )
+    best = min(batch_results, key=lambda result: result["real_time_factor"])
+
+    profile: TuningProfile = {
+        "host": socket.gethostname(),
+        "cpu_count": os.cpu_count() or 1,
+        "torch_version": str(torch.__version__),
+        "interval": interval,
+        "context": context,
+        "batch_size": best["batch_size"],
+        "threads": threads,
+        "interop_threads": interop_threads,
+        "real_time_factor": best["real_time_factor"],
+    }
+    save_profile(profile, args.output)
+
+    print(json.dumps({"results": results, "profile": profile}, indent=2))
+    Halo().succeed(
+        f"Saved profile to {get_profile_path(args.output)}: {threads} threads, "
+        f"{interop_threads} inter-op, {interval:g}s windows, {context:g} context, "
+        f"batch size {best['batch_size']} (RTF {best['real_time_factor']:.3f})."
+    )
+
+
+main()
@@ -0,0 +1,226 @@
+"""
+Inference backends for the alignment model. Every backend has the same call
+signature as the eager torchaudio model, `model(waveforms, lengths=None)`
+returning `(emissions, lengths)`, so `generate_emissions` works with any of
+them.
+
+Exported artifacts are cached on disk along with the checkpoint they were
+exported from, and each backend is checked against the eager model on a few
+fixed windows when it is first built.
+"""
+
+import json
+import os
+from typing import Any, Callable
+
+import torch
+from halo import Halo
+
+# The largest difference in emissions (logits) from the eager model a backend
+# is allowed to have.
+TOLERANCE = 1e-3
+
+
+def get_artifact_path(model_path: str, suffix: str) -> str:
+    """
+    Get the path a backend's artifact for a checkpoint is cached at, e.g.
+    `model.onnx` for `model.pt`.
+    """
+    return f"{os.path.splitext(model_path)[0]}.{suffix}"
+
+
+def get_check_windows() -> list[tuple[torch.Tensor, torch.Tensor | None]]:
+    """
+    Get the fixed (waveforms, lengths) inputs backends are checked on: a
+    single window, and a padded batch of windows of different lengths.
+    """
+    generator = torch.Generator().manual_seed(0)
+    waveforms = torch.randn(2, 5 * 16000, generator=generator) * 0.1
+    return [
+        (waveforms[:1], None),
+        (waveforms, torch.tensor([5 * 16000, 3 * 16000])),
+    ]
+
+
+def check_equivalence(model: Any, reference: Any) -> float:
+    """
+    Run the check windows through `model` and the eager `reference` model and
+    raise if their emissions differ by more than TOLERANCE. Returns the
+    largest difference.
+    """
+    max_diff = 0.0
+    with torch.inference_mode():
+        for waveforms, lengths in get_check_windows():
+            expected, expected_lengths = reference(waveforms, lengths)
+            actual, actual_lengths = model(waveforms, lengths)
+
+            if lengths is not None:
+                assert torch.equal(actual_lengths.cpu(), expected_lengths.cpu())
+                # Frames past each window's length are padding.
+                for j, length in enumerate(expected_lengths.tolist()):
+                    diff = (actual[j, :length].cpu() - expected[j, :length].cpu()).abs()
+                    max_diff = max(max_diff, diff.max().item())
+            else:
+                diff = (actual.cpu() - expected.cpu()).abs()
+                max_diff = max(max_diff, diff.max().item())
+
+    if max_diff > TOLERANCE:
+        raise ValueError(
+            f"Backend emissions differ from the eager model by {max_diff:.2e}."
+        )
+    return max_diff
+
+
+def read_signature(path: str) -> str | None:
+    try:
+        with open(f"{path}.json", encoding="utf-8") as f:
+            return json.load(f)["signature"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_signature(path: str, signature: str):
+    with open(f"{path}.json", "w", encoding="utf-8") as f:
+        json.dump({"signature": signature}, f)
+
+
+class OnnxModel:
+    """
+    An exported ONNX graph of the alignment model, run with ONNX Runtime on
+    the CPU. The session is created on first use in each process, since
+    ONNX Runtime's thread pool doesn't survive a fork.
+    """
+
+    device = torch.device("cpu")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._session = None
+        self._pid = None
+
+    def __getstate__(self):
+        return {"path": self.path, "_session": None, "_pid": None}
+
+    def get_session(self):
+        if self._session is None or self._pid != os.getpid():
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = torch.get_num_threads()
+            self._session = onnxruntime.InferenceSession(
+                self.path, options, providers=["CPUExecutionProvider"]
+            )
+            self._pid = os.getpid()
+        return self._session
+
+    def share_memory(self):
+        return self
+
+    def __call__(self, waveforms: torch.Tensor, lengths: torch.Tensor | None = None):
+        full_lengths = lengths
+        if full_lengths is None:
+            full_lengths = torch.full((waveforms.size(0),), waveforms.size(1))
+        emissions, out_lengths = self.get_session().run(
+            None,
+            {
+                "waveforms": waveforms.cpu().numpy(),
+                "lengths": full_lengths.to(torch.int64).cpu().numpy(),
+            },
+        )
+        return (
+            torch.from_numpy(emissions),
+            torch.from_numpy(out_lengths) if lengths is not None else None,
+        )
+
+
+def load_torchscript(path: str, signature: str, load: Callable[[], Any]):
+    """
+    Load the TorchScript model cached at `path`, or script the eager model
+    from `load` and save it there.
+    """
+    extra_files = {"signature": ""}
+    if os.path.exists(path):
+        model = torch.jit.load(path, map_location="cpu", _extra_files=extra_files)
+        if extra_files["signature"].decode("utf-8") == signature:
+            return model
+
+    spinner = Halo(text="Scripting model with TorchScript...").start()
+    reference = load()
+    model = torch.jit.script(reference)
+    spinner.text = "Checking TorchScript model against the eager model..."
+    max_diff = check_equivalence(model, reference)
+    torch.jit.save(model, path, _extra_files={"signature": signature})
+    spinner.succeed(f"TorchScript model saved to {path} (max diff {max_diff:.2e}).")
+    return model
+
+
+def load_onnx(path: str, signature: str, load: Callable[[], Any]):
+    """
+    Load the ONNX graph cached at `path`, or export the eager model from
+    `load` to it. Needs the `onnxruntime` (and, to export, `onnxscript`)
+    packages.
+    """
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        raise RuntimeError(
+            "The onnx backend needs onnxruntime: pip install onnxruntime onnxscript"
+        )
+
+    if os.path.exists(path) and read_signature(path) == signature:
+        return OnnxModel(path)
+
+    spinner = Halo(text="Exporting model to ONNX...").start()
+    reference = load()
+    waveforms, lengths = get_check_windows()[1]
+    batch = torch.export.Dim("batch")
+    samples = torch.export.Dim("samples")
+    torch.onnx.export(
+        reference,
+        (waveforms, lengths),
+        path,
+        input_names=["waveforms", "lengths"],
+        output_names=["emissions", "lengths_out"],
+        dynamic_shapes=({0: batch, 1: samples}, {0: batch}),
+        dynamo=True,
+    )
+    model = OnnxModel(path)
+    spinner.text = "Checking ONNX model against the eager model..."
+    max_diff = check_equivalence(model, reference)
+    write_signature(path, signature)
+    spinner.succeed(f"ONNX model saved to {path} (max diff {max_diff:.2e}).")
+    return model
+
+
+def compile_model(cache_dir: str, load: Callable[[], Any]):
+    """
+    Compile the eager model from `load` with `torch.compile`. Compiled
+    kernels are cached in `cache_dir`, which makes later runs compile much
+    faster.
+    """
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.abspath(cache_dir))
+
+    spinner = Halo(text="Compiling model...").start()
+    reference = load()
+    model = torch.compile(reference, dynamic=True)
+    max_diff = check_equivalence(model, reference)
+    spinner.succeed(f"Model compiled (max diff {max_diff:.2e}).")
+    return model
+
+
+def load_backend(backend: str, model_path: str, signature: str, load: Callable[[], Any]):
+    """
+    Get the alignment model from `load` (or its cached artifact) wrapped in
+    `backend`. `signature` identifies the checkpoint, so artifacts exported
+    from a different one (or with a different torch version) are rebuilt.
+    """
+    signature = f"{signature}:{torch.__version__}"
+    if backend == "torchscript":
+        return load_torchscript(
+            get_artifact_path(model_path, "torchscript.pt"), signature, load
+        )
+    elif backend == "onnx":
+        return load_onnx(get_artifact_path(model_path, "onnx"), signature, load)
+    elif backend == "compile":
+        return compile_model(get_artifact_path(model_path, "inductor"), load)
+    return load()
@@ -0,0 +1,189 @@
+"""
+Micro-batching of model calls across threads. `MicroBatcher` wraps the
+alignment model with the same `(waveforms, lengths) -> (emissions, lengths)`
+interface, so `generate_emissions` can use it unchanged, but calls made at
+about the same time from different threads (e.g. concurrent requests to the
+server) are padded into one batch and run through the model together.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any
+
+import torch
+
+from mms.align_utils import get_device, get_num_frames
+
+# How many of the most recent latencies percentiles are computed over.
+LATENCY_WINDOW = 1000
+
+
+class Latencies:
+    """
+    The most recent LATENCY_WINDOW latencies of something, in seconds.
+    """
+
+    def __init__(self):
+        self.values: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self.lock:
+            self.values.append(seconds)
+            self.count += 1
+
+    def summary(self) -> dict[str, float]:
+        """
+        Get the count, and the mean, median and 95th percentile in ms.
+        """
+        with self.lock:
+            values = sorted(self.values)
+            count = self.count
+        if not values:
+            return {"count": count}
+        return {
+            "count": count,
+            "mean_ms": sum(values) / len(values) * 1000,
+            "p50_ms": values[len(values) // 2] * 1000,
+            "p95_ms": values[min(len(values) - 1, int(len(values) * 0.95))] * 1000,
+        }
+
+
+@dataclass
+class BatchRequest:
+    waveforms: torch.Tensor
+    lengths: torch.Tensor | None
+    future: Future = field(default_factory=Future)
+    submitted: float = field(default_factory=time.perf_counter)
+
+
+class MicroBatcher:
+    """
+    Runs model calls from any number of threads on one background thread.
+    The first waiting call starts a batch, which then takes calls for up to
+    `max_wait_ms` or until it has `max_windows` windows. Windows are
+    zero-padded to the longest one and passed to the model with their
+    lengths, like `generate_emissions` does with a batch size above 1.
+    """
+
+    def __init__(self, model: Any, max_windows: int = 8, max_wait_ms: float = 10):
+        self.model = model
+        self.device = get_device(model)
+        self.max_windows = max_windows
+        self.max_wait = max_wait_ms / 1000
+        self.queue: queue.Queue[BatchRequest] = queue.Queue()
+        # A request that didn't fit in the last batch, which starts the next.
+        self.held: BatchRequest | None = None
+
+        self.batches = 0
+        self.windows = 0
+        self.wait_latencies = Latencies()
+        self.model_latencies = Latencies()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __call__(self, waveforms: torch.Tensor, lengths: torch.Tensor | None = None):
+        request = BatchRequest(waveforms, lengths)
+        self.queue.put(request)
+        return request.future.result()
+
+    def depth(self) -> int:
+        """
+        Get the number of calls waiting for a batch.
+        """
+        return self.queue.qsize() + (self.held is not None)
+
+    def next_batch(self) -> list[BatchRequest]:
+        if self.held is not None:
+            batch, self.held = [self.held], None
+        else:
+            batch = [self.queue.get()]
+        windows = batch[0].waveforms.size(0)
+        deadline = time.perf_counter() + self.max_wait
+        while windows < self.max_windows:
+            try:
+                request = self.queue.get(
+                    timeout=max(0, deadline - time.perf_counter())
+                )
+            except queue.Empty:
+                break
+            if windows + request.waveforms.size(0) > self.max_windows:
+                self.held = request
+                break
+            batch.append(request)
+            windows += request.waveforms.size(0)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            start_time = time.perf_counter()
+            for request in batch:
+                self.wait_latencies.add(start_time - request.submitted)
+            try:
+                results = self.run_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            finally:
+                self.model_latencies.add(time.perf_counter() - start_time)
+                self.batches += 1
+                self.windows += sum(request.waveforms.size(0) for request in batch)
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+
+    def run_batch(self, batch: list[BatchRequest]) -> list[tuple[Any, Any]]:
+        with torch.inference_mode():
+            if len(batch) == 1:
+                return [self.model(batch[0].waveforms, batch[0].lengths)]
+
+            rows = [row for request in batch for row in request.waveforms]
+            lengths = torch.cat(
+                [
+                    request.lengths
+                    if request.lengths is not None
+                    else torch.full(
+                        (request.waveforms.size(0),),
+                        request.waveforms.size(1),
+                        device=self.device,
+                    )
+                    for request in batch
+                ]
+            )
+            padded = torch.nn.utils.rnn.pad_sequence(rows, batch_first=True)
+            emissions, out_lengths = self.model(padded, lengths)
+
+        # Give each call back its own rows, cut to the frames the model would
+        # have output for its input alone.
+        results = []
+        start = 0
+        for request in batch:
+            end = start + request.waveforms.size(0)
+            num_frames = get_num_frames(request.waveforms.size(1))
+            results.append(
+                (
+                    emissions[start:end, :num_frames],
+                    out_lengths[start:end] if request.lengths is not None else None,
+                )
+            )
+            start = end
+        return results
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "queue_depth": self.depth(),
+            "batches": self.batches,
+            "windows": self.windows,
+            "mean_windows_per_batch": self.windows / self.batches
+            if self.batches
+            else 0,
+            "wait": self.wait_latencies.summary(),
+            "model": self.model_latencies.summary(),
+        }
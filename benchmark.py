@@ -0,0 +1,688 @@
+"""
+Benchmarks for the alignment pipeline. The model benchmarks use a randomly
+initialised MMS model and synthetic audio, so they run without downloading the
+checkpoint.
+
+    python benchmark.py pipeline --duration 600 --verses 30 --output run.json
+    python benchmark.py emissions --durations 600 3600 --batch-sizes 1 2 4 8
+    python benchmark.py memory --durations 600 3600
+    python benchmark.py precision -i ./input-dir -l eng
+    python benchmark.py backends --duration 600
+    python benchmark.py uroman -i ./input-dir -l eng
+    python benchmark.py normalize --lines 100000
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from halo import Halo
+
+from audio import decode_audio
+from backends import load_backend
+import tracing
+from mms.align_utils import (
+    EmissionConfig,
+    generate_emissions,
+    get_uroman,
+    romanize_lines,
+    romanize_lines_cli,
+)
+from mms.norm_config import norm_config
+from mms.text_normalization import Normalizer, text_normalize
+from model import BACKENDS, PRECISIONS, get_peak_rss_mb, get_rss_mb, load_model
+from synthetic import (
+    get_random_model,
+    get_synthetic_audio,
+    get_synthetic_corpus,
+    get_synthetic_dictionary,
+    write_synthetic_pair,
+    write_synthetic_wav,
+)
+from utils import align_match, match_files, read_lines, write_outputs
+
+parser = argparse.ArgumentParser()
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+pipeline_parser = subparsers.add_parser(
+    "pipeline",
+    help="Time every stage of aligning a synthetic audio and text pair.",
+)
+pipeline_parser.add_argument(
+    "--duration",
+    help="Duration (in seconds) of the synthetic audio.",
+    type=float,
+    default=600,
+)
+pipeline_parser.add_argument(
+    "--verses",
+    help="The number of verses in the synthetic text.",
+    type=int,
+    default=30,
+)
+pipeline_parser.add_argument(
+    "--runs",
+    help="How many times to run the pipeline. The first run includes one-off setup.",
+    type=int,
+    default=3,
+)
+pipeline_parser.add_argument(
+    "-l",
+    "--language",
+    help="The language to normalize and romanize the text as.",
+    default="eng",
+)
+pipeline_parser.add_argument(
+    "-b",
+    "--batch-size",
+    help="The number of windows to run through the model at once.",
+    type=int,
+    default=1,
+)
+pipeline_parser.add_argument(
+    "--chunk-seconds",
+    help="Align in chunks of about this many seconds (see main.py).",
+    type=float,
+    default=0,
+)
+pipeline_parser.add_argument(
+    "--seed",
+    help="Seed for the random model weights and synthetic audio and text.",
+    type=int,
+    default=0,
+)
+pipeline_parser.add_argument(
+    "-o",
+    "--output",
+    help="A file to write the JSON results to, so runs can be compared across commits.",
+    default=None,
+)
+
+emissions_parser = subparsers.add_parser(
+    "emissions", help="Compare emission throughput across batch sizes."
+)
+emissions_parser.add_argument(
+    "--durations",
+    help="Durations (in seconds) of the synthetic audio to benchmark.",
+    nargs="+",
+    type=float,
+    default=[600, 3600],
+)
+emissions_parser.add_argument(
+    "--batch-sizes",
+    help="Batch sizes to compare. The first one is the baseline for the diff.",
+    nargs="+",
+    type=int,
+    default=[1, 2, 4, 8],
+)
+emissions_parser.add_argument(
+    "--seed",
+    help="Seed for the random model weights and synthetic audio.",
+    type=int,
+    default=0,
+)
+
+memory_parser = subparsers.add_parser(
+    "memory",
+    help="Compare peak memory of the in-memory and --low-memory emission paths.",
+)
+memory_parser.add_argument(
+    "--durations",
+    help="Durations (in seconds) of the synthetic audio to benchmark.",
+    nargs="+",
+    type=float,
+    default=[600, 3600],
+)
+memory_parser.add_argument(
+    "--seed",
+    help="Seed for the random model weights and synthetic audio.",
+    type=int,
+    default=0,
+)
+
+backends_parser = subparsers.add_parser(
+    "backends", help="Compare the real-time factor of each inference backend."
+)
+backends_parser.add_argument(
+    "--backends",
+    help="The backends to compare. The first one is the baseline for the diff.",
+    nargs="+",
+    choices=BACKENDS,
+    default=BACKENDS,
+)
+backends_parser.add_argument(
+    "--duration",
+    help="Duration (in seconds) of the synthetic audio to benchmark.",
+    type=float,
+    default=600,
+)
+backends_parser.add_argument(
+    "--batch-size",
+    help="The number of windows to run through the model at once.",
+    type=int,
+    default=1,
+)
+backends_parser.add_argument(
+    "--seed",
+    help="Seed for the random model weights and synthetic audio.",
+    type=int,
+    default=0,
+)
+
+precision_parser = subparsers.add_parser(
+    "precision",
+    help=(
+        "Compare alignment speed and verse boundaries of the int8 model against "
+        "fp32. Uses the real model."
+    ),
+)
+precision_parser.add_argument(
+    "-i",
+    "--input",
+    help="The path to a folder containing audio and text files.",
+    required=True,
+)
+precision_parser.add_argument(
+    "-l",
+    "--language",
+    help="The language of the text and audio files.",
+    default="eng",
+)
+precision_parser.add_argument(
+    "-s",
+    "--separator",
+    help="The separator used in the text files.",
+    default="lineBreak",
+)
+
+uroman_parser = subparsers.add_parser(
+    "uroman",
+    help="Check the in-process uroman engine against the uroman CLI.",
+)
+uroman_parser.add_argument(
+    "-i",
+    "--input",
+    help="The path to a folder containing text files.",
+    required=True,
+)
+uroman_parser.add_argument(
+    "-l",
+    "--language",
+    help="The language of the text files.",
+    default="eng",
+)
+uroman_parser.add_argument(
+    "-s",
+    "--separator",
+    help="The separator used in the text files.",
+    default="lineBreak",
+)
+
+normalize_parser = subparsers.add_parser(
+    "normalize",
+    help="Time text normalization for every language in norm_config.",
+)
+normalize_parser.add_argument(
+    "--corpus",
+    help="A text file to normalize, one line per verse. Defaults to a synthetic corpus.",
+    default=None,
+)
+normalize_parser.add_argument(
+    "--lines",
+    help="The number of lines in the synthetic corpus.",
+    type=int,
+    default=100000,
+)
+normalize_parser.add_argument(
+    "--seed",
+    help="Seed for the synthetic corpus.",
+    type=int,
+    default=0,
+)
+
+def get_environment() -> dict:
+    """
+    Describe the code and machine a benchmark ran on.
+    """
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=repo,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = bool(
+            subprocess.run(
+                ["git", "status", "--porcelain", "--untracked-files=no"],
+                cwd=repo,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+
+    import torch
+
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "python": platform.python_version(),
+        "torch": str(torch.__version__),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "threads": torch.get_num_threads(),
+    }
+
+
+def run_pipeline(
+    match, output: str, model, dictionary, args: argparse.Namespace
+) -> dict[str, float]:
+    """
+    Align a match with `align_match`, write its outputs and total up the time
+    spent in each traced stage.
+    """
+    tracer = tracing.start_tracing()
+    with tracing.span("align_file"):
+        timestamps = align_match(
+            match,
+            args.language,
+            "lineBreak",
+            model,
+            dictionary,
+            -1,
+            EmissionConfig(batch_size=args.batch_size),
+            chunk_seconds=args.chunk_seconds,
+            spinner=Halo(enabled=False),
+        )
+    with tracing.span("write_outputs"):
+        write_outputs(output, match, timestamps)
+    tracing.tracer = None
+
+    timings: dict[str, float] = {}
+    for event in tracer.events:
+        timings[event["name"]] = timings.get(event["name"], 0) + event["dur"] / 1e6
+    timings["total"] = timings["align_file"] + timings["write_outputs"]
+    return timings
+
+
+def benchmark_pipeline(args: argparse.Namespace):
+    spinner = Halo("Building random model...").start()
+    model = get_random_model(args.seed)
+    dictionary = get_synthetic_dictionary()
+    spinner.succeed("Random model built.")
+
+    runs = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output = os.path.join(temp_dir, "output")
+        os.makedirs(output)
+        match = write_synthetic_pair(
+            temp_dir, "GEN.1", args.duration, args.verses, args.seed
+        )
+
+        for run in range(args.runs):
+            spinner = Halo(f"Run {run + 1} of {args.runs}...").start()
+            timings = run_pipeline(match, output, model, dictionary, args)
+            runs.append(timings)
+            spinner.succeed(
+                f"Run {run + 1}: {timings['total']:.2f}s "
+                f"(RTF {timings['total'] / args.duration:.3f}), "
+                + ", ".join(
+                    f"{stage} {seconds:.2f}s"
+                    for stage, seconds in timings.items()
+                    if stage not in ("total", "align_file", "emission_window")
+                )
+            )
+
+    median = {stage: statistics.median(run[stage] for run in runs) for stage in runs[0]}
+    results = {
+        "benchmark": "pipeline",
+        "environment": get_environment(),
+        "parameters": {
+            "duration": args.duration,
+            "verses": args.verses,
+            "language": args.language,
+            "batch_size": args.batch_size,
+            "chunk_seconds": args.chunk_seconds,
+            "seed": args.seed,
+        },
+        "runs": runs,
+        "median": median,
+        "real_time_factor": median["total"] / args.duration,
+    }
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        Halo().succeed(f"Results written to {args.output}.")
+    print(json.dumps(results, indent=2))
+
+
+def benchmark_emissions(args: argparse.Namespace):
+    model = get_random_model(args.seed)
+    results = []
+
+    for duration in args.durations:
+        audio = get_synthetic_audio(duration, args.seed)
+        baseline = None
+
+        for batch_size in args.batch_sizes:
+            spinner = Halo(
+                f"{duration:.0f}s of audio, batch size {batch_size}..."
+            ).start()
+            start_time = time.perf_counter()
+            emissions, _ = generate_emissions(
+                model, audio, EmissionConfig(batch_size=batch_size)
+            )
+            elapsed = time.perf_counter() - start_time
+
+            if baseline is None:
+                baseline = emissions
+            max_diff = (emissions - baseline).abs().max().item()
+
+            results.append(
+                {
+                    "duration": duration,
+                    "batch_size": batch_size,
+                    "seconds": elapsed,
+                    "real_time_factor": elapsed / duration,
+                    "max_abs_diff": max_diff,
+                }
+            )
+            spinner.succeed(
+                f"{duration:.0f}s of audio, batch size {batch_size}: "
+                f"{elapsed:.2f}s (RTF {elapsed / duration:.3f}, "
+                f"max diff {max_diff:.2e})."
+            )
+
+    print(json.dumps(results, indent=2))
+
+
+def measure_emissions_memory(path: str, low_memory: bool, seed: int) -> dict:
+    # Runs in a fresh child process so that the peak RSS only covers this run.
+    model = get_random_model(seed)
+    model_rss = get_rss_mb()
+
+    start_time = time.perf_counter()
+    audio = decode_audio(path, low_memory=low_memory)
+    emissions, _ = generate_emissions(model, audio)
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "model_rss_mb": model_rss,
+        "peak_rss_mb": get_peak_rss_mb(),
+        "emissions_mb": emissions.numel() * emissions.element_size() / 1024**2,
+        "seconds": elapsed,
+    }
+
+
+def benchmark_memory(args: argparse.Namespace):
+    # Fork before the model is loaded so every child starts from the same
+    # small baseline.
+    context = multiprocessing.get_context("fork")
+    results = []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for duration in args.durations:
+            path = os.path.join(temp_dir, f"{duration:.0f}.wav")
+            write_synthetic_wav(path, duration, args.seed)
+
+            for low_memory in (False, True):
+                mode = "low memory" if low_memory else "in memory"
+                spinner = Halo(f"{duration:.0f}s of audio, {mode}...").start()
+                with context.Pool(1) as pool:
+                    result = pool.apply(
+                        measure_emissions_memory, (path, low_memory, args.seed)
+                    )
+                results.append(
+                    {"duration": duration, "low_memory": low_memory, **result}
+                )
+                spinner.succeed(
+                    f"{duration:.0f}s of audio, {mode}: peak "
+                    f"{result['peak_rss_mb']:.0f} MB "
+                    f"({result['peak_rss_mb'] - result['model_rss_mb']:.0f} MB "
+                    f"above the model), {result['seconds']:.2f}s."
+                )
+
+    print(json.dumps(results, indent=2))
+
+
+def measure_backend(
+    backend: str, artifact_dir: str, args: argparse.Namespace
+) -> tuple[dict, np.ndarray]:
+    # Runs in a child process so only one backend's model is in memory at once.
+    start_time = time.perf_counter()
+    model = load_backend(
+        backend,
+        os.path.join(artifact_dir, "model.pt"),
+        f"random:{args.seed}",
+        lambda: get_random_model(args.seed),
+    )
+    setup_time = time.perf_counter() - start_time
+
+    audio = get_synthetic_audio(args.duration, args.seed)
+    start_time = time.perf_counter()
+    emissions, _ = generate_emissions(
+        model, audio, EmissionConfig(batch_size=args.batch_size)
+    )
+    elapsed = time.perf_counter() - start_time
+
+    result = {
+        "backend": backend,
+        "setup_seconds": setup_time,
+        "seconds": elapsed,
+        "real_time_factor": elapsed / args.duration,
+    }
+    return result, emissions.cpu().numpy()
+
+
+def benchmark_backends(args: argparse.Namespace):
+    context = multiprocessing.get_context("fork")
+    results = []
+    baseline = None
+
+    with tempfile.TemporaryDirectory() as artifact_dir:
+        for backend in args.backends:
+            with context.Pool(1) as pool:
+                result, emissions = pool.apply(
+                    measure_backend, (backend, artifact_dir, args)
+                )
+
+            if baseline is None:
+                baseline = emissions
+            result["max_abs_diff"] = float(np.abs(emissions - baseline).max())
+            results.append(result)
+            Halo().succeed(
+                f"{backend}: RTF {result['real_time_factor']:.3f} "
+                f"(setup {result['setup_seconds']:.1f}s, "
+                f"max diff {result['max_abs_diff']:.2e})."
+            )
+
+    print(json.dumps(results, indent=2))
+
+
+def benchmark_precision(args: argparse.Namespace):
+    files = [
+        (file_name, os.path.abspath(os.path.join(dirpath, file_name)))
+        for dirpath, _, filenames in os.walk(args.input)
+        for file_name in filenames
+    ]
+    matches = [
+        match
+        for match in match_files(files)
+        if match[0] is not None and match[1] is not None
+    ]
+    results = []
+
+    # Load uroman and both models, and align the first file once with each
+    # precision untimed, so neither precision pays for first-use setup.
+    get_uroman()
+    if matches:
+        for precision in PRECISIONS:
+            model, dictionary = load_model(precision)
+            align_match(
+                matches[0], args.language, args.separator, model, dictionary, -1
+            )
+
+    for match in matches:
+        assert match[0] is not None
+        audio = decode_audio(match[0][1])
+        timings = {}
+        seconds = {}
+
+        for precision in PRECISIONS:
+            model, dictionary = load_model(precision)
+            start_time = time.perf_counter()
+            timestamps = align_match(
+                match, args.language, args.separator, model, dictionary, -1, audio=audio
+            )
+            seconds[precision] = time.perf_counter() - start_time
+            timings[precision] = np.array(
+                [section["timings"] for section in timestamps["sections"]]
+            )
+
+        # How far each verse start and end moved, in ms.
+        shifts = np.abs(timings["int8"] - timings["fp32"]).ravel() * 1000
+        if not len(shifts):
+            shifts = np.zeros(1)
+        result = {
+            "file": match[0][0],
+            "duration": audio.duration,
+            "verses": len(timings["fp32"]),
+            "fp32_seconds": seconds["fp32"],
+            "int8_seconds": seconds["int8"],
+            "speedup": seconds["fp32"] / seconds["int8"],
+            "mean_shift_ms": float(shifts.mean()),
+            "p95_shift_ms": float(np.percentile(shifts, 95)),
+            "max_shift_ms": float(shifts.max()),
+        }
+        results.append(result)
+        Halo().succeed(
+            f"{match[0][0]}: {result['speedup']:.2f}x faster, boundaries moved "
+            f"{result['mean_shift_ms']:.0f}ms on average "
+            f"({result['max_shift_ms']:.0f}ms max)."
+        )
+
+    print(json.dumps(results, indent=2))
+
+
+def benchmark_uroman(args: argparse.Namespace):
+    cli_time = 0.0
+    python_time = 0.0
+    lines_checked = 0
+    mismatches = []
+
+    for dirpath, _, filenames in os.walk(args.input):
+        for file_name in sorted(filenames):
+            if file_name.split(".")[-1] not in ("txt", "usfm"):
+                continue
+            lines = [
+                text_normalize(line.strip(), args.language)
+                for line in read_lines(
+                    file_name, os.path.join(dirpath, file_name), args.separator
+                )
+            ]
+
+            start_time = time.perf_counter()
+            cli_lines = romanize_lines_cli(lines, args.language)
+            cli_time += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            python_lines = romanize_lines(lines, args.language)
+            python_time += time.perf_counter() - start_time
+
+            lines_checked += len(lines)
+            for line, cli_line, python_line in zip(lines, cli_lines, python_lines):
+                if cli_line != python_line:
+                    mismatches.append(
+                        {
+                            "file": file_name,
+                            "text": line,
+                            "cli": cli_line,
+                            "python": python_line,
+                        }
+                    )
+            if len(cli_lines) != len(python_lines):
+                mismatches.append({"file": file_name, "error": "line count differs"})
+
+    print(
+        json.dumps(
+            {
+                "lines": lines_checked,
+                "cli_seconds": cli_time,
+                "python_seconds": python_time,
+                "mismatches": mismatches,
+            },
+            indent=2,
+            ensure_ascii=False,
+        )
+    )
+    if mismatches:
+        exit(1)
+
+
+def benchmark_normalize(args: argparse.Namespace):
+    if args.corpus is not None:
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus = [line.strip() for line in f]
+    else:
+        corpus = get_synthetic_corpus(args.lines, args.seed)
+
+    results = []
+    for iso_code in norm_config:
+        start_time = time.perf_counter()
+        normalizer = Normalizer(iso_code)
+        build_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        for line in corpus:
+            normalizer.normalize(line)
+        elapsed = time.perf_counter() - start_time
+
+        results.append(
+            {
+                "iso": iso_code,
+                "lines": len(corpus),
+                "build_seconds": build_time,
+                "seconds": elapsed,
+                "lines_per_second": len(corpus) / elapsed,
+            }
+        )
+        Halo().succeed(
+            f"{iso_code}: {len(corpus) / elapsed:,.0f} lines/s "
+            f"(built in {build_time * 1000:.1f}ms)."
+        )
+
+    print(json.dumps(results, indent=2))
+
+
+def main():
+    args = parser.parse_args()
+
+    if args.command == "pipeline":
+        benchmark_pipeline(args)
+    elif args.command == "emissions":
+        benchmark_emissions(args)
+    elif args.command == "memory":
+        benchmark_memory(args)
+    elif args.command == "backends":
+        benchmark_backends(args)
+    elif args.command == "precision":
+        benchmark_precision(args)
+    elif args.command == "uroman":
+        benchmark_uroman(args)
+    elif args.command == "normalize":
+        benchmark_normalize(args)
+
+
+main()
@@ -1,14 +1,12 @@
 import json
 import os
 import time
-import urllib.request
 from typing import Any, Union
 
-import ffmpeg
 from halo import Halo
 
-from constants import NT_BOOKS
-from mms.align_utils import get_alignments, get_spans, get_uroman_tokens
+from constants import NT_BOOKS, bb_api_url, dbl_api_url, yv_api_url
+from http_client import get_client
 from mms.text_normalization import text_normalize
 from timestamp_types import ChapterInfo, ChapterText, Verse
 
@@ -33,6 +31,16 @@ def get_chapter_info(
     }
 
 
+def check_audio(path: str):
+    """
+    Check that a downloaded audio file can be read and isn't empty.
+    """
+    from audio import probe_duration
+
+    if probe_duration(path) <= 0:
+        raise ValueError(f"{path} has no audio.")
+
+
 def get_dbl_text(
     dbl_id: str,
     chapter_id: str,
@@ -61,22 +69,23 @@ def get_dbl_text(
                     }
                 )
 
-    spinner = Halo(
-        f"({chapter_id}) Getting text from dbl...",
-    ).start()
+    # Downloads run on background threads while a chapter is being aligned,
+    # so their spinners aren't started: only the aligning spinner animates,
+    # and the downloads just print how they went.
+    spinner = Halo()
 
     try:
-        req = urllib.request.Request(
-            "https://api.scripture.api.bible/v1"
+        json_response = get_client().get_json(
+            f"{dbl_api_url}"
             f"/bibles/{dbl_id}"
             f"/chapters/{chapter_id}"
             "?content-type=json&include-notes=false&include-titles=true"
             "&include-chapter-numbers=false&include-verse-numbers=true"
-            "&include-verse-spans=false"
+            "&include-verse-spans=false",
+            "dbl:text",
+            "dbl",
+            headers={"api-key": os.getenv("API_BIBLE_KEY", "")},
         )
-        req.add_header("api-key", os.getenv("API_BIBLE_KEY", ""))
-        resp = urllib.request.urlopen(req).read()
-        json_response = json.loads(resp.decode("utf-8"))
 
         # Iterate through reponse and add all text to an object.
         for verse_chunk in json_response["data"]["content"]:
@@ -99,22 +108,21 @@ def get_dbl_text(
         spinner.fail(f"({chapter_id}) Failed to get text from dbl. Error: {e}.")
         return
     spinner.succeed(f"({chapter_id}) Got text from dbl.")
-    json.dump(chapter_text, open(output, "w", encoding="utf-8"), indent=2)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(chapter_text, f, indent=2)
 
 
 def get_bb_text(bb_id: str, chapter_id: str, chapter_text: ChapterText, output: str):
-    spinner = Halo(
-        f"({chapter_id}) Getting text from bb...",
-    ).start()
+    spinner = Halo()
 
     book, chapter = chapter_id.split(".")
 
     try:
-        req = urllib.request.Request(
-            f"https://4.dbt.io/api/download/{bb_id}/{book}/{chapter}?&v=4&key={os.getenv('BIBLE_BRAIN_API_KEY', '')}"
+        json_response = get_client().get_json(
+            f"{bb_api_url}/download/{bb_id}/{book}/{chapter}?&v=4&key={os.getenv('BIBLE_BRAIN_API_KEY', '')}",
+            "bb:text",
+            "bb",
         )
-        resp = urllib.request.urlopen(req).read()
-        json_response = json.loads(resp.decode("utf-8"))
 
         for verse in json_response["data"]:
             verseId = f"{book}.{chapter}.{verse['verse_start']}"
@@ -135,28 +143,36 @@ def get_bb_text(bb_id: str, chapter_id: str, chapter_text: ChapterText, output:
         spinner.fail(f"({chapter_id}) Failed to get text from bb. Error: {e}.")
         return
     spinner.succeed(f"({chapter_id}) Got text from bb.")
-    json.dump(chapter_text, open(output, "w", encoding="utf-8"), indent=2)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(chapter_text, f, indent=2)
 
 
 def get_dbl_audio(dbl_id: str, chapter_id: str, output: str):
-    spinner = Halo(f"({chapter_id}) Getting audio from dbl...").start()
+    spinner = Halo()
 
     fetch_url = (
-        "https://api.scripture.api.bible/v1"
+        f"{dbl_api_url}"
         f"/audio-bibles/{dbl_id}"
         f"/chapters/{chapter_id}"
     )
 
     try:
-        req = urllib.request.Request(fetch_url)
-        req.add_header("api-key", os.getenv("API_BIBLE_KEY", ""))
-        resp = urllib.request.urlopen(req).read()
-        json_response = json.loads(resp.decode("utf-8"))
+        json_response = get_client().get_json(
+            fetch_url,
+            "dbl:audio",
+            "dbl",
+            headers={"api-key": os.getenv("API_BIBLE_KEY", "")},
+        )
     except Exception as e:
         spinner.fail(f"({chapter_id}) Failed to get audio from dbl. Error: {e}.")
         return
     try:
-        urllib.request.urlretrieve(json_response["data"]["resourceUrl"], output)
+        get_client().download(
+            json_response["data"]["resourceUrl"],
+            output,
+            "dbl:file",
+            verify=check_audio,
+        )
     except Exception as e:
         spinner.fail(f"({chapter_id}) Failed to download audio from dbl. Error: {e}.")
         return
@@ -165,26 +181,26 @@ def get_dbl_audio(dbl_id: str, chapter_id: str, output: str):
 
 
 def get_yv_audio(yv_id: str, chapter_id: str, output: str):
-    spinner = Halo(f"({chapter_id}) Getting audio from yv...").start()
+    spinner = Halo()
 
     fetch_url = (
-        "https://audio-bible.youversionapi.com/3.1/chapter.json"
+        f"{yv_api_url}/chapter.json"
         "?version_id="
         f"{yv_id}"
         f"&reference={chapter_id}"
     )
     try:
-        req = urllib.request.Request(fetch_url)
-        resp = urllib.request.urlopen(req).read()
-        json_response = json.loads(resp.decode("utf-8"))
+        json_response = get_client().get_json(fetch_url, "yv:audio", "yv")
     except Exception as e:
         spinner.fail(f"({chapter_id}) Failed to get audio from yv. Error: {e}.")
         return
 
     try:
-        urllib.request.urlretrieve(
+        get_client().download(
             f"https:{json_response['response']['data'][0]['download_urls']['format_mp3_32k']}",
             output,
+            "yv:file",
+            verify=check_audio,
         )
     except Exception as e:
         spinner.fail(f"({chapter_id}) Failed to download audio from yv. Error: {e}.")
@@ -193,19 +209,19 @@ def get_yv_audio(yv_id: str, chapter_id: str, output: str):
 
 
 def get_bb_audio(bb_id: str, chapter_id: str, output: str):
-    spinner = Halo(f"({chapter_id}) Getting audio from bb...").start()
+    spinner = Halo()
     book, chapter = chapter_id.split(".")
-    fetch_url = f"https://4.dbt.io/api/download/{bb_id}/{book}/{chapter}?&v=4&key={os.getenv('BIBLE_BRAIN_API_KEY', '')}"
+    fetch_url = f"{bb_api_url}/download/{bb_id}/{book}/{chapter}?&v=4&key={os.getenv('BIBLE_BRAIN_API_KEY', '')}"
     try:
-        req = urllib.request.Request(fetch_url)
-        resp = urllib.request.urlopen(req).read()
-        json_response = json.loads(resp.decode("utf-8"))
+        json_response = get_client().get_json(fetch_url, "bb:audio", "bb")
     except Exception as e:
         spinner.fail(f"({chapter_id}) Failed to get audio from bb. Error: {e}.")
         return
 
     try:
-        urllib.request.urlretrieve(json_response["data"][0]["path"], output)
+        get_client().download(
+            json_response["data"][0]["path"], output, "bb:file", verify=check_audio
+        )
     except Exception as e:
         spinner.fail(f"({chapter_id}) Failed to download audio from bb. Error: {e}.")
         return
@@ -217,14 +233,27 @@ def get_timings(
     chapter_info: ChapterInfo,
     model: Any,
     dictionary: Any,
-):
+    emission_config: Any = None,
+    emission_cache: Any = None,
+) -> bool:
+    """
+    Align a chapter's audio and text, adding the timings to its text file.
+    Returns whether the chapter has timings, either already or now.
+    """
+    from audio import decode_audio
+    from mms.align_utils import (
+        get_alignments,
+        get_spans,
+        get_uroman_tokens,
+    )
+
     spinner = Halo(text=f"({chapter_info['chapter_id']}) Aligning...").start()
 
     if not os.path.exists(chapter_info["paths"]["text"]):
         spinner.fail(
             f"({chapter_info['chapter_id']}) No text file found. Skipping alignment."
         )
-        return
+        return False
 
     chapter_text: ChapterText = json.load(
         open(chapter_info["paths"]["text"], encoding="utf-8")
@@ -234,30 +263,20 @@ def get_timings(
         spinner.fail(
             f"({chapter_info['chapter_id']}) Text file exists but has no bible text. Skipping alignment."
         )
-        return
+        return False
     elif chapter_text["verses"][0].get("timings") is not None:
         spinner.info(
             f"({chapter_info['chapter_id']}) Timing data already exists. Skipping."
         )
-        return
+        return True
     elif not os.path.exists(chapter_info["paths"]["audio"]):
         spinner.fail(
             f"({chapter_info['chapter_id']}) No audio found. Skipping alignment."
         )
-        return
+        return False
 
-    audio_type = chapter_info["paths"]["audio"].split(".")[-1]
-    wav_output = chapter_info["paths"]["audio"].replace(f".{audio_type}", "_output.wav")
-    spinner.text = f"({chapter_info['chapter_id']}) Converting audio to wav..."
-
-    stream = ffmpeg.input(chapter_info["paths"]["audio"])
-    stream = ffmpeg.output(stream, wav_output, acodec="pcm_s16le", ar=16000)
-    stream = ffmpeg.overwrite_output(stream)
-    ffmpeg.run(
-        stream,
-        overwrite_output=True,
-        cmd=["ffmpeg", "-loglevel", "error"],  # type: ignore
-    )
+    spinner.text = f"({chapter_info['chapter_id']}) Decoding audio..."
+    audio = decode_audio(chapter_info["paths"]["audio"])
 
     spinner.text = f"({chapter_info['chapter_id']}) Normalizing text..."
     lines_to_timestamp = []
@@ -276,10 +295,12 @@ def get_timings(
     spinner.text = f"({chapter_info['chapter_id']}) Aligning..."
 
     segments, stride = get_alignments(
-        wav_output,
+        audio,
         uroman_lines_to_timestamp,
         model,
         dictionary,
+        emission_config,
+        emission_cache,
     )
 
     spans = get_spans(uroman_lines_to_timestamp, segments)
@@ -302,13 +323,8 @@ def get_timings(
         )
         matching_verse["uroman"] = uroman_lines_to_timestamp[i]
 
-    json.dump(
-        chapter_text,
-        open(chapter_info["paths"]["text"], "w", encoding="utf-8"),
-        indent=2,
-    )
+    with open(chapter_info["paths"]["text"], "w", encoding="utf-8") as f:
+        json.dump(chapter_text, f, indent=2)
 
-    spinner.text = f"({chapter_info['chapter_id']}) Cleaning up..."
-    spinner.start()
-    os.remove(wav_output)
     spinner.succeed(f"({chapter_info['chapter_id']}) Aligned.")
+    return True
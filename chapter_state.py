@@ -0,0 +1,177 @@
+"""
+An index of how far each chapter of a bible has got (audio downloaded, text
+downloaded, aligned), kept in a small SQLite database in the output folder.
+`align_bible.py` uses it to skip finished chapters on a restart without
+opening their files, and to report progress. A stage is only trusted while
+the file it produced is still there and unchanged.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import TypedDict
+
+STATE_NAME = "state.sqlite3"
+
+
+# The stages a chapter goes through, each recorded with the sha256, size and
+# modification time of the file it produced.
+STAGES = ["audio", "text", "aligned"]
+
+
+class ChapterStatus(TypedDict):
+    chapter_id: str
+    audio_sha256: str | None
+    audio_size: int | None
+    audio_mtime_ns: int | None
+    text_sha256: str | None
+    text_size: int | None
+    text_mtime_ns: int | None
+    verses: int | None
+    aligned_sha256: str | None
+    aligned_size: int | None
+    aligned_mtime_ns: int | None
+    updated_at: float
+
+
+class ChapterState:
+    """
+    The state index of an output folder. Each stage records the file it
+    produced: the audio, the downloaded text, and the text with timings once
+    the chapter is aligned. It is safe to use from the download threads and
+    the aligning thread at the same time.
+    """
+
+    def __init__(self, output: str):
+        self.path = os.path.join(output, STATE_NAME)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chapters (
+                    chapter_id TEXT PRIMARY KEY,
+                    audio_sha256 TEXT,
+                    audio_size INTEGER,
+                    audio_mtime_ns INTEGER,
+                    text_sha256 TEXT,
+                    text_size INTEGER,
+                    text_mtime_ns INTEGER,
+                    verses INTEGER,
+                    aligned_sha256 TEXT,
+                    aligned_size INTEGER,
+                    aligned_mtime_ns INTEGER,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, chapter_id: str, **values):
+        columns = ", ".join(values)
+        placeholders = ", ".join("?" for _ in values)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in values)
+        with self.lock, self.connection:
+            self.connection.execute(
+                f"""
+                INSERT INTO chapters (chapter_id, {columns}, updated_at)
+                VALUES (?, {placeholders}, ?)
+                ON CONFLICT (chapter_id) DO UPDATE SET
+                    {updates}, updated_at = excluded.updated_at
+                """,
+                (chapter_id, *values.values(), time.time()),
+            )
+
+    def mark(self, chapter_id: str, stage: str, path: str, **values):
+        # emission_cache pulls in torch.
+        from emission_cache import hash_file
+
+        stat = os.stat(path)
+        self.update(
+            chapter_id,
+            **{
+                f"{stage}_sha256": hash_file(path),
+                f"{stage}_size": stat.st_size,
+                f"{stage}_mtime_ns": stat.st_mtime_ns,
+            },
+            **values,
+        )
+
+    def mark_audio(self, chapter_id: str, path: str):
+        self.mark(chapter_id, "audio", path)
+
+    def mark_text(self, chapter_id: str, path: str, verses: int):
+        self.mark(chapter_id, "text", path, verses=verses)
+
+    def mark_aligned(self, chapter_id: str, path: str):
+        self.mark(chapter_id, "aligned", path)
+
+    def clear(self, chapter_id: str, *stages: str):
+        """
+        Forget that the chapter got through `stages`, so they are redone.
+        """
+        values: dict[str, None] = {}
+        for stage in stages:
+            values.update(
+                {f"{stage}_{field}": None for field in ["sha256", "size", "mtime_ns"]}
+            )
+            if stage == "text":
+                values["verses"] = None
+        self.update(chapter_id, **values)
+
+    def is_current(self, status: ChapterStatus, stage: str, path: str) -> bool:
+        """
+        Check that the file a stage recorded is still at `path` and unchanged:
+        the same size and modification time, or if only the modification time
+        changed, the same sha256.
+        """
+        sha256 = status[f"{stage}_sha256"]  # type: ignore
+        if sha256 is None:
+            return False
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if stat.st_size != status[f"{stage}_size"]:  # type: ignore
+            return False
+        if stat.st_mtime_ns == status[f"{stage}_mtime_ns"]:  # type: ignore
+            return True
+
+        from emission_cache import hash_file
+
+        if hash_file(path) != sha256:
+            return False
+        self.update(status["chapter_id"], **{f"{stage}_mtime_ns": stat.st_mtime_ns})
+        return True
+
+    def get(self, chapter_id: str) -> ChapterStatus | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM chapters WHERE chapter_id = ?", (chapter_id,)
+            ).fetchone()
+        return dict(row) if row is not None else None  # type: ignore
+
+    def get_all(self) -> dict[str, ChapterStatus]:
+        with self.lock:
+            rows = self.connection.execute("SELECT * FROM chapters").fetchall()
+        return {row["chapter_id"]: dict(row) for row in rows}  # type: ignore
+
+    def get_aligned(self, text_paths: dict[str, str]) -> set[str]:
+        """
+        Get the ids of the chapters that have been aligned, out of those in
+        `text_paths` (chapter id to text file). Chapters whose text file has
+        been removed or changed since are cleared, so they are aligned again.
+        """
+        aligned = set()
+        for chapter_id, status in self.get_all().items():
+            if status["aligned_sha256"] is None or chapter_id not in text_paths:
+                continue
+            if self.is_current(status, "aligned", text_paths[chapter_id]):
+                aligned.add(chapter_id)
+            else:
+                self.clear(chapter_id, "aligned")
+        return aligned
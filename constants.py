@@ -1,8 +1,9 @@
 import json
+import os
 
 from dotenv import load_dotenv
 
-from timestamp_types import MmsLanguage, Translation
+from timestamp_types import Translation
 
 model_name = "ctc_alignment_mling_uroman_model.pt"
 model_url = (
@@ -10,6 +11,7 @@ model_url = (
 )
 dict_name = "ctc_alignment_mling_uroman_model.dict"
 dict_url = "https://dl.fbaipublicfiles.com/mms/torchaudio/ctc_alignment_mling_uroman/dictionary.txt"
+lid_model_id = "facebook/mms-lid-4017"
 
 NT_BOOKS = [
     "MAT",
@@ -43,13 +45,15 @@ NT_BOOKS = [
 
 load_dotenv()
 
+# Base URLs of the bible APIs. They can be pointed somewhere else, e.g. a local
+# stand-in server for testing, with these environment variables.
+bb_api_url = os.getenv("BB_API_URL", "https://4.dbt.io/api")
+dbl_api_url = os.getenv("DBL_API_URL", "https://api.scripture.api.bible/v1")
+yv_api_url = os.getenv("YV_API_URL", "https://audio-bible.youversionapi.com/3.1")
+
 bible_chapters: list[str] = json.load(
     open("data/bible_chapters.json", encoding="utf-8")
 )
 translations: list[Translation] = json.load(
     open("data/translations.json", encoding="utf-8")
 )
-
-mms_languages: list[MmsLanguage] = json.load(
-    open("data/mms_languages.json", encoding="utf-8")
-)
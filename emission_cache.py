@@ -0,0 +1,161 @@
+"""
+On-disk cache of model emissions, so audio that has already been through the
+acoustic model can be re-aligned (e.g. against edited text or with different
+padding) without running the model again.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import torch
+
+from audio import DecodedAudio
+
+# Bump this whenever the layout of cached emissions changes.
+CACHE_VERSION = 3
+
+
+def hash_file(path: str) -> str:
+    """
+    Get the sha256 of a file's contents.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class EmissionCache:
+    """
+    Log-softmax emissions stored as float16 `.npy` files, keyed by a hash of
+    the audio, the model checkpoint, its precision and backend and the
+    windowing parameters. Once the cache grows past `max_size_mb`, the least
+    recently used entries are removed.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_size_mb: float,
+        model_path: str,
+        precision: str = "fp32",
+        backend: str = "eager",
+    ):
+        self.directory = directory
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.model_path = model_path
+        self.precision = precision
+        self.backend = backend
+        self._model_hash: str | None = None
+        os.makedirs(directory, exist_ok=True)
+
+    def get_model_hash(self) -> str:
+        """
+        Hash the model checkpoint. Hashing a 1 GB checkpoint takes a few
+        seconds, so the result is remembered per file size and mtime.
+        """
+        if self._model_hash is not None:
+            return self._model_hash
+
+        stat = os.stat(self.model_path)
+        signature = f"{os.path.abspath(self.model_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        hashes_path = os.path.join(self.directory, "checkpoints.json")
+
+        hashes: dict[str, str] = {}
+        if os.path.exists(hashes_path):
+            with open(hashes_path, encoding="utf-8") as f:
+                hashes = json.load(f)
+
+        if signature not in hashes:
+            hashes[signature] = hash_file(self.model_path)
+            self._write_atomic(
+                hashes_path, lambda f: f.write(json.dumps(hashes).encode("utf-8"))
+            )
+
+        self._model_hash = hashes[signature]
+        return self._model_hash
+
+    def get_key(self, audio: DecodedAudio, interval: float, context: float) -> str:
+        sha = hashlib.sha256()
+        sha.update(memoryview(np.ascontiguousarray(audio.samples)))
+        sha.update(
+            json.dumps(
+                {
+                    "version": CACHE_VERSION,
+                    "model": self.get_model_hash(),
+                    "precision": self.precision,
+                    "backend": self.backend,
+                    "sample_rate": audio.sample_rate,
+                    "interval": interval,
+                    "context": context,
+                },
+                sort_keys=True,
+            ).encode("utf-8")
+        )
+        return sha.hexdigest()
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def _write_atomic(self, path: str, write):
+        # Write to a temp file and rename it into place so that parallel runs
+        # never see a partially written entry.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get(self, key: str) -> torch.Tensor | None:
+        path = self._get_path(key)
+        # Alignment needs every frame as float32, so the entry is read in
+        # full rather than memory-mapped.
+        try:
+            emissions = np.load(path)
+        except (OSError, ValueError):
+            return None
+
+        # Mark the entry as recently used. Eviction in another process may
+        # have removed it since it was read, which is fine.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return torch.from_numpy(emissions.astype(np.float32))
+
+    def put(self, key: str, emissions: torch.Tensor):
+        array = emissions.to("cpu").numpy().astype(np.float16)
+        self._write_atomic(self._get_path(key), lambda f: np.save(f, array))
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits its
+        size budget.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npy"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -0,0 +1,381 @@
+"""
+A shared HTTP session for the bible APIs. Connections are kept alive and
+pooled, requests to each provider are rate limited to stay inside its quota,
+transient failures are retried with exponential backoff and jitter, and the
+latency and throughput of each endpoint are counted.
+"""
+
+import base64
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# (requests per second, burst) for each provider. API.Bible's quota is much
+# tighter than Bible Brain's. Audio files themselves are served from CDNs and
+# aren't rate limited.
+RATE_LIMITS: dict[str, tuple[float, int]] = {
+    "bb": (5, 10),
+    "dbl": (1, 5),
+    "yv": (5, 10),
+}
+
+# Responses with these statuses are retried.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+
+# (connect, read) timeouts in seconds.
+TIMEOUT = (10, 60)
+
+# Enough pooled connections per host for align_bible.py's download workers.
+POOL_SIZE = 10
+
+
+class IncompleteDownload(Exception):
+    """
+    A download ended before the whole file arrived. It can be resumed.
+    """
+
+
+def get_total_size(response: requests.Response) -> int | None:
+    """
+    Get the size of the whole file from a response's Content-Range (for
+    partial and 416 responses) or Content-Length.
+    """
+    content_range = response.headers.get("Content-Range")
+    if content_range is not None:
+        match = re.search(r"/(\d+)$", content_range)
+        return int(match.group(1)) if match else None
+    if response.status_code == 200 and "Content-Length" in response.headers:
+        return int(response.headers["Content-Length"])
+    return None
+
+
+def get_expected_md5(response: requests.Response) -> str | None:
+    """
+    Get the MD5 of the whole file if the server sent one: in Content-MD5, or
+    as the ETag, which object stores like S3 set to the MD5 of files that
+    weren't uploaded in parts.
+    """
+    content_md5 = response.headers.get("Content-MD5")
+    if content_md5 is not None and response.status_code == 200:
+        try:
+            return base64.b64decode(content_md5).hex()
+        except ValueError:
+            return None
+    etag = response.headers.get("ETag", "").strip('"')
+    if re.fullmatch(r"[0-9a-f]{32}", etag):
+        return etag
+    return None
+
+
+def hash_md5(path: str) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average, and bursts of up to
+    `capacity` requests.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until a request is allowed.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+@dataclass
+class EndpointStats:
+    requests: int = 0
+    retries: int = 0
+    errors: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+
+class HttpClient:
+    def __init__(
+        self,
+        rate_limits: dict[str, tuple[float, int]] = RATE_LIMITS,
+        max_retries: int = MAX_RETRIES,
+        backoff_seconds: float = BACKOFF_SECONDS,
+    ):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.buckets = {
+            provider: TokenBucket(rate, capacity)
+            for provider, (rate, capacity) in rate_limits.items()
+        }
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.stats: dict[str, EndpointStats] = {}
+        self.lock = threading.Lock()
+
+    def get_backoff(self, attempt: int, response: requests.Response | None) -> float:
+        """
+        Get how long to wait before retrying: the server's Retry-After if it
+        sent one, otherwise exponential backoff with full jitter.
+        """
+        if response is not None:
+            try:
+                return min(
+                    MAX_BACKOFF_SECONDS, float(response.headers["Retry-After"])
+                )
+            except (KeyError, ValueError):
+                pass
+        return random.uniform(
+            0, min(MAX_BACKOFF_SECONDS, self.backoff_seconds * 2**attempt)
+        )
+
+    def count(self, endpoint: str, **counts: Any):
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, EndpointStats())
+            for name, value in counts.items():
+                setattr(stats, name, getattr(stats, name) + value)
+
+    def get(
+        self,
+        url: str,
+        endpoint: str,
+        provider: str | None = None,
+        headers: dict[str, str] | None = None,
+        stream: bool = False,
+        allow_statuses: frozenset[int] = frozenset(),
+    ) -> requests.Response:
+        """
+        GET `url`, retrying connection errors, timeouts and retryable statuses.
+        `endpoint` names the request in the stats (URLs can contain API keys),
+        and `provider` picks the rate limit. Raises the last error once the
+        retries run out, or straight away for other error statuses except
+        `allow_statuses`.
+        """
+        bucket = self.buckets.get(provider) if provider is not None else None
+        attempt = 0
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+
+            start_time = time.perf_counter()
+            response = None
+            try:
+                response = self.session.get(
+                    url, headers=headers, stream=stream, timeout=TIMEOUT
+                )
+                if response.status_code not in RETRY_STATUSES:
+                    if response.status_code not in allow_statuses:
+                        response.raise_for_status()
+                    self.count(
+                        endpoint,
+                        requests=1,
+                        seconds=time.perf_counter() - start_time,
+                        bytes=0 if stream else len(response.content),
+                    )
+                    return response
+                error: Exception = requests.HTTPError(
+                    f"{response.status_code} {response.reason}", response=response
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except requests.HTTPError:
+                self.count(endpoint, requests=1, errors=1)
+                raise
+
+            self.count(
+                endpoint, requests=1, seconds=time.perf_counter() - start_time
+            )
+            if attempt >= self.max_retries:
+                self.count(endpoint, errors=1)
+                raise error
+
+            backoff = self.get_backoff(attempt, response)
+            if response is not None:
+                response.close()
+            self.count(endpoint, retries=1)
+            time.sleep(backoff)
+            attempt += 1
+
+    def get_json(
+        self,
+        url: str,
+        endpoint: str,
+        provider: str | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> Any:
+        return self.get(url, endpoint, provider, headers).json()
+
+    def download_part(
+        self,
+        url: str,
+        part_path: str,
+        endpoint: str,
+        provider: str | None = None,
+        headers: dict[str, str] | None = None,
+    ):
+        """
+        Download whatever is missing from `part_path`, asking for only the
+        bytes after the ones it already has. Raises IncompleteDownload if the
+        transfer stops early, and ValueError if the finished file doesn't
+        match the size or checksum the server gave.
+        """
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        # Ranges and sizes count the bytes as stored, so the body mustn't be
+        # compressed in transit.
+        request_headers = {**(headers or {}), "Accept-Encoding": "identity"}
+        if offset > 0:
+            request_headers["Range"] = f"bytes={offset}-"
+
+        # A 416 means there is nothing past the end of the part, so it is
+        # already complete.
+        response = self.get(
+            url,
+            endpoint,
+            provider,
+            request_headers,
+            stream=True,
+            allow_statuses=frozenset({416}) if offset > 0 else frozenset(),
+        )
+        with response:
+            total_size = get_total_size(response)
+            expected_md5 = get_expected_md5(response)
+            if response.status_code != 416:
+                # A 200 means the server ignored the range, so start over.
+                mode = "ab" if response.status_code == 206 else "wb"
+                # The request was counted when the response headers arrived,
+                # so only add the time spent reading the body.
+                start_time = time.perf_counter()
+                size = 0
+                try:
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(1024 * 1024):
+                            f.write(chunk)
+                            size += len(chunk)
+                except (
+                    requests.ConnectionError,
+                    requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError,
+                ) as e:
+                    raise IncompleteDownload(str(e))
+                finally:
+                    self.count(
+                        endpoint, bytes=size, seconds=time.perf_counter() - start_time
+                    )
+
+        size = os.path.getsize(part_path)
+        if total_size is not None and size < total_size:
+            raise IncompleteDownload(f"Got {size} of {total_size} bytes.")
+        if total_size is not None and size > total_size:
+            os.remove(part_path)
+            raise ValueError(f"Got {size} bytes, expected {total_size}.")
+        if expected_md5 is not None and hash_md5(part_path) != expected_md5:
+            os.remove(part_path)
+            raise ValueError("Checksum mismatch.")
+
+    def download(
+        self,
+        url: str,
+        output: str,
+        endpoint: str,
+        provider: str | None = None,
+        headers: dict[str, str] | None = None,
+        verify: Callable[[str], Any] | None = None,
+    ):
+        """
+        Download `url` to the file `output`. The file is written to
+        `<output>.part` and only renamed to `output` once it is complete,
+        matches the size and checksum the server gave, and passes `verify`
+        (which should raise if the file is bad). Interrupted transfers, in
+        this run or an earlier one, resume from where they stopped.
+        """
+        part_path = f"{output}.part"
+        attempt = 0
+        while True:
+            try:
+                self.download_part(url, part_path, endpoint, provider, headers)
+                break
+            except (IncompleteDownload, ValueError):
+                # Resume, or start over if the part was bad and was removed.
+                if attempt >= self.max_retries:
+                    self.count(endpoint, errors=1)
+                    raise
+            self.count(endpoint, retries=1)
+            time.sleep(self.get_backoff(attempt, None))
+            attempt += 1
+
+        if verify is not None:
+            try:
+                verify(part_path)
+            except Exception:
+                os.remove(part_path)
+                self.count(endpoint, errors=1)
+                raise
+        os.replace(part_path, output)
+
+    def summary(self) -> str:
+        """
+        Get a table of the requests, retries, errors, mean time per request
+        (including reading the body) and throughput of each endpoint.
+        """
+        rows = [
+            f"{'endpoint':<12} {'requests':>9} {'retries':>8} {'errors':>7} "
+            f"{'mean ms':>9} {'MB':>9} {'MB/s':>7}"
+        ]
+        with self.lock:
+            for endpoint, stats in sorted(self.stats.items()):
+                mean = stats.seconds / stats.requests if stats.requests else 0
+                megabytes = stats.bytes / 1e6
+                rows.append(
+                    f"{endpoint:<12} {stats.requests:>9} {stats.retries:>8} "
+                    f"{stats.errors:>7} {mean * 1000:>9.1f} {megabytes:>9.2f} "
+                    f"{megabytes / stats.seconds if stats.seconds else 0:>7.2f}"
+                )
+        return "\n".join(rows)
+
+
+# The client shared by every thread in this process.
+client: HttpClient | None = None
+client_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    global client
+    with client_lock:
+        if client is None:
+            client = HttpClient()
+        return client
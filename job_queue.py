@@ -0,0 +1,381 @@
+"""
+A durable queue of alignment jobs, kept in a SQLite database that any number
+of worker processes (see jobs.py) can share. Each job is one audio and text
+pair. Jobs are claimed highest priority first, failed jobs are retried with
+backoff until they run out of attempts, and jobs whose worker stopped sending
+heartbeats (because it crashed or was killed) are put back in the queue.
+"""
+
+import os
+import socket
+import sqlite3
+import time
+from typing import Any, TypedDict
+
+# Job statuses.
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+STATUSES = [QUEUED, RUNNING, DONE, FAILED, CANCELLED]
+
+# How often workers update the heartbeat of the job they are running, and how
+# long without one before the job is reclaimed.
+HEARTBEAT_SECONDS = 10
+STALE_SECONDS = 120
+
+# Failed jobs are retried after RETRY_DELAY_SECONDS, doubling each attempt.
+RETRY_DELAY_SECONDS = 30
+MAX_RETRY_DELAY_SECONDS = 3600
+
+
+class Job(TypedDict):
+    id: int
+    audio_path: str
+    text_path: str
+    output: str
+    language: str | None
+    separator: str
+    max_silence_padding_ms: int
+    priority: int
+    status: str
+    attempts: int
+    max_attempts: int
+    worker: str | None
+    heartbeat: float | None
+    available_at: float
+    error: str | None
+    created_at: float
+    updated_at: float
+
+
+def get_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """
+    A connection to the queue at `path`. Each process should open its own.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Autocommit, with claims made in explicit write transactions.
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                audio_path TEXT NOT NULL,
+                text_path TEXT NOT NULL,
+                output TEXT NOT NULL,
+                language TEXT,
+                separator TEXT NOT NULL,
+                max_silence_padding_ms INTEGER NOT NULL,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                worker TEXT,
+                heartbeat REAL,
+                available_at REAL NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE INDEX IF NOT EXISTS jobs_by_priority
+            ON jobs (status, priority DESC, id)
+            """
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def enqueue(
+        self,
+        audio_path: str,
+        text_path: str,
+        output: str,
+        language: str | None = None,
+        separator: str = "lineBreak",
+        max_silence_padding_ms: int = -1,
+        priority: int = 0,
+        max_attempts: int = 3,
+    ) -> int | None:
+        """
+        Add a job, unless the same pair is already queued or running for the
+        same output folder. Returns the new job's id.
+        """
+        now = time.time()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            existing = self.connection.execute(
+                """
+                SELECT id FROM jobs
+                WHERE audio_path = ? AND text_path = ? AND output = ?
+                    AND status IN (?, ?)
+                """,
+                (audio_path, text_path, output, QUEUED, RUNNING),
+            ).fetchone()
+            if existing is not None:
+                self.connection.execute("COMMIT")
+                return None
+            cursor = self.connection.execute(
+                """
+                INSERT INTO jobs (
+                    audio_path, text_path, output, language, separator,
+                    max_silence_padding_ms, priority, status, max_attempts,
+                    available_at, created_at, updated_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    audio_path,
+                    text_path,
+                    output,
+                    language,
+                    separator,
+                    max_silence_padding_ms,
+                    priority,
+                    QUEUED,
+                    max_attempts,
+                    now,
+                    now,
+                    now,
+                ),
+            )
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return cursor.lastrowid
+
+    def reclaim(self, condition: str, params: tuple[Any, ...], error: str) -> int:
+        """
+        Put the running jobs matching `condition` back in the queue, or fail
+        them if that was their last attempt.
+        """
+        now = time.time()
+        cursor = self.connection.execute(
+            f"""
+            UPDATE jobs SET
+                status = CASE WHEN attempts < max_attempts THEN ? ELSE ? END,
+                error = ?,
+                worker = NULL,
+                available_at = ?,
+                updated_at = ?
+            WHERE status = ? AND {condition}
+            """,
+            (QUEUED, FAILED, error, now, now, RUNNING, *params),
+        )
+        return cursor.rowcount
+
+    def reclaim_stale(self, stale_seconds: float = STALE_SECONDS) -> int:
+        """
+        Reclaim jobs that haven't had a heartbeat for `stale_seconds`.
+        Returns the number of jobs reclaimed.
+        """
+        return self.reclaim(
+            "heartbeat < ?",
+            (time.time() - stale_seconds,),
+            "Worker stopped responding.",
+        )
+
+    def reclaim_workers(self, workers: list[str]) -> int:
+        """
+        Reclaim the jobs of workers that are known to have died.
+        """
+        return self.reclaim(
+            f"worker IN ({', '.join('?' for _ in workers)})",
+            tuple(workers),
+            "Worker exited.",
+        )
+
+    def claim(self, worker: str) -> Job | None:
+        """
+        Take the highest priority job that is ready to run, oldest first.
+        """
+        now = time.time()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.connection.execute(
+                """
+                SELECT id FROM jobs
+                WHERE status = ? AND available_at <= ?
+                ORDER BY priority DESC, id
+                LIMIT 1
+                """,
+                (QUEUED, now),
+            ).fetchone()
+            jobs = []
+            if row is not None:
+                # Read every returned row, so the statement finishes before
+                # the commit.
+                jobs = self.connection.execute(
+                    """
+                    UPDATE jobs SET
+                        status = ?, worker = ?, heartbeat = ?,
+                        attempts = attempts + 1, updated_at = ?
+                    WHERE id = ?
+                    RETURNING *
+                    """,
+                    (RUNNING, worker, now, now, row["id"]),
+                ).fetchall()
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return dict(jobs[0]) if jobs else None  # type: ignore
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        """
+        Record that `worker` is still running the job. Returns False if the
+        job is no longer the worker's, e.g. it was cancelled or reclaimed.
+        """
+        now = time.time()
+        cursor = self.connection.execute(
+            """
+            UPDATE jobs SET heartbeat = ?, updated_at = ?
+            WHERE id = ? AND worker = ? AND status = ?
+            """,
+            (now, now, job_id, worker, RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker: str) -> bool:
+        now = time.time()
+        cursor = self.connection.execute(
+            """
+            UPDATE jobs SET status = ?, error = NULL, updated_at = ?
+            WHERE id = ? AND worker = ? AND status = ?
+            """,
+            (DONE, now, job_id, worker, RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    def fail(
+        self, job_id: int, worker: str, error: str, retry: bool = True
+    ) -> str | None:
+        """
+        Record a failed attempt. The job is queued to be retried after a
+        backoff, or failed if it has no attempts left or `retry` is False.
+        Returns its new status.
+        """
+        now = time.time()
+        rows = self.connection.execute(
+            """
+            UPDATE jobs SET
+                status = CASE WHEN ? AND attempts < max_attempts THEN ? ELSE ? END,
+                available_at = ? + MIN(?, ? * (1 << (attempts - 1))),
+                worker = NULL,
+                error = ?,
+                updated_at = ?
+            WHERE id = ? AND worker = ? AND status = ?
+            RETURNING status
+            """,
+            (
+                retry,
+                QUEUED,
+                FAILED,
+                now,
+                MAX_RETRY_DELAY_SECONDS,
+                RETRY_DELAY_SECONDS,
+                error,
+                now,
+                job_id,
+                worker,
+                RUNNING,
+            ),
+        ).fetchall()
+        return rows[0]["status"] if rows else None
+
+    def release(self, workers: list[str]) -> int:
+        """
+        Put the jobs `workers` are running back in the queue without using up
+        an attempt, for when the workers are stopped on purpose.
+        """
+        now = time.time()
+        cursor = self.connection.execute(
+            f"""
+            UPDATE jobs SET
+                status = ?, worker = NULL, attempts = attempts - 1,
+                available_at = ?, updated_at = ?
+            WHERE status = ? AND worker IN ({", ".join("?" for _ in workers)})
+            """,
+            (QUEUED, now, now, RUNNING, *workers),
+        )
+        return cursor.rowcount
+
+    def cancel(self, job_ids: list[int]) -> int:
+        """
+        Cancel queued or running jobs. A running job's worker stops aligning
+        it at its next heartbeat and doesn't write its outputs.
+        """
+        now = time.time()
+        cursor = self.connection.execute(
+            f"""
+            UPDATE jobs SET status = ?, worker = NULL, updated_at = ?
+            WHERE status IN (?, ?) AND id IN ({", ".join("?" for _ in job_ids)})
+            """,
+            (CANCELLED, now, QUEUED, RUNNING, *job_ids),
+        )
+        return cursor.rowcount
+
+    def retry(self, job_ids: list[int]) -> int:
+        """
+        Queue failed or cancelled jobs again with a fresh set of attempts.
+        """
+        now = time.time()
+        cursor = self.connection.execute(
+            f"""
+            UPDATE jobs SET
+                status = ?, attempts = 0, error = NULL, available_at = ?,
+                updated_at = ?
+            WHERE status IN (?, ?) AND id IN ({", ".join("?" for _ in job_ids)})
+            """,
+            (QUEUED, now, now, FAILED, CANCELLED, *job_ids),
+        )
+        return cursor.rowcount
+
+    def get(self, job_id: int) -> Job | None:
+        row = self.connection.execute(
+            "SELECT * FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return dict(row) if row is not None else None  # type: ignore
+
+    def get_jobs(self, status: str | None = None, limit: int = 100) -> list[Job]:
+        """
+        List jobs in the order they would run, or the most recently updated
+        first for finished ones.
+        """
+        if status is None:
+            rows = self.connection.execute(
+                "SELECT * FROM jobs ORDER BY updated_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        else:
+            rows = self.connection.execute(
+                """
+                SELECT * FROM jobs WHERE status = ?
+                ORDER BY priority DESC, id LIMIT ?
+                """,
+                (status, limit),
+            ).fetchall()
+        return [dict(row) for row in rows]  # type: ignore
+
+    def counts(self) -> dict[str, int]:
+        """
+        Count the jobs with each status.
+        """
+        rows = self.connection.execute(
+            "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+        ).fetchall()
+        counts: dict[str, Any] = {status: 0 for status in STATUSES}
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
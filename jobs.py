@@ -0,0 +1,585 @@
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from typing import Any
+
+from halo import Halo
+
+from constants import model_name
+from job_queue import (
+    HEARTBEAT_SECONDS,
+    QUEUED,
+    RUNNING,
+    STALE_SECONDS,
+    STATUSES,
+    Job,
+    JobQueue,
+    get_worker_id,
+)
+from languages import can_align
+from model import BACKENDS, PRECISIONS, load_model
+from timestamp_types import File, Match
+from tuning import load_emission_config
+from utils import (
+    align_match,
+    get_cpu_sets,
+    identify_match_languages,
+    init_worker,
+    match_files,
+    worker_state,
+    write_outputs,
+)
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--queue",
+    help="The path to the job queue database. Default is `jobs.sqlite3`.",
+    default="jobs.sqlite3",
+)
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+enqueue_parser = subparsers.add_parser(
+    "enqueue", help="Add a job for every audio and text pair in a folder."
+)
+enqueue_parser.add_argument(
+    "-i",
+    "--input",
+    help="The path to a folder containing audio and text files.",
+    required=True,
+)
+enqueue_parser.add_argument(
+    "-o",
+    "--output",
+    help="The path to a folder to write JSON and SRT files to.",
+    required=True,
+)
+enqueue_parser.add_argument(
+    "-s",
+    "--separator",
+    help=(
+        "The location to timestamp within a text file. Options are `lineBreak`, "
+        "`leftBracket` ([), or `downArrow` (⬇️)."
+    ),
+    default="lineBreak",
+)
+enqueue_parser.add_argument(
+    "-l",
+    "--language",
+    help=(
+        "The language of the text and audio files. If one isn't provided, the "
+        "language of each file is identified when it is aligned."
+    ),
+    default=None,
+    type=str,
+)
+enqueue_parser.add_argument(
+    "-m",
+    "--max-silence-padding-ms",
+    help=(
+        "The maximum amount of silence padding (in ms) to offset the start and end "
+        "timestamps of each text span. Default is -1 (equally distribute silence). "
+        "0 will remove all silence. 500 (for example) will add up to 500ms of "
+        "silence to the start and end of each text span."
+    ),
+    default=-1,
+    type=int,
+)
+enqueue_parser.add_argument(
+    "-p",
+    "--priority",
+    help="Jobs with a higher priority run first. Default is 0.",
+    default=0,
+    type=int,
+)
+enqueue_parser.add_argument(
+    "--max-attempts",
+    help="The number of times to try a job before giving up. Default is 3.",
+    default=3,
+    type=int,
+)
+
+work_parser = subparsers.add_parser("work", help="Run jobs from the queue.")
+work_parser.add_argument(
+    "-w",
+    "--workers",
+    help=(
+        "The number of processes to run jobs in. The model is loaded once and "
+        "shared between them. Default is 1."
+    ),
+    default=1,
+    type=int,
+)
+work_parser.add_argument(
+    "--pin-workers",
+    help="Pin each worker to its own set of CPUs. Only used with --workers.",
+    action="store_true",
+)
+work_parser.add_argument(
+    "--drain",
+    help=(
+        "Exit once the queue is empty, instead of waiting for more jobs to be "
+        "added."
+    ),
+    action="store_true",
+)
+work_parser.add_argument(
+    "--poll-seconds",
+    help="How often idle workers check for new jobs. Default is 5.",
+    default=5,
+    type=float,
+)
+work_parser.add_argument(
+    "--stale-seconds",
+    help=(
+        "How long a running job can go without a heartbeat from its worker "
+        f"before it is put back in the queue. Default is {STALE_SECONDS}."
+    ),
+    default=STALE_SECONDS,
+    type=float,
+)
+work_parser.add_argument(
+    "-b",
+    "--batch-size",
+    help=(
+        "The number of audio windows to run through the model at once. Default "
+        "is 1, or the batch size from this machine's tuning profile."
+    ),
+    default=None,
+    type=int,
+)
+work_parser.add_argument(
+    "--no-tuning",
+    help=(
+        "Ignore this machine's tuning profile (see autotune.py) and use the "
+        "default window length, batch size and thread counts."
+    ),
+    action="store_true",
+)
+work_parser.add_argument(
+    "--chunk-seconds",
+    help=(
+        "Align long recordings in independent chunks of about this many seconds, "
+        "cut at verse boundaries found a few chunks at a time. This bounds "
+        "memory for hour-long files. Default is 0 (align each file in one go)."
+    ),
+    default=0,
+    type=float,
+)
+work_parser.add_argument(
+    "--precision",
+    help=(
+        "The numeric precision to run the models in. `int8` quantizes the "
+        "models' linear layers, which is faster on CPU but can move timestamps "
+        "slightly. Default is `fp32`."
+    ),
+    choices=PRECISIONS,
+    default="fp32",
+)
+work_parser.add_argument(
+    "--backend",
+    help=(
+        "How to run the alignment model: `eager` PyTorch, `torchscript`, "
+        "`compile` (torch.compile) or `onnx` (ONNX Runtime, needs onnxruntime "
+        "and onnxscript). Only supported with fp32 precision. Default is `eager`."
+    ),
+    choices=BACKENDS,
+    default="eager",
+)
+work_parser.add_argument(
+    "--low-memory",
+    help=(
+        "Keep decoded audio in a memory-mapped temporary file instead of in RAM. "
+        "Useful for multi-hour recordings."
+    ),
+    action="store_true",
+)
+work_parser.add_argument(
+    "--cache-dir",
+    help=(
+        "A folder to cache model emissions and identified languages in. "
+        "Default is `emission_cache`."
+    ),
+    default="emission_cache",
+)
+work_parser.add_argument(
+    "--cache-size-mb",
+    help=(
+        "The maximum size of the emission cache in MB. 0 disables the cache. "
+        "Default is 1024."
+    ),
+    default=1024,
+    type=float,
+)
+
+list_parser = subparsers.add_parser("list", help="List jobs.")
+list_parser.add_argument(
+    "--status",
+    help="Only list jobs with this status.",
+    choices=STATUSES,
+    default=None,
+)
+list_parser.add_argument(
+    "--limit",
+    help="The most jobs to list. Default is 100.",
+    default=100,
+    type=int,
+)
+
+cancel_parser = subparsers.add_parser("cancel", help="Cancel queued or running jobs.")
+cancel_parser.add_argument("ids", help="The ids of the jobs.", nargs="+", type=int)
+
+retry_parser = subparsers.add_parser(
+    "retry", help="Queue failed or cancelled jobs again."
+)
+retry_parser.add_argument("ids", help="The ids of the jobs.", nargs="+", type=int)
+
+
+def get_match(job: Job) -> Match:
+    return (
+        (os.path.basename(job["audio_path"]), job["audio_path"]),
+        (os.path.basename(job["text_path"]), job["text_path"]),
+    )
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobRejected(Exception):
+    """
+    The job can't be aligned however often it's retried, e.g. because its
+    detected language isn't supported.
+    """
+
+
+class CancellableModel:
+    """
+    Wraps the alignment model so a job stops at the next batch of windows
+    once `cancelled` is set, instead of aligning the rest of the file.
+    """
+
+    def __init__(self, model: Any, cancelled: threading.Event):
+        from mms.align_utils import get_device
+
+        self.model = model
+        self.device = get_device(model)
+        self.cancelled = cancelled
+
+    def __call__(self, *args):
+        if self.cancelled.is_set():
+            raise JobCancelled
+        return self.model(*args)
+
+
+def send_heartbeats(
+    queue_path: str,
+    job_id: int,
+    worker: str,
+    stop: threading.Event,
+    cancelled: threading.Event,
+):
+    """
+    Update the job's heartbeat until `stop` is set, on a connection of its own.
+    Sets `cancelled` if the job is no longer the worker's.
+    """
+    queue = JobQueue(queue_path)
+    try:
+        while not stop.wait(HEARTBEAT_SECONDS):
+            if not queue.heartbeat(job_id, worker):
+                cancelled.set()
+                return
+    finally:
+        queue.close()
+
+
+def run_job(
+    queue: JobQueue,
+    job: Job,
+    worker: str,
+    precision: str = "fp32",
+    language_cache: Any = None,
+) -> bool:
+    """
+    Align a job's pair and write its outputs. Returns False if the job was
+    cancelled or reclaimed while it was being aligned, in which case it stops
+    within a heartbeat or so and nothing is written.
+    """
+    align_args = worker_state["align_args"]
+    match = get_match(job)
+
+    stop = threading.Event()
+    cancelled = threading.Event()
+    heartbeats = threading.Thread(
+        target=send_heartbeats,
+        args=(queue.path, job["id"], worker, stop, cancelled),
+        daemon=True,
+    )
+    heartbeats.start()
+    try:
+        language = job["language"]
+        if language is None:
+            language = identify_match_languages(
+                [match], precision, 1, language_cache
+            )[0]
+            if not can_align(language):
+                raise JobRejected(f"Detected language {language} not supported.")
+        if cancelled.is_set():
+            return False
+
+        timestamps = align_match(
+            match,
+            **{
+                **align_args,
+                "model": CancellableModel(align_args["model"], cancelled),
+                "language": language,
+                "separator": job["separator"],
+                "max_silence_padding_ms": job["max_silence_padding_ms"],
+            },
+            spinner=Halo(enabled=False),
+        )
+    except JobCancelled:
+        return False
+    finally:
+        stop.set()
+        heartbeats.join()
+
+    current = queue.get(job["id"])
+    if current is None or current["status"] != RUNNING or current["worker"] != worker:
+        return False
+    os.makedirs(job["output"], exist_ok=True)
+    write_outputs(job["output"], match, timestamps)
+    return queue.complete(job["id"], worker)
+
+
+def work(
+    queue_path: str,
+    poll_seconds: float,
+    stale_seconds: float,
+    drain: bool,
+    precision: str = "fp32",
+    language_cache: Any = None,
+):
+    """
+    Run jobs until the queue is empty (with `drain`) or forever. Jobs this
+    worker is running when it is interrupted go back in the queue.
+    """
+    queue = JobQueue(queue_path)
+    worker = get_worker_id()
+    try:
+        while True:
+            reclaimed = queue.reclaim_stale(stale_seconds)
+            if reclaimed:
+                Halo().warn(f"Reclaimed {reclaimed} jobs from unresponsive workers.")
+
+            job = queue.claim(worker)
+            if job is None:
+                counts = queue.counts()
+                if drain and counts[QUEUED] == 0 and counts[RUNNING] == 0:
+                    return
+                time.sleep(poll_seconds)
+                continue
+
+            name = os.path.basename(job["audio_path"])
+            try:
+                if run_job(queue, job, worker, precision, language_cache):
+                    Halo().succeed(f"Job {job['id']}: aligned {name}.")
+                else:
+                    Halo().info(f"Job {job['id']}: {name} was cancelled.")
+            except JobRejected as e:
+                queue.fail(job["id"], worker, str(e), retry=False)
+                Halo().fail(f"Job {job['id']}: can't align {name}. {e}")
+            except Exception:
+                status = queue.fail(job["id"], worker, traceback.format_exc())
+                Halo().fail(
+                    f"Job {job['id']}: failed to align {name}"
+                    + (", will retry." if status == QUEUED else ".")
+                )
+    except KeyboardInterrupt:
+        queue.release([worker])
+    finally:
+        queue.close()
+
+
+def work_in_process(
+    align_args: dict[str, Any],
+    threads: int,
+    cpu_sets: Any,
+    queue_path: str,
+    poll_seconds: float,
+    stale_seconds: float,
+    drain: bool,
+    precision: str,
+    language_cache: Any,
+):
+    init_worker(align_args, threads, cpu_sets)
+    work(queue_path, poll_seconds, stale_seconds, drain, precision, language_cache)
+
+
+def run_workers(args: argparse.Namespace):
+    if args.precision != "fp32" and args.backend != "eager":
+        parser.error("--backend only supports fp32 precision.")
+
+    emission_config = load_emission_config(args.batch_size, not args.no_tuning)
+    model, dictionary = load_model(args.precision, args.backend)
+    from emission_cache import EmissionCache
+    from lid import LanguageCache
+    from mms.align_utils import get_uroman
+
+    emission_cache = None
+    language_cache = None
+    if args.cache_size_mb > 0:
+        emission_cache = EmissionCache(
+            args.cache_dir,
+            args.cache_size_mb,
+            model_name,
+            args.precision,
+            args.backend,
+        )
+        language_cache = LanguageCache(args.cache_dir)
+
+    align_args = {
+        "model": model,
+        "dictionary": dictionary,
+        "emission_config": emission_config,
+        "emission_cache": emission_cache,
+        "chunk_seconds": args.chunk_seconds,
+        "low_memory": args.low_memory,
+    }
+    work_args = (
+        args.queue,
+        args.poll_seconds,
+        args.stale_seconds,
+        args.drain,
+        args.precision,
+        language_cache,
+    )
+
+    if args.workers <= 1:
+        worker_state["align_args"] = align_args
+        work(*work_args)
+        return
+
+    # Forked workers share the model's weights (and the uroman rules) with this
+    # process copy-on-write, as in align_matches.
+    get_uroman()
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context("spawn")
+        model.share_memory()
+
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    worker_cpu_sets: list[set[int] | None] = [None] * args.workers
+    if args.pin_workers:
+        worker_cpu_sets = list(get_cpu_sets(args.workers))
+        threads = len(worker_cpu_sets[0] or [])
+
+    def start_worker(cpu_set: set[int] | None):
+        # init_worker takes its CPUs from a queue.
+        cpu_sets = None
+        if cpu_set is not None:
+            cpu_sets = context.Queue()
+            cpu_sets.put(cpu_set)
+        process = context.Process(
+            target=work_in_process,
+            args=(align_args, threads, cpu_sets, *work_args),
+        )
+        process.start()
+        return process
+
+    queue = JobQueue(args.queue)
+    hostname = get_worker_id().rsplit(":", 1)[0]
+    processes = {start_worker(cpu_set): cpu_set for cpu_set in worker_cpu_sets}
+    Halo().info(f"Started {args.workers} workers.")
+    try:
+        while processes:
+            time.sleep(1)
+            for process in [process for process in processes if not process.is_alive()]:
+                cpu_set = processes.pop(process)
+                if process.exitcode == 0:
+                    continue
+                # The worker crashed, e.g. it ran out of memory. Its job counts
+                # as a failed attempt, and a new worker takes its place.
+                queue.reclaim_workers([f"{hostname}:{process.pid}"])
+                Halo().fail(f"Worker {process.pid} exited with {process.exitcode}.")
+                processes[start_worker(cpu_set)] = cpu_set
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+    finally:
+        queue.close()
+
+
+def enqueue(args: argparse.Namespace):
+    if args.language is not None and not can_align(args.language):
+        print("Provided language is not supported by mms.")
+        exit(0)
+
+    files: list[File] = []
+    for dirpath, _, filenames in os.walk(args.input):
+        for file_name in filenames:
+            files.append((file_name, os.path.abspath(os.path.join(dirpath, file_name))))
+
+    queue = JobQueue(args.queue)
+    added = 0
+    matches = match_files(files)
+    for match in matches:
+        assert match[0] is not None and match[1] is not None
+        job_id = queue.enqueue(
+            match[0][1],
+            match[1][1],
+            os.path.abspath(args.output),
+            args.language,
+            args.separator,
+            args.max_silence_padding_ms,
+            args.priority,
+            args.max_attempts,
+        )
+        added += job_id is not None
+    queue.close()
+    Halo().succeed(
+        f"Queued {added} of {len(matches)} pairs "
+        f"({len(matches) - added} already queued)."
+    )
+
+
+def list_jobs(args: argparse.Namespace):
+    queue = JobQueue(args.queue)
+    rows = [
+        f"{'id':>6} {'status':<10} {'priority':>8} {'attempts':>8}  audio",
+    ]
+    for job in queue.get_jobs(args.status, args.limit):
+        rows.append(
+            f"{job['id']:>6} {job['status']:<10} {job['priority']:>8} "
+            f"{job['attempts']:>3}/{job['max_attempts']:<4}  {job['audio_path']}"
+        )
+    counts = queue.counts()
+    queue.close()
+    print("\n".join(rows))
+    print(", ".join(f"{count} {status}" for status, count in counts.items()))
+
+
+def main():
+    args = parser.parse_args()
+    if args.command == "enqueue":
+        enqueue(args)
+    elif args.command == "work":
+        run_workers(args)
+    elif args.command == "list":
+        list_jobs(args)
+    elif args.command == "cancel":
+        queue = JobQueue(args.queue)
+        Halo().succeed(f"Cancelled {queue.cancel(args.ids)} jobs.")
+        queue.close()
+    elif args.command == "retry":
+        queue = JobQueue(args.queue)
+        Halo().succeed(f"Queued {queue.retry(args.ids)} jobs again.")
+        queue.close()
+
+
+# Spawned workers import this module, so only run when started directly.
+if __name__ == "__main__":
+    main()
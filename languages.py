@@ -0,0 +1,127 @@
+"""
+The languages MMS supports, loaded once per process on first use and indexed
+by ISO code. The first load also writes a compact copy of
+`data/mms_languages.json` (one line per language, with its align, identify
+and tts support packed into flags), which later processes read instead of
+parsing the full JSON.
+"""
+
+import json
+import os
+import tempfile
+
+from timestamp_types import MmsLanguage
+
+LANGUAGES_PATH = "data/mms_languages.json"
+COMPACT_PATH = "data/mms_languages.cache"
+
+ALIGN = 1
+IDENTIFY = 2
+TTS = 4
+
+# Languages keyed by ISO code, once loaded.
+languages: dict[str, MmsLanguage] | None = None
+
+
+def get_source_signature(path: str = LANGUAGES_PATH) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def to_flags(language: MmsLanguage) -> int:
+    return (
+        (ALIGN if language["align"] else 0)
+        | (IDENTIFY if language["identify"] else 0)
+        | (TTS if language["tts"] else 0)
+    )
+
+
+def from_flags(iso: str, flags: int, name: str) -> MmsLanguage:
+    return {
+        "align": bool(flags & ALIGN),
+        "identify": bool(flags & IDENTIFY),
+        "iso": iso,
+        "name": name,
+        "tts": bool(flags & TTS),
+    }
+
+
+def read_compact(signature: str) -> dict[str, MmsLanguage] | None:
+    """
+    Read the compact copy, if it was made from the current JSON.
+    """
+    try:
+        with open(COMPACT_PATH, encoding="utf-8") as f:
+            if f.readline().rstrip("\n") != signature:
+                return None
+            index = {}
+            for line in f:
+                iso, flags, name = line.rstrip("\n").split("\t", 2)
+                index[iso] = from_flags(iso, int(flags), name)
+            return index
+    except (OSError, ValueError):
+        return None
+
+
+def write_compact(index: dict[str, MmsLanguage], signature: str):
+    # Write to a temp file and rename it into place so that parallel runs
+    # never see a partially written copy. The data folder may be read-only,
+    # in which case the JSON is just parsed every time.
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(COMPACT_PATH), suffix=".tmp"
+        )
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(f"{signature}\n")
+            for iso, language in index.items():
+                f.write(f"{iso}\t{to_flags(language)}\t{language['name']}\n")
+        os.replace(tmp_path, COMPACT_PATH)
+    except OSError:
+        os.remove(tmp_path)
+
+
+def get_languages() -> dict[str, MmsLanguage]:
+    """
+    Get every language, keyed by ISO code.
+    """
+    global languages
+    if languages is not None:
+        return languages
+
+    signature = get_source_signature()
+    index = read_compact(signature)
+    if index is None:
+        with open(LANGUAGES_PATH, encoding="utf-8") as f:
+            index = {
+                language["iso"]: from_flags(
+                    language["iso"], to_flags(language), language["name"]
+                )
+                for language in json.load(f)
+            }
+        write_compact(index, signature)
+
+    languages = index
+    return languages
+
+
+def get_language(iso: str) -> MmsLanguage | None:
+    return get_languages().get(iso)
+
+
+def can_align(iso: str) -> bool:
+    """
+    Check whether the alignment model supports a language.
+    """
+    language = get_language(iso)
+    return language is not None and language["align"]
+
+
+def can_identify(iso: str) -> bool:
+    """
+    Check whether the LID model can identify a language.
+    """
+    language = get_language(iso)
+    return language is not None and language["identify"]
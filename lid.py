@@ -1,42 +1,162 @@
+"""
+Spoken language identification with the MMS LID model, on audio that has
+already been decoded. Several clips of a file can be scored together and
+several files identified in one padded batch.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
 import torch
-import torchaudio
-from transformers import AutoFeatureExtractor, Wav2Vec2ForSequenceClassification
 
-model_id = "facebook/mms-lid-4017"
+from audio import DecodedAudio
+from constants import lid_model_id
+from model import load_lid_model
+
+# Each clip scored for the language is this long.
+LID_SECONDS = 30
+
+# Clips shorter than this (the end of a file) aren't worth scoring, unless
+# they are all there is.
+MIN_CLIP_SECONDS = 2
+
+# The number of clips run through the model at once.
+LID_BATCH_SIZE = 8
+
+
+def get_clips(audio: DecodedAudio, clips: int = 1) -> list[np.ndarray]:
+    """
+    Get up to `clips` consecutive LID_SECONDS clips from the start of the
+    audio.
+    """
+    clip_length = LID_SECONDS * audio.sample_rate
+    min_length = MIN_CLIP_SECONDS * audio.sample_rate
+    arrays = []
+    for i in range(clips):
+        start = i * clip_length
+        if start >= audio.num_samples:
+            break
+        array = audio.array(start, start + clip_length)
+        if arrays and len(array) < min_length:
+            break
+        arrays.append(array)
+    return arrays
+
+
+class LanguageCache:
+    """
+    Identified languages keyed by a hash of the clips they were identified
+    from, the LID model and its precision, stored in one small JSON file.
+    """
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, "languages.json")
+        self.languages: dict[str, str] = {}
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.languages = json.load(f)
+        except (OSError, ValueError):
+            pass
 
-processor = AutoFeatureExtractor.from_pretrained(model_id)
-model = Wav2Vec2ForSequenceClassification.from_pretrained(model_id)
+    def get_key(self, clips: list[np.ndarray], precision: str) -> str:
+        sha = hashlib.sha256()
+        for clip in clips:
+            sha.update(memoryview(np.ascontiguousarray(clip)))
+        sha.update(json.dumps([lid_model_id, precision, len(clips)]).encode("utf-8"))
+        return sha.hexdigest()
 
+    def get(self, key: str) -> str | None:
+        return self.languages.get(key)
 
-# Load the MP3 file and convert to the correct format
-def load_audio(file_path: str):
-    # Load the audio file (returns waveform, sample rate)
-    waveform, sample_rate = torchaudio.load(file_path)
+    def put(self, languages: dict[str, str]):
+        self.languages.update(languages)
+        # Write to a temp file and rename it into place so that parallel runs
+        # never see a partially written cache.
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.path), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.languages, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
 
-    # Resample to 16000 Hz if necessary (the model expects 16kHz audio)
-    if sample_rate != 16000:
-        waveform = torchaudio.transforms.Resample(
-            orig_freq=sample_rate, new_freq=16000
-        )(waveform)
 
-    return waveform.squeeze(), 16000
+def score_clips(clips: list[np.ndarray], precision: str = "fp32") -> torch.Tensor:
+    """
+    Get the log-probabilities of each language for each clip, running the
+    clips through the model in padded batches.
+    """
+    processor, model = load_lid_model(precision)
+    scores = []
+    for i in range(0, len(clips), LID_BATCH_SIZE):
+        inputs = processor(
+            clips[i : i + LID_BATCH_SIZE],
+            sampling_rate=processor.sampling_rate,
+            padding=True,
+            return_attention_mask=True,
+            return_tensors="pt",
+        )
+        with torch.inference_mode():
+            logits = model(**inputs).logits
+        scores.append(torch.log_softmax(logits, dim=-1))
+    return torch.cat(scores)
 
 
-# Function to identify the language of an audio file
-def identify_language(audio_path: str) -> str:
-    waveform, sample_rate = load_audio(audio_path)
+def identify_languages(
+    audios: list[DecodedAudio],
+    precision: str = "fp32",
+    clips: int = 1,
+    cache: LanguageCache | None = None,
+) -> list[str]:
+    """
+    Identify the language of each decoded audio, from up to `clips` clips of
+    its start. The clips of every audio that isn't already cached are scored
+    in the same batches, and each audio's language is the one with the
+    highest total log-probability over its clips.
+    """
+    file_clips = [get_clips(audio, clips) for audio in audios]
+    keys = [
+        cache.get_key(arrays, precision) if cache is not None else None
+        for arrays in file_clips
+    ]
+    languages: list[str | None] = [
+        cache.get(key) if cache is not None and key is not None else None
+        for key in keys
+    ]
 
-    # Process the waveform to match the input expected by the model
-    inputs = processor(waveform, sampling_rate=sample_rate, return_tensors="pt")
+    missing = [i for i, language in enumerate(languages) if language is None]
+    if missing:
+        _, model = load_lid_model(precision)
+        scores = score_clips(
+            [clip for i in missing for clip in file_clips[i]], precision
+        )
+        start = 0
+        for i in missing:
+            end = start + len(file_clips[i])
+            predicted_id = scores[start:end].sum(dim=0).argmax().item()
+            languages[i] = model.config.id2label[int(predicted_id)]
+            start = end
 
-    # Forward pass through the model
-    with torch.no_grad():
-        logits = model(**inputs).logits
+        if cache is not None:
+            cache.put({keys[i]: languages[i] for i in missing})
 
-    # Get the predicted language ID (class with the highest score)
-    predicted_id = torch.argmax(logits, dim=-1).item()
+    return [language or "" for language in languages]
 
-    # Convert the predicted ID to the corresponding language label
-    language = model.config.id2label[int(predicted_id)]
 
-    return language
+def identify_language(
+    audio: DecodedAudio,
+    precision: str = "fp32",
+    clips: int = 1,
+    cache: LanguageCache | None = None,
+) -> str:
+    """
+    Identify the language of decoded audio.
+    """
+    return identify_languages([audio], precision, clips, cache)[0]
@@ -1,15 +1,19 @@
 import argparse
-import json
 import os
 import time
+from contextlib import nullcontext
 
 from halo import Halo
 
-from model import load_model
+import tracing
+from constants import model_name
+from languages import can_align
+from manifest import MANIFEST_NAME, Manifest
+from model import BACKENDS, PRECISIONS, load_model
 from timestamp_types import File
+from tuning import load_emission_config
 from utils import align_matches, match_files
-
-mms_languages = json.load(open("data/mms_languages.json"))
+from writer import OutputWriter
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -43,6 +47,24 @@ parser.add_argument(
     default=None,
     type=str,
 )
+parser.add_argument(
+    "--per-file-language",
+    help=(
+        "Identify the language of every file instead of assuming they are all "
+        "in the language of the first one. Only used without --language."
+    ),
+    action="store_true",
+)
+parser.add_argument(
+    "--language-clips",
+    help=(
+        "The number of 30 second clips from the start of a file to identify "
+        "its language from. More clips are more reliable for recordings that "
+        "start with music or an introduction in another language. Default is 1."
+    ),
+    default=1,
+    type=int,
+)
 parser.add_argument(
     "-m",
     "--max-silence-padding-ms",
@@ -55,10 +77,133 @@ parser.add_argument(
     default=-1,
     type=int,
 )
+parser.add_argument(
+    "-b",
+    "--batch-size",
+    help=(
+        "The number of audio windows to run through the model at once. "
+        "Larger batches are usually faster on CPU but use more memory. Default is "
+        "1, or the batch size from this machine's tuning profile."
+    ),
+    default=None,
+    type=int,
+)
+parser.add_argument(
+    "--no-tuning",
+    help=(
+        "Ignore this machine's tuning profile (see autotune.py) and use the "
+        "default window length, batch size and thread counts."
+    ),
+    action="store_true",
+)
+parser.add_argument(
+    "--chunk-seconds",
+    help=(
+        "Align long recordings in independent chunks of about this many seconds, "
+        "cut at verse boundaries found a few chunks at a time. This bounds "
+        "memory for hour-long files. Default is 0 (align each file in one go)."
+    ),
+    default=0,
+    type=float,
+)
+parser.add_argument(
+    "--precision",
+    help=(
+        "The numeric precision to run the models in. `int8` quantizes the "
+        "models' linear layers, which is faster on CPU but can move timestamps "
+        "slightly. Default is `fp32`."
+    ),
+    choices=PRECISIONS,
+    default="fp32",
+)
+parser.add_argument(
+    "--backend",
+    help=(
+        "How to run the alignment model: `eager` PyTorch, `torchscript`, "
+        "`compile` (torch.compile) or `onnx` (ONNX Runtime, needs onnxruntime "
+        "and onnxscript). Exported models are cached next to the checkpoint. "
+        "Only supported with fp32 precision. Default is `eager`."
+    ),
+    choices=BACKENDS,
+    default="eager",
+)
+parser.add_argument(
+    "--low-memory",
+    help=(
+        "Keep decoded audio in a memory-mapped temporary file instead of in RAM. "
+        "Useful for multi-hour recordings."
+    ),
+    action="store_true",
+)
+parser.add_argument(
+    "-w",
+    "--workers",
+    help=(
+        "The number of files to align in parallel. Workers share one copy of the "
+        "model and split the CPU threads between them. Default is 1."
+    ),
+    default=1,
+    type=int,
+)
+parser.add_argument(
+    "--pin-workers",
+    help="Pin each worker to its own set of CPUs. Only used with --workers.",
+    action="store_true",
+)
+parser.add_argument(
+    "--cache-dir",
+    help=(
+        "A folder to cache model emissions and identified languages in, so "
+        "re-aligning the same audio skips the models. Default is `emission_cache`."
+    ),
+    default="emission_cache",
+)
+parser.add_argument(
+    "--trace",
+    help=(
+        "Write a Chrome trace of how long each stage took for each file to this "
+        "path (open it in chrome://tracing or https://ui.perfetto.dev), and print "
+        "a summary table with the real-time factor."
+    ),
+    default=None,
+)
+parser.add_argument(
+    "--profile",
+    help=(
+        "Profile the run with `cprofile` (emissions and forced alignment only, "
+        "saved to profile.prof in the output folder) or `torch` (torch.profiler, "
+        "saved to torch_trace.json in the output folder). Needs --workers 1."
+    ),
+    choices=["cprofile", "torch"],
+    default=None,
+)
+parser.add_argument(
+    "--force",
+    help=(
+        f"Realign every pair, even ones the output folder's {MANIFEST_NAME} "
+        "says are already aligned with the same audio, text and options."
+    ),
+    action="store_true",
+)
+parser.add_argument(
+    "--cache-size-mb",
+    help=(
+        "The maximum size of the emission cache in MB. The least recently used "
+        "entries are removed past this size. 0 disables the cache. Default is 1024."
+    ),
+    default=1024,
+    type=float,
+)
 
 
 def main():
     args = parser.parse_args()
+    if args.precision != "fp32" and args.backend != "eager":
+        parser.error("--backend only supports fp32 precision.")
+    if args.language_clips < 1:
+        parser.error("--language-clips must be at least 1.")
+    if args.profile is not None and args.workers > 1:
+        parser.error("--profile needs --workers 1.")
     folder = args.input
     output = args.output.rstrip('/') + '/'  # Ensure output ends with a slash
     separator = args.separator
@@ -66,19 +211,16 @@ def main():
     max_silence_padding_ms = args.max_silence_padding_ms
 
     perf_start_time = time.time()
+    tracer = None
+    if args.trace is not None or args.profile is not None:
+        tracer = tracing.start_tracing()
 
     if language is not None:
         # Check if language is valid.
-        language_match = next(
-            (item for item in mms_languages if item["iso"] == language), None
-        )
-
-        if language_match is None or not language_match["align"]:
+        if not can_align(language):
             print(f"Invalid language detected.")
             exit(0)
 
-    model, dictionary = load_model()
-
     files: list[File] = []
 
     for dirpath, _, filenames in os.walk(folder):
@@ -97,46 +239,110 @@ def main():
 
     spinner.succeed(f"Finished matching files in {folder}.")
 
-    for match in matched_files:
-        if match[0] is None or match[1] is None:
-            continue
-    
-    timestamps = align_matches(
-        folder, language, separator, matched_files, model, dictionary, max_silence_padding_ms
-    )
-    
+    if not matched_files:
+        spinner.fail(f"No matching audio and text files found in {folder}.")
+        exit(0)
+
     # Create output directory if it doesn't exist
     os.makedirs(output, exist_ok=True)
-    
-    # Write each timestamp data item to a separate JSON and SRT file
-    for (text_file, audio_file), timestamp_data in zip(matched_files, timestamps):
-        if text_file is None or audio_file is None:
-            continue
-
-        # Create JSON file
-        base_name = os.path.splitext(text_file[0])[0]  # Use file_name from the tuple
-        output_file = os.path.join(output, f"{base_name}.json")
-        json.dump(timestamp_data, open(output_file, "w"))
-
-        # Create SRT file
-        srt_file = os.path.join(output, f"{base_name}.srt")
-        with open(srt_file, 'w') as f:
-            for i, section in enumerate(timestamp_data['sections'], 1):
-                start_time = section['timings'][0]
-                end_time = section['timings'][1]
-                
-                # Convert timestamps to SRT format (HH:MM:SS,mmm)
-                start_srt = time.strftime('%H:%M:%S,', time.gmtime(start_time)) + f"{int((start_time % 1) * 1000):03d}"
-                end_srt = time.strftime('%H:%M:%S,', time.gmtime(end_time)) + f"{int((end_time % 1) * 1000):03d}"
-                
-                # Write SRT entry
-                f.write(f"{i}\n")
-                f.write(f"{start_srt} --> {end_srt}\n")
-                f.write(f"{section['text']}\n\n")
-    
+
+    # The tuning profile's window length changes the emissions, so it's one of
+    # the options pairs are checked against.
+    emission_config = load_emission_config(args.batch_size, not args.no_tuning)
+
+    # Skip pairs that were already aligned with the same inputs and options.
+    manifest = Manifest(
+        output,
+        folder,
+        {
+            "language": language,
+            "per_file_language": language is None and args.per_file_language,
+            "language_clips": args.language_clips,
+            "separator": separator,
+            "max_silence_padding_ms": max_silence_padding_ms,
+            "chunk_seconds": args.chunk_seconds,
+            "interval": emission_config.interval,
+            "context": emission_config.context,
+            "model": model_name,
+            "precision": args.precision,
+            "backend": args.backend,
+        },
+    )
+    if not args.force:
+        spinner = Halo(text="Checking for pairs that are already aligned...").start()
+        up_to_date = [match for match in matched_files if manifest.is_up_to_date(match)]
+        matched_files = [match for match in matched_files if match not in up_to_date]
+        spinner.succeed(
+            f"Skipping {len(up_to_date)} already aligned pairs, "
+            f"{len(matched_files)} to align."
+        )
+        if not matched_files:
+            spinner.succeed(f"Done in {(time.time() - perf_start_time):.2f} seconds.")
+            exit(0)
+
+    # Hash the inputs before any are aligned, so the manifest records the
+    # files as they were read.
+    manifest.snapshot(matched_files)
+
+    with tracing.span("load_model"):
+        model, dictionary = load_model(args.precision, args.backend)
+    from emission_cache import EmissionCache
+    from lid import LanguageCache
+
+    emission_cache = None
+    language_cache = None
+    if args.cache_size_mb > 0:
+        emission_cache = EmissionCache(
+            args.cache_dir,
+            args.cache_size_mb,
+            model_name,
+            args.precision,
+            args.backend,
+        )
+        language_cache = LanguageCache(args.cache_dir)
+
+    profiling = nullcontext()
+    if args.profile == "cprofile":
+        profiling = tracing.profiling("cprofile", os.path.join(output, "profile.prof"))
+    elif args.profile == "torch":
+        profiling = tracing.profiling("torch", os.path.join(output, "torch_trace.json"))
+
+    # Write each pair's JSON and SRT files as soon as it is aligned, so an
+    # interrupted run can pick up where it stopped.
+    with profiling, OutputWriter(output, manifest) as writer:
+        for match, timestamp_data in align_matches(
+            folder,
+            language,
+            separator,
+            matched_files,
+            model,
+            dictionary,
+            max_silence_padding_ms,
+            emission_config,
+            emission_cache,
+            args.workers,
+            args.pin_workers,
+            args.chunk_seconds,
+            args.low_memory,
+            args.precision,
+            args.per_file_language,
+            args.language_clips,
+            language_cache,
+        ):
+            writer.put(match, timestamp_data)
+
     perf_end_time = time.time()
     
-    spinner.succeed(f"Done in {(perf_end_time - perf_start_time):.2f} seconds.")
+    spinner.succeed(
+        f"Wrote {writer.written} of {len(matched_files)} pairs in "
+        f"{(perf_end_time - perf_start_time):.2f} seconds."
+    )
+
+    if tracer is not None:
+        print(tracer.summary())
+        if args.trace is not None:
+            tracer.export_chrome(args.trace)
+            spinner.succeed(f"Trace written to {args.trace}.")
 
 
 main()
@@ -0,0 +1,160 @@
+"""
+A manifest of the pairs aligned into an output folder, so re-running
+`main.py` on the same folder only aligns pairs whose audio, text or
+parameters have changed, and an interrupted run picks up where it stopped.
+"""
+
+import json
+import os
+import tempfile
+from typing import Any, TypedDict
+
+from timestamp_types import Match
+
+MANIFEST_NAME = "manifest.json"
+
+# Bump this whenever the layout of the manifest changes.
+MANIFEST_VERSION = 1
+
+
+class InputFile(TypedDict):
+    """
+    An input file's content hash, with the size and mtime it was hashed at so
+    unchanged files don't have to be hashed again.
+    """
+
+    path: str
+    size: int
+    mtime_ns: int
+    sha256: str
+
+
+class ManifestEntry(TypedDict):
+    """
+    A pair that has been aligned, and the outputs it was written to.
+    """
+
+    audio: InputFile
+    text: InputFile
+    params: dict[str, Any]
+    outputs: list[str]
+
+
+class Manifest:
+    """
+    The manifest in an output folder. Entries are keyed by the audio file's
+    path relative to the input folder, and the manifest is rewritten after
+    every pair so it is never more than one pair behind the outputs.
+    """
+
+    def __init__(self, output: str, folder: str, params: dict[str, Any]):
+        self.path = os.path.join(output, MANIFEST_NAME)
+        self.folder = folder
+        self.params = params
+        self.entries: dict[str, ManifestEntry] = {}
+        # Inputs already described this run, so files aren't hashed twice.
+        self.inputs: dict[str, tuple[InputFile, InputFile]] = {}
+
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get("version") == MANIFEST_VERSION:
+            self.entries = manifest["entries"]
+
+    def get_key(self, match: Match) -> str:
+        assert match[0] is not None
+        return os.path.relpath(match[0][1], self.folder)
+
+    def get_input_file(self, path: str, previous: InputFile | None) -> InputFile:
+        """
+        Describe an input file, only hashing it if its size or mtime changed
+        since `previous`.
+        """
+        # emission_cache pulls in torch.
+        from emission_cache import hash_file
+
+        stat = os.stat(path)
+        if (
+            previous is not None
+            and previous["path"] == path
+            and previous["size"] == stat.st_size
+            and previous["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return previous
+        return {
+            "path": path,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": hash_file(path),
+        }
+
+    def get_inputs(self, match: Match) -> tuple[InputFile, InputFile]:
+        assert match[0] is not None and match[1] is not None
+        key = self.get_key(match)
+        if key not in self.inputs:
+            entry = self.entries.get(key)
+            self.inputs[key] = (
+                self.get_input_file(match[0][1], entry["audio"] if entry else None),
+                self.get_input_file(match[1][1], entry["text"] if entry else None),
+            )
+        return self.inputs[key]
+
+    def snapshot(self, matches: list[Match]):
+        """
+        Describe the inputs of every pair about to be aligned. Call this before
+        they are dispatched, so that a file edited while its pair is being
+        aligned is recorded as it was, and aligned again on the next run.
+        """
+        for match in matches:
+            self.get_inputs(match)
+
+    def is_up_to_date(self, match: Match) -> bool:
+        """
+        Check whether a pair was aligned with the same audio, text and
+        parameters, and its outputs are still there.
+        """
+        entry = self.entries.get(self.get_key(match))
+        if entry is None or entry["params"] != self.params:
+            return False
+        if not all(os.path.exists(output) for output in entry["outputs"]):
+            return False
+
+        audio, text = self.get_inputs(match)
+        return (
+            audio["sha256"] == entry["audio"]["sha256"]
+            and text["sha256"] == entry["text"]["sha256"]
+        )
+
+    def record(self, match: Match, outputs: list[str]):
+        """
+        Record that a pair has been aligned and written to `outputs`, with the
+        inputs from `snapshot`.
+        """
+        key = self.get_key(match)
+        audio, text = self.inputs[key]
+        self.entries[key] = {
+            "audio": audio,
+            "text": text,
+            "params": self.params,
+            "outputs": outputs,
+        }
+        self.save()
+
+    def save(self):
+        # Write to a temp file and rename it into place so that an
+        # interrupted run never leaves a half-written manifest.
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": MANIFEST_VERSION, "entries": self.entries},
+                    f,
+                    indent=2,
+                )
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
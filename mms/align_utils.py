@@ -1,23 +1,47 @@
 import math
+import os
 import re
 import subprocess
 import tempfile
+import threading
 from dataclasses import dataclass
 from typing import Any, List, TypedDict, Union
 
-import sox
 import torch
-import torchaudio
 import torchaudio.functional as F
 from torchaudio.models import wav2vec2_model
 
+import tracing
+from audio import SAMPLING_FREQ, DecodedAudio
 from constants import dict_name, model_name
+from emission_cache import EmissionCache
 
-SAMPLING_FREQ = 16000
 EMISSION_INTERVAL = 30
+EMISSION_CONTEXT = 0.1
+# (channels, kernel size, stride) of the model's feature extractor convolutions
+CONV_LAYER_CONFIG = [
+    (512, 10, 5),
+    (512, 3, 2),
+    (512, 3, 2),
+    (512, 3, 2),
+    (512, 3, 2),
+    (512, 2, 2),
+    (512, 2, 2),
+]
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
+@dataclass
+class EmissionConfig:
+    """
+    How audio is split into windows for the acoustic model.
+    """
+
+    interval: float = EMISSION_INTERVAL  # seconds of emissions per window
+    context: float = EMISSION_CONTEXT  # extra audio each side, as a fraction of interval
+    batch_size: int = 1  # windows run through the model at once
+
+
 class MMSSegment(TypedDict):
     begin: float
     end: float
@@ -64,12 +88,56 @@ def normalize_uroman(text: str):
     return text.strip()
 
 
-def get_uroman_tokens(norm_transcripts: List[str], iso: Union[str, None] = None):
+# The uroman rules are loaded once per process (for all languages) and shared
+# by every thread in it. uroman keeps an internal romanization cache, so calls
+# into it are serialized with a lock.
+_uroman: Any = None
+_uroman_lock = threading.Lock()
+
+
+def _reset_uroman_lock():
+    global _uroman_lock
+    _uroman_lock = threading.Lock()
+
+
+# A forked worker inherits the loaded rules, but needs a fresh lock in case
+# another thread held it at the time of the fork.
+os.register_at_fork(after_in_child=_reset_uroman_lock)
+
+
+def get_uroman():
+    global _uroman
+    with _uroman_lock:
+        if _uroman is None:
+            from uroman import Uroman
+            from uroman.uroman import DEFAULT_ROM_MAX_CACHE_SIZE
+
+            # Same settings as the uroman CLI.
+            _uroman = Uroman(cache_size=DEFAULT_ROM_MAX_CACHE_SIZE)
+        return _uroman
+
+
+def romanize_lines(lines: List[str], iso: Union[str, None] = None):
+    """
+    Romanize each line with the in-process uroman engine.
+    """
+    lcode = iso if iso and iso in special_isos_uroman else None
+    uroman = get_uroman()
+    with _uroman_lock:
+        return [uroman.romanize_string(line, lcode=lcode) for line in lines]
+
+
+def romanize_lines_cli(lines: List[str], iso: Union[str, None] = None):
+    """
+    Romanize each line by running the uroman CLI. This starts a new
+    interpreter and reloads all of uroman's rules, so it's only kept around to
+    check `romanize_lines` against.
+    """
     normalized_file = tempfile.NamedTemporaryFile()
     uroman_file = tempfile.NamedTemporaryFile()
 
     with open(normalized_file.name, "w", encoding="utf-8") as f:
-        for t in norm_transcripts:
+        for t in lines:
             f.write(t + "\n")
 
     cmd = ["uroman", "-i", normalized_file.name, "-o", uroman_file.name]
@@ -79,12 +147,16 @@ def get_uroman_tokens(norm_transcripts: List[str], iso: Union[str, None] = None)
 
     subprocess.run(cmd, check=True)
 
-    outtexts = []
     with open(uroman_file.name, encoding="utf-8") as f:
-        for line in f:
-            line = " ".join(line.strip())
-            line = re.sub(r"\s+", " ", line).strip()
-            outtexts.append(line)
+        return [line.rstrip("\n") for line in f]
+
+
+def get_uroman_tokens(norm_transcripts: List[str], iso: Union[str, None] = None):
+    outtexts = []
+    for line in romanize_lines(norm_transcripts, iso):
+        line = " ".join(line.strip())
+        line = re.sub(r"\s+", " ", line).strip()
+        outtexts.append(line)
     assert len(outtexts) == len(norm_transcripts)
     uromans: List[str] = []
     for ot in outtexts:
@@ -92,7 +164,7 @@ def get_uroman_tokens(norm_transcripts: List[str], iso: Union[str, None] = None)
     return uromans
 
 
-@dataclass
+@dataclass(slots=True)
 class Segment:
     label: str
     start: int # start frame
@@ -106,15 +178,20 @@ class Segment:
         return self.end - self.start
 
 
-def merge_repeats(path: List[Any], idx_to_token_map: dict[int, str]):
-    i1, i2 = 0, 0
-    segments: List[Segment] = []
-    while i1 < len(path):
-        while i2 < len(path) and path[i1] == path[i2]:
-            i2 += 1
-        segments.append(Segment(idx_to_token_map[path[i1]], i1, i2 - 1))
-        i1 = i2
-    return segments
+def merge_repeats(path: torch.Tensor, idx_to_token: List[str]):
+    """
+    Merge runs of the same token in a frame path (1D tensor of token indices)
+    into Segments. Runs are found with a run-length encoding of the path
+    tensor instead of walking it frame by frame.
+    """
+    labels, counts = torch.unique_consecutive(path.to("cpu"), return_counts=True)
+    ends = torch.cumsum(counts, dim=0)
+    starts = (ends - counts).tolist()
+    ends = (ends - 1).tolist()
+    return [
+        Segment(idx_to_token[label], start, end)
+        for label, start, end in zip(labels.tolist(), starts, ends)
+    ]
 
 
 def time_to_frame(time: float):
@@ -128,35 +205,34 @@ def get_spans(tokens: List[str], segments: List[Segment], max_silence_padding_fr
     Given a list of tokens (text strings), get the spans that correspond to the tokens.
         (each span is a List of Segments) 
     """
-    ltr_idx = 0
-    tokens_idx = 0
-    intervals = []
-    start, end = (0, 0)
     sil = "<blank>" # silence label
 
+    # Every letter of every token is aligned to exactly one non-silence
+    # segment, in order, so each token's interval of segment indices can be
+    # read off from the letter offsets instead of walking the segments.
+    token_letters = [token.split(" ") if token else [] for token in tokens]
+    letters = [letter for token in token_letters for letter in token]
+    letter_segments = [
+        seg_idx for seg_idx, seg in enumerate(segments) if seg.label != sil
+    ]
+    assert len(letter_segments) == len(letters)
+    assert [segments[seg_idx].label for seg_idx in letter_segments] == letters
+    # Only a single trailing silence can follow the last letter.
+    assert not letter_segments or letter_segments[-1] >= len(segments) - 2
+
     # Create intervals of segment indices that correspond to tokens
-    for seg_idx, seg in enumerate(segments):
-        if tokens_idx == len(tokens):
-            assert seg_idx == len(segments) - 1
-            assert seg.label == "<blank>"
-            continue
-        cur_token = tokens[tokens_idx].split(" ")
-        ltr = cur_token[ltr_idx]
-        if seg.label == "<blank>":
+    intervals = []
+    offset = 0
+    for token, cur_token in zip(tokens, token_letters):
+        if len(token) == 0 and intervals:
+            # Empty tokens get an empty interval at the end of the previous one
+            intervals.append((intervals[-1][1], intervals[-1][1]))
             continue
-        assert seg.label == ltr
-        if (ltr_idx) == 0:
-            start = seg_idx
-        if ltr_idx == len(cur_token) - 1:
-            # Done with the current token
-            ltr_idx = 0
-            tokens_idx += 1
-            intervals.append((start, seg_idx))
-            while tokens_idx < len(tokens) and len(tokens[tokens_idx]) == 0:
-                intervals.append((seg_idx, seg_idx))
-                tokens_idx += 1
-        else:
-            ltr_idx += 1
+        intervals.append(
+            (letter_segments[offset], letter_segments[offset + len(cur_token) - 1])
+        )
+        offset += len(cur_token)
+
     spans: List[List[Segment]] = []
 
     # Build spans from the intervals, adding silence padding to the start / end
@@ -196,77 +272,219 @@ def get_spans(tokens: List[str], segments: List[Segment], max_silence_padding_fr
     return spans
 
 
-def generate_emissions(model: Any, audio_file: str):
-    waveform, _ = torchaudio.load(audio_file)  # waveform: channels X T
-    waveform = waveform.to(DEVICE)
-    total_duration = sox.file_info.duration(audio_file)
+def get_windows(total_duration: float, config: EmissionConfig):
+    """
+    Split audio of `total_duration` seconds into model windows. Each window is
+    (input start sample, input end sample, first frame, end frame) where the
+    frames are the part of the window's output to keep, relative to the start
+    of its input.
+    """
+    windows: List[tuple[int, int, int, int]] = []
+    i: float = 0
+    while i < total_duration:
+        segment_start_time, segment_end_time = (i, i + config.interval)
+
+        context = config.interval * config.context
+        input_start_time = max(segment_start_time - context, 0)
+        input_end_time = min(segment_end_time + context, total_duration)
+
+        offset = time_to_frame(input_start_time)
+        windows.append(
+            (
+                int(SAMPLING_FREQ * input_start_time),
+                int(SAMPLING_FREQ * (input_end_time)),
+                time_to_frame(segment_start_time) - offset,
+                time_to_frame(segment_end_time) - offset,
+            )
+        )
+        i += config.interval
+    return windows
+
+
+def get_num_frames(num_samples: int):
+    """
+    Get the number of frames the model outputs for `num_samples` of audio.
+    """
+    for _, kernel_size, stride in CONV_LAYER_CONFIG:
+        num_samples = (num_samples - kernel_size) // stride + 1
+    return max(num_samples, 0)
 
-    assert total_duration, "Could not get duration of audio file"
 
-    audio_sf = sox.file_info.sample_rate(audio_file)
-    assert audio_sf == SAMPLING_FREQ
+def generate_emissions(
+    model: Any, audio: DecodedAudio, config: EmissionConfig | None = None
+):
+    """
+    Run the model over the audio window by window and return the log-softmax
+    emissions for the whole file along with the stride (ms per frame). The
+    emissions have an extra all-zero column at the end for the <star> token.
 
-    emissions_arr = []
-    with torch.inference_mode():
-        i: float = 0
-        while i < total_duration:
-            segment_start_time, segment_end_time = (i, i + EMISSION_INTERVAL)
+    Only one batch of windows is converted to float at a time, and every
+    window's log-probs are written straight into a single preallocated
+    T x (V + 1) buffer, so peak memory is about one batch plus the output.
 
-            context = EMISSION_INTERVAL * 0.1
-            input_start_time = max(segment_start_time - context, 0)
-            input_end_time = min(segment_end_time + context, total_duration)
-            waveform_split = waveform[
-                :,
-                int(SAMPLING_FREQ * input_start_time) : int(
-                    SAMPLING_FREQ * (input_end_time)
-                ),
-            ]
+    With `config.batch_size` > 1, windows are zero-padded to the longest
+    window in their batch and passed to the model with their lengths so
+    padding is masked out.
+    """
+    config = config or EmissionConfig()
+    total_duration = audio.duration
 
-            model_outs, _ = model(waveform_split)
-            emissions_ = model_outs[0]
-            emission_start_frame = time_to_frame(segment_start_time)
-            emission_end_frame = time_to_frame(segment_end_time)
-            offset = time_to_frame(input_start_time)
+    assert total_duration, f"No audio decoded from {audio.path}"
+    assert audio.sample_rate == SAMPLING_FREQ
 
-            emissions_ = emissions_[
-                emission_start_frame - offset : emission_end_frame - offset, :
-            ]
-            emissions_arr.append(emissions_)
-            i += EMISSION_INTERVAL
+    windows = get_windows(total_duration, config)
+    total_frames = sum(
+        max(0, min(end_frame, get_num_frames(end - start)) - start_frame)
+        for start, end, start_frame, end_frame in windows
+    )
 
-    emissions = torch.cat(emissions_arr, dim=0).squeeze()
-    emissions = torch.log_softmax(emissions, dim=-1)
+    # int8 and ONNX models always run on the CPU, so follow the model's device.
+    device = get_device(model)
+    emissions: torch.Tensor | None = None
+    num_frames = 0
+    with torch.inference_mode():
+        for batch_start in range(0, len(windows), config.batch_size):
+            batch = windows[batch_start : batch_start + config.batch_size]
+            with tracing.span(
+                "emission_window",
+                start_seconds=batch[0][0] / SAMPLING_FREQ,
+                windows=len(batch),
+            ):
+                waveform_splits = [
+                    audio.waveform(start, end)[0].to(device)
+                    for start, end, _, _ in batch
+                ]
+
+                if len(batch) == 1:
+                    model_outs, _ = model(waveform_splits[0].unsqueeze(0))
+                    frame_counts = [model_outs.size(1)]
+                else:
+                    lengths = torch.tensor(
+                        [split.size(0) for split in waveform_splits], device=device
+                    )
+                    padded = torch.nn.utils.rnn.pad_sequence(
+                        waveform_splits, batch_first=True
+                    )
+                    model_outs, out_lengths = model(padded, lengths)
+                    frame_counts = out_lengths.tolist()
+
+                if emissions is None:
+                    emissions = torch.zeros(
+                        total_frames, model_outs.size(2) + 1, device=device
+                    )
+
+                # Only keep the frames for each window's own (unpadded) audio.
+                for j, (_, _, start_frame, end_frame) in enumerate(batch):
+                    end_frame = min(end_frame, int(frame_counts[j]))
+                    window_emissions = model_outs[j, start_frame:end_frame, :]
+                    end = num_frames + window_emissions.size(0)
+                    emissions[num_frames:end, :-1] = torch.log_softmax(
+                        window_emissions, dim=-1
+                    )
+                    num_frames = end
+
+    assert emissions is not None and num_frames == total_frames
+
+    return emissions, get_stride(audio, emissions.size(0))
+
+
+def get_device(model: Any) -> torch.device:
+    """
+    Get the device a model (or inference backend) runs on.
+    """
+    device = getattr(model, "device", None)
+    if isinstance(device, torch.device):
+        return device
+    return next(model.parameters()).device
 
-    stride = float(waveform.size(1) * 1000 / emissions.size(0) / SAMPLING_FREQ)
 
-    return emissions, stride
+def get_stride(audio: DecodedAudio, num_frames: int):
+    """
+    Get the ms of audio per emission frame.
+    """
+    return float(audio.num_samples * 1000 / num_frames / SAMPLING_FREQ)
 
 
 def get_alignments(
-    audio_file: str,
+    audio: DecodedAudio,
     tokens: List[str],
     model: Any,
     dictionary: dict[str, int],
+    emission_config: EmissionConfig | None = None,
+    emission_cache: EmissionCache | None = None,
+    chunk_seconds: float = 0,
 ):
+    """
+    Align the tokens to the audio and return the Segments along with the
+    stride (ms per frame). With `chunk_seconds` > 0, the alignment is done in
+    chunks of about that length (see `force_align_anchored`).
+    """
+    emission_config = emission_config or EmissionConfig()
+
+    # Generate emissions, or reuse them if this audio has been seen before.
+    with tracing.span("emissions", file=audio.path) as span_args:
+        emissions = None
+        if emission_cache is not None:
+            cache_key = emission_cache.get_key(
+                audio, emission_config.interval, emission_config.context
+            )
+            emissions = emission_cache.get(cache_key)
+        span_args["cached"] = emissions is not None
+
+        if emissions is None:
+            emissions, stride = generate_emissions(model, audio, emission_config)
+            if emission_cache is not None:
+                emission_cache.put(cache_key, emissions)
+        else:
+            # Put them where freshly generated emissions would be, which is
+            # the CPU for int8 and ONNX models.
+            emissions = emissions.to(get_device(model))
+            stride = get_stride(audio, emissions.size(0))
+    chunk_frames = int(chunk_seconds * 1000 / stride)
 
-    # Generate emissions
-    emissions, stride = generate_emissions(model, audio_file)
-    T, _ = emissions.size()
+    # Force Alignment
+    if not tokens:
+        print(f"Empty transcript for audio file {audio.path}.")
+
+    idx_to_token = [""] * len(dictionary)
+    for token, idx in dictionary.items():
+        idx_to_token[idx] = token
+
+    with tracing.span("forced_align", file=audio.path, frames=emissions.size(0)):
+        if chunk_frames > 0:
+            segments = force_align_anchored(
+                emissions, tokens, dictionary, idx_to_token, chunk_frames
+            )
+        else:
+            path = force_align(
+                emissions, get_token_indices(tokens, dictionary), dictionary
+            )
+            segments = merge_repeats(path, idx_to_token)
 
-    emissions = torch.cat([emissions, torch.zeros(T, 1).to(DEVICE)], dim=1)
+    return segments, stride
 
-    # Force Alignment
-    if tokens:
-        token_indices = [
-            dictionary[c] for c in " ".join(tokens).split(" ") if c in dictionary
-        ]
-    else:
-        print(f"Empty transcript for audio file {audio_file}.")
-        token_indices = []
 
-    blank = dictionary["<blank>"]
+def get_token_indices(tokens: List[str], dictionary: dict[str, int]):
+    return [dictionary[c] for c in " ".join(tokens).split(" ") if c in dictionary]
+
+
+def get_required_frames(token_indices: List[int]):
+    """
+    Get the minimum number of frames a CTC path through the tokens needs: one
+    per token, plus a blank between repeated tokens.
+    """
+    repeats = sum(1 for a, b in zip(token_indices, token_indices[1:]) if a == b)
+    return len(token_indices) + repeats
 
-    targets = torch.tensor(token_indices, dtype=torch.int32).to(DEVICE)
+
+def force_align(
+    emissions: torch.Tensor, token_indices: List[int], dictionary: dict[str, int]
+):
+    """
+    Force align emissions (T x V) to the token indices and return the frame
+    path as a 1D tensor of token indices.
+    """
+    targets = torch.tensor(token_indices, dtype=torch.int32).to(emissions.device)
 
     input_lengths = torch.tensor(emissions.shape[0]).unsqueeze(-1)
     target_lengths = torch.tensor(targets.shape[0]).unsqueeze(-1)
@@ -276,30 +494,228 @@ def get_alignments(
         targets.unsqueeze(0),
         input_lengths,
         target_lengths,
-        blank=blank,
+        blank=dictionary["<blank>"],
     )
+    return path[0]
 
-    path = path.squeeze().to("cpu").tolist()
-    idx_to_token_map = {v: k for k, v in dictionary.items()}
-    segments = merge_repeats(path, idx_to_token_map)
 
-    return segments, stride
+# How many chunks of audio each window force_align_anchored aligns to find a
+# cut covers. Cuts are only taken from all but the last chunk of a window, so
+# they don't depend on where the window happened to end.
+ANCHOR_WINDOW_CHUNKS = 3
 
+# How much better than the best token <star> scores when it takes the audio
+# left over at the end of a window.
+STAR_BONUS = 0.1
+
+
+def get_required_frames_between(token_indices: List[int]):
+    """
+    Get a function giving `get_required_frames(token_indices[a:b])` in
+    constant time.
+    """
+    repeats = [0]
+    for a, b in zip(token_indices, token_indices[1:]):
+        repeats.append(repeats[-1] + (a == b))
+
+    def required_frames(start: int, end: int) -> int:
+        if end <= start:
+            return 0
+        return end - start + repeats[end - 1] - repeats[start]
+
+    return required_frames
 
-def get_model_and_dict():
-    state_dict = torch.load(model_name, map_location="cpu", weights_only=True)
 
-    model = wav2vec2_model(
+def find_cut(
+    emissions: torch.Tensor,
+    token_indices: List[int],
+    boundaries: dict[int, int],
+    dictionary: dict[str, int],
+    chunk_start: tuple[int, int, int],
+    chunk_frames: int,
+    window_frames: int,
+) -> tuple[tuple[int, int, int] | None, bool]:
+    """
+    Find where to cut the chunk starting at `chunk_start` (a token index,
+    frame and target index): the middle of the silence before the first
+    verse that starts `chunk_frames` or more frames in. Only the
+    `window_frames` frames after the chunk start are aligned, against an
+    estimate of the targets they hold followed by <star>, which absorbs
+    whatever audio is left over. Returns the cut, if one was found, and
+    whether the window reached the end of the file.
+    """
+    blank = dictionary["<blank>"]
+    star = dictionary["<star>"]
+    _, start, start_target = chunk_start
+    T = emissions.size(0)
+    required_frames = get_required_frames_between(token_indices)
+
+    end = min(T, start + window_frames)
+    last = end == T
+    window = emissions[start:end]
+    remaining = len(token_indices) - start_target
+    if last:
+        count = remaining
+        targets = token_indices[start_target:]
+        # Cuts near the end of a window that doesn't reach the end of the file
+        # could move once more of the file is aligned.
+        commit_end = T
+    else:
+        # Slightly fewer targets than the average rate of speech would put
+        # in the window, so that they all fit and <star> takes the rest.
+        rate = remaining / (T - start)
+        count = min(remaining, max(1, math.floor(rate * (end - start) * 0.8)))
+        # Leave room for <star> and the blank that may have to precede it.
+        while count > 1 and required_frames(start_target, start_target + count) > (
+            end - start - 2
+        ):
+            count -= 1
+        targets = token_indices[start_target : start_target + count] + [star]
+        commit_end = start + (end - start) * (
+            ANCHOR_WINDOW_CHUNKS - 1
+        ) // ANCHOR_WINDOW_CHUNKS
+        # Make <star> a little better than any token, so the targets end as
+        # early as the audio allows rather than spreading out over the audio
+        # <star> should take.
+        window = window.clone()
+        window[:, star] = (
+            torch.cat([window[:, :star], window[:, star + 1 :]], dim=1)
+            .max(dim=1)
+            .values
+            + STAR_BONUS
+        )
+
+    while True:
+        path = force_align(window, targets, dictionary).to("cpu")
+        labels, counts = torch.unique_consecutive(path, return_counts=True)
+        ends = torch.cumsum(counts, dim=0)
+        is_target = labels != blank
+        target_starts = ((ends - counts)[is_target] + start).tolist()
+        target_ends = ((ends - 1)[is_target] + start).tolist()
+        # If <star> only starts late in the window, there may have been more
+        # targets than the window has audio for, squeezed in wherever it was
+        # cheapest. Retry with fewer.
+        if last or count == 1 or target_starts[-1] <= commit_end:
+            break
+        count = count * 3 // 4
+        targets = token_indices[start_target : start_target + count] + [star]
+
+    candidates = [
+        offset
+        for offset in range(start_target + 1, start_target + count)
+        if offset in boundaries
+    ]
+    if not last:
+        # Nothing after the last verse holds it in place, so it, and the
+        # silence before it, can still drift towards <star>.
+        candidates = candidates[:-1]
+    for target_offset in candidates:
+        gap_start = target_ends[target_offset - start_target - 1] + 1
+        gap_end = target_starts[target_offset - start_target]
+        if gap_end > commit_end:
+            break
+        frame = (gap_start + gap_end) // 2
+        chunk_length = frame - start
+        if (
+            gap_end > gap_start
+            and chunk_length >= chunk_frames
+            and required_frames(start_target, target_offset) <= chunk_length
+            # The rest of the file has to fit its tokens too.
+            and required_frames(target_offset, len(token_indices)) <= T - frame
+        ):
+            return (boundaries[target_offset], frame, target_offset), last
+    return None, last
+
+
+def force_align_anchored(
+    emissions: torch.Tensor,
+    tokens: List[str],
+    dictionary: dict[str, int],
+    idx_to_token: List[str],
+    chunk_frames: int,
+):
+    """
+    Force align long audio in independent chunks of roughly `chunk_frames`
+    frames, so memory is bounded by the chunk size rather than the length of
+    the file.
+
+    Chunks are cut at verse boundaries with silence between them. To find
+    them, a window of a few chunks after the last cut is aligned against the
+    verses expected in it (see `find_cut`), so this pass is bounded too. Each
+    chunk's emissions and tokens are then aligned on their own. This
+    approximates aligning the whole file at once: the spans match when the
+    emissions are clear, but segments can differ where they are ambiguous.
+    """
+    T = emissions.size(0)
+
+    token_targets = [get_token_indices([token], dictionary) for token in tokens]
+    token_indices = [idx for targets in token_targets for idx in targets]
+
+    if T <= chunk_frames:
+        path = force_align(emissions, token_indices, dictionary)
+        return merge_repeats(path, idx_to_token)
+
+    # The token each verse starts at, keyed by its first target's index.
+    boundaries = {}
+    target_offset = 0
+    for token_idx, targets in enumerate(token_targets):
+        if targets and target_offset > 0:
+            boundaries[target_offset] = token_idx
+        target_offset += len(targets)
+
+    # Each cut is the (token index, frame, target index) a chunk starts at.
+    cuts: List[tuple[int, int, int]] = [(0, 0, 0)]
+    window_frames = ANCHOR_WINDOW_CHUNKS * chunk_frames
+    while True:
+        cut, done = find_cut(
+            emissions,
+            token_indices,
+            boundaries,
+            dictionary,
+            cuts[-1],
+            chunk_frames,
+            window_frames,
+        )
+        if cut is not None:
+            cuts.append(cut)
+            window_frames = ANCHOR_WINDOW_CHUNKS * chunk_frames
+        elif done:
+            break
+        else:
+            # No verse boundary to cut at in this window, so look further.
+            window_frames += chunk_frames
+    cuts.append((len(tokens), T, len(token_indices)))
+
+    # Align each chunk on its own and stitch the segments together.
+    segments: List[Segment] = []
+    for (start_token, start_frame, _), (end_token, end_frame, _) in zip(
+        cuts, cuts[1:]
+    ):
+        chunk_indices = get_token_indices(tokens[start_token:end_token], dictionary)
+        path = force_align(emissions[start_frame:end_frame], chunk_indices, dictionary)
+        for segment in merge_repeats(path, idx_to_token):
+            segment.start += start_frame
+            segment.end += start_frame
+            if (
+                segments
+                and segment.label == segments[-1].label == "<blank>"
+                and segments[-1].end + 1 == segment.start
+            ):
+                # Silence that runs across a cut is a single segment.
+                segments[-1].end = segment.end
+            else:
+                segments.append(segment)
+
+    return segments
+
+
+def build_model():
+    """
+    Build the MMS alignment model architecture with untrained weights.
+    """
+    return wav2vec2_model(
         extractor_mode="layer_norm",
-        extractor_conv_layer_config=[
-            (512, 10, 5),
-            (512, 3, 2),
-            (512, 3, 2),
-            (512, 3, 2),
-            (512, 3, 2),
-            (512, 2, 2),
-            (512, 2, 2),
-        ],
+        extractor_conv_layer_config=CONV_LAYER_CONFIG,
         extractor_conv_bias=True,
         encoder_embed_dim=1024,
         encoder_projection_dropout=0.0,
@@ -315,11 +731,23 @@ def get_model_and_dict():
         encoder_layer_drop=0.1,
         aux_num_out=31,
     )
+
+
+def get_model():
+    state_dict = torch.load(model_name, map_location="cpu", weights_only=True)
+
+    model = build_model()
     model.load_state_dict(state_dict)
     model.eval()
+    return model
 
+
+def get_dictionary():
     dictionary = {}
     with open(dict_name, encoding="utf-8") as f:
         dictionary = {l.strip(): i for i, l in enumerate(f.readlines())}
+    return dictionary
+
 
-    return model, dictionary
+def get_model_and_dict():
+    return get_model(), get_dictionary()
@@ -1,103 +1,147 @@
 import re
 import unicodedata
+from functools import lru_cache
 
 from mms.norm_config import norm_config
 
+# always text inside brackets with numbers in them. Usually corresponds to "(Sam 23:17)"
+bracket_numbers_pattern = re.compile(r"\([^\)]*\d[^\)]*\)")
+brackets_pattern = re.compile(r"\([^\)]*\)")
+spaces_pattern = re.compile(r"\s+")
 
-def text_normalize(
-    text: str,
-    iso_code: str,
-    lower_case: bool = True,
-    remove_numbers: bool = True,
-    remove_brackets: bool = False,
-):
-    """Given a text, normalize it by changing to lower case, removing punctuations, removing words that only contain digits and removing extra spaces
 
-    Args:
-        text : The string to be normalized
-        iso_code :
-        remove_numbers : Boolean flag to specify if words containing only digits should be removed
+def is_literal(pattern: str, replacement: str):
+    """Check if a mapping entry is a plain string replacement rather than a regex."""
+    return re.escape(pattern) == pattern and "\\" not in replacement
 
-    Returns:
-        normalized_text : the string after all normalization
 
+class Normalizer:
+    """
+    Text normalization for a single language. All of the language's patterns
+    are compiled once up front and the shared `norm_config` is never modified,
+    so one instance can be used from several threads.
     """
 
-    config = norm_config.get(iso_code, norm_config["*"])
-
-    for field in [
-        "lower_case",
-        "punc_set",
-        "del_set",
-        "mapping",
-        "digit_set",
-        "unicode_norm",
-    ]:
-        if field not in config:
-            config[field] = norm_config["*"][field]
-
-    text = unicodedata.normalize(config["unicode_norm"], text)
+    def __init__(self, iso_code: str):
+        config = {**norm_config["*"], **norm_config.get(iso_code, {})}
+
+        self.iso_code = iso_code
+        self.unicode_norm = config["unicode_norm"]
+        self.lower_case = config["lower_case"]
+
+        # Runs of plain string replacements are merged into a single pass over
+        # the text, regex mappings are applied one at a time in their original
+        # order.
+        self.mapping: list[tuple[re.Pattern, object]] = []
+        literals: dict[str, str] = {}
+        for old, new in config["mapping"].items():
+            if is_literal(old, new):
+                literals[old] = new
+                continue
+            self._add_literals(literals)
+            literals = {}
+            self.mapping.append((re.compile(old), new))
+        self._add_literals(literals)
+
+        # Replace punctutations with space
+        self.punct_pattern = re.compile(r"[" + config["punc_set"] + "]")
+
+        # remove characters in delete list
+        self.delete_pattern = re.compile(r"[" + config["del_set"] + "]")
+
+        # Remove words containing only digits
+        # We check for 3 cases  a)text starts with a number b) a number is present somewhere in the middle of the text c) the text ends with a number
+        # For each case we use lookaround regex pattern to see if the digit pattern in preceded and followed by whitespaces, only then we replace the numbers with space
+        # The lookaround enables overlapping pattern matches to be replaced
+        digits_pattern = "[" + config["digit_set"] + "]+"
+        self.digits_pattern = re.compile(
+            r"^"
+            + digits_pattern
+            + r"(?=\s)|(?<=\s)"
+            + digits_pattern
+            + r"(?=\s)|(?<=\s)"
+            + digits_pattern
+            + "$"
+        )
 
-    # Convert to lower case
+        self.unidecode = None
+        if config["rm_diacritics"]:
+            from unidecode import unidecode
 
-    if config["lower_case"] and lower_case:
-        text = text.lower()
+            self.unidecode = unidecode
 
-    # brackets
+    def _add_literals(self, literals: dict[str, str]):
+        if not literals:
+            return
+        table = dict(literals)
+        pattern = re.compile("|".join(re.escape(old) for old in table))
+        self.mapping.append((pattern, lambda match: table[match.group(0)]))
 
-    # always text inside brackets with numbers in them. Usually corresponds to "(Sam 23:17)"
-    text = re.sub(r"\([^\)]*\d[^\)]*\)", " ", text)
-    if remove_brackets:
-        text = re.sub(r"\([^\)]*\)", " ", text)
+    def normalize(
+        self,
+        text: str,
+        lower_case: bool = True,
+        remove_numbers: bool = True,
+        remove_brackets: bool = False,
+    ) -> str:
+        text = unicodedata.normalize(self.unicode_norm, text)
 
-    # Apply mappings
+        # Convert to lower case
 
-    for old, new in config["mapping"].items():
-        text = re.sub(old, new, text)
+        if self.lower_case and lower_case:
+            text = text.lower()
 
-    # Replace punctutations with space
+        # brackets
 
-    punct_pattern = r"[" + config["punc_set"]
+        text = bracket_numbers_pattern.sub(" ", text)
+        if remove_brackets:
+            text = brackets_pattern.sub(" ", text)
 
-    punct_pattern += "]"
+        # Apply mappings
 
-    normalized_text = re.sub(punct_pattern, " ", text)
+        for pattern, replacement in self.mapping:
+            text = pattern.sub(replacement, text)  # type: ignore
 
-    # remove characters in delete list
+        normalized_text = self.punct_pattern.sub(" ", text)
+        normalized_text = self.delete_pattern.sub("", normalized_text)
 
-    delete_patten = r"[" + config["del_set"] + "]"
+        if remove_numbers:
+            normalized_text = self.digits_pattern.sub(" ", normalized_text)
 
-    normalized_text = re.sub(delete_patten, "", normalized_text)
+        if self.unidecode is not None:
+            normalized_text = self.unidecode(normalized_text)
 
-    # Remove words containing only digits
-    # We check for 3 cases  a)text starts with a number b) a number is present somewhere in the middle of the text c) the text ends with a number
-    # For each case we use lookaround regex pattern to see if the digit pattern in preceded and followed by whitespaces, only then we replace the numbers with space
-    # The lookaround enables overlapping pattern matches to be replaced
+        # Remove extra spaces
+        normalized_text = spaces_pattern.sub(" ", normalized_text).strip()
 
-    if remove_numbers:
+        return normalized_text
 
-        digits_pattern = "[" + config["digit_set"]
 
-        digits_pattern += "]+"
+@lru_cache(maxsize=None)
+def get_normalizer(iso_code: str) -> Normalizer:
+    """Get the normalizer for a language, building it on first use."""
+    return Normalizer(iso_code if iso_code in norm_config else "*")
 
-        complete_digit_pattern = (
-            r"^"
-            + digits_pattern
-            + r"(?=\s)|(?<=\s)"
-            + digits_pattern
-            + r"(?=\s)|(?<=\s)"
-            + digits_pattern
-            + "$"
-        )
 
-        normalized_text = re.sub(complete_digit_pattern, " ", normalized_text)
+def text_normalize(
+    text: str,
+    iso_code: str,
+    lower_case: bool = True,
+    remove_numbers: bool = True,
+    remove_brackets: bool = False,
+):
+    """Given a text, normalize it by changing to lower case, removing punctuations, removing words that only contain digits and removing extra spaces
 
-    if config["rm_diacritics"]:
-        from unidecode import unidecode
+    Args:
+        text : The string to be normalized
+        iso_code :
+        remove_numbers : Boolean flag to specify if words containing only digits should be removed
 
-        normalized_text = unidecode(normalized_text)
+    Returns:
+        normalized_text : the string after all normalization
 
-    # Remove extra spaces
-    normalized_text = re.sub(r"\s+", " ", normalized_text).strip()
+    """
 
-    return normalized_text
+    return get_normalizer(iso_code).normalize(
+        text, lower_case, remove_numbers, remove_brackets
+    )
@@ -1,13 +1,78 @@
 import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Callable
 
-import torch
 from halo import Halo
 
-from constants import dict_name, dict_url, model_name, model_url
-from mms.align_utils import DEVICE, get_model_and_dict
+from constants import dict_name, dict_url, lid_model_id, model_name, model_url
 
+# Models loaded in this process, keyed by name. Each model is only loaded the
+# first time it is requested and is then kept warm for the life of the process.
+models: dict[str, Any] = {}
+
+# Load time (in seconds) and resident memory growth (in MB) for each model.
+model_stats: dict[str, dict[str, float]] = {}
+
+# Numeric precisions models can be run in. int8 applies dynamic quantization
+# to the Linear layers, which hold almost all of the weights and compute.
+PRECISIONS = ["fp32", "int8"]
+
+# Ways of running the alignment model, see backends.py.
+BACKENDS = ["eager", "torchscript", "compile", "onnx"]
+
+
+def get_rss_mb() -> float:
+    """
+    Get the current resident set size of this process in MB.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except OSError:
+        # No procfs (e.g. macOS), fall back to the peak RSS.
+        return get_peak_rss_mb()
+
+
+def get_peak_rss_mb() -> float:
+    """
+    Get the peak resident set size of this process in MB.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024**2 if sys.platform == "darwin" else rss / 1024
+
+
+def get_or_load(name: str, loader: Callable[[], Any]) -> Any:
+    """
+    Return the model registered under `name`, loading it with `loader` on
+    first use and reporting how long it took and how much memory it uses.
+    """
+    if name in models:
+        return models[name]
+
+    rss_before = get_rss_mb()
+    start_time = time.perf_counter()
+    models[name] = loader()
+    load_time = time.perf_counter() - start_time
+    rss_after = get_rss_mb()
+
+    model_stats[name] = {
+        "load_time": load_time,
+        "rss_mb": rss_after - rss_before,
+    }
+    Halo().info(
+        f"Loaded {name} model in {load_time:.2f} seconds "
+        f"(+{rss_after - rss_before:.0f} MB, {rss_after:.0f} MB resident)."
+    )
+    return models[name]
+
+
+def download_model():
+    import torch
 
-def load_model():
     spinner = Halo(text="Downloading model...").start()
     if os.path.exists(model_name):
         spinner.info("Model already downloaded.")
@@ -32,9 +97,153 @@ def load_model():
         spinner.succeed("Dictionary downloaded.")
     assert os.path.exists(dict_name)
 
+
+def get_checkpoint_signature(path: str) -> str:
+    """
+    Identify a checkpoint file by its path, size and modification time.
+    """
+    stat = os.stat(path)
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def get_quantized_path(name: str) -> str:
+    """
+    Get the path the int8 weights of a model are cached at.
+    """
+    return f"{os.path.splitext(os.path.basename(name))[0]}.int8.pt"
+
+
+def quantize(model):
+    import torch
+
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def load_quantized(
+    path: str, source: str, build: Callable[[], Any], load: Callable[[], Any]
+):
+    """
+    Load a dynamically quantized model from `path`. If it isn't there, or it
+    was made from a different `source`, quantize the fp32 model from `load`
+    and save it. `build` creates the model architecture with untrained
+    weights, which the cached int8 weights are loaded into.
+    """
+    import torch
+
+    # Packed int8 weights depend on the quantization backend.
+    signature = {
+        "source": source,
+        "torch": str(torch.__version__),
+        "engine": torch.backends.quantized.engine,
+    }
+
+    if os.path.exists(path):
+        try:
+            checkpoint = torch.load(path, map_location="cpu", weights_only=True)
+            if checkpoint["signature"] == signature:
+                model = quantize(build().eval())
+                model.load_state_dict(checkpoint["state_dict"])
+                return model
+        except Exception as e:
+            # A truncated or corrupt file is quantized again and replaced.
+            Halo().warn(f"Can't load {path}, quantizing again. Error: {e}.")
+
+    spinner = Halo(text="Quantizing model to int8...").start()
+    model = quantize(load().eval())
+    # Saved to a temp file of its own and renamed into place, so processes
+    # quantizing at the same time never write over each other's file.
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            torch.save({"signature": signature, "state_dict": model.state_dict()}, f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    spinner.succeed(f"Quantized model saved to {path}.")
+    return model
+
+
+def _load_alignment_model(precision: str, backend: str):
+    from backends import load_backend
+    from mms.align_utils import DEVICE, build_model, get_dictionary, get_model
+
+    download_model()
+
     load_spinner = Halo(text="Loading model and dictionary...").start()
-    model, dictionary = get_model_and_dict()
+    if precision == "int8":
+        model = load_quantized(
+            get_quantized_path(model_name),
+            get_checkpoint_signature(model_name),
+            build_model,
+            get_model,
+        )
+    elif backend != "eager":
+        model = load_backend(
+            backend, model_name, get_checkpoint_signature(model_name), get_model
+        )
+    else:
+        model = get_model().to(DEVICE)
+    dictionary = get_dictionary()
     dictionary["<star>"] = len(dictionary)
-    model = model.to(DEVICE)
     load_spinner.succeed("Model and dictionary loaded. Ready to receive requests.")
     return model, dictionary
+
+
+def _load_lid_model(precision: str):
+    from transformers import (
+        AutoConfig,
+        AutoFeatureExtractor,
+        Wav2Vec2ForSequenceClassification,
+    )
+
+    spinner = Halo(text="Loading language identification model...").start()
+    processor = AutoFeatureExtractor.from_pretrained(lid_model_id)
+    if precision == "int8":
+        model = load_quantized(
+            get_quantized_path(lid_model_id),
+            lid_model_id,
+            lambda: Wav2Vec2ForSequenceClassification(
+                AutoConfig.from_pretrained(lid_model_id)
+            ),
+            lambda: Wav2Vec2ForSequenceClassification.from_pretrained(lid_model_id),
+        )
+    else:
+        model = Wav2Vec2ForSequenceClassification.from_pretrained(lid_model_id)
+    model.eval()
+    spinner.succeed("Language identification model loaded.")
+    return processor, model
+
+
+def get_model_key(name: str, precision: str, backend: str = "eager") -> str:
+    return "-".join(
+        [name]
+        + ([precision] if precision != "fp32" else [])
+        + ([backend] if backend != "eager" else [])
+    )
+
+
+def load_model(precision: str = "fp32", backend: str = "eager"):
+    """
+    Get the alignment model and its dictionary. Backends other than eager
+    only support fp32.
+    """
+    if precision != "fp32" and backend != "eager":
+        raise ValueError(f"The {backend} backend only supports fp32.")
+    return get_or_load(
+        get_model_key("alignment", precision, backend),
+        lambda: _load_alignment_model(precision, backend),
+    )
+
+
+def load_lid_model(precision: str = "fp32"):
+    """
+    Get the language identification feature extractor and model.
+    """
+    return get_or_load(
+        get_model_key("lid", precision), lambda: _load_lid_model(precision)
+    )
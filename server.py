@@ -0,0 +1,394 @@
+"""
+An HTTP service that aligns uploaded audio and text. The model is loaded once
+when the server starts and kept warm, and emission windows from requests
+being aligned at the same time are run through the model together (see
+batcher.py).
+
+Run it with `python server.py`, or with gunicorn as one process with several
+threads so every request shares the model and the batcher:
+
+    gunicorn -w 1 --threads 8 'server:create_app()'
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from flask import Flask, jsonify, request
+from halo import Halo
+
+from batcher import Latencies, MicroBatcher
+from constants import model_name
+from languages import can_align
+from model import BACKENDS, PRECISIONS, load_model, model_stats
+from sessions import SessionStore, open_session_store, to_record
+from timestamp_types import Match, SessionDoc, Status
+from tuning import load_emission_config
+from utils import align_match, identify_match_languages
+
+# The file types main.py matches.
+AUDIO_EXTENSIONS = {".wav", ".mp3"}
+TEXT_EXTENSIONS = {".txt", ".usfm"}
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--host",
+    help="The address to listen on. Default is 127.0.0.1.",
+    default="127.0.0.1",
+)
+parser.add_argument(
+    "--port",
+    help="The port to listen on. Default is 8080.",
+    default=8080,
+    type=int,
+)
+parser.add_argument(
+    "--session-store",
+    help=(
+        "Where to keep sessions: `sqlite:<path>`, `file:<folder>` (one JSON "
+        "file per session) or `firestore:<collection>` (needs firebase-admin). "
+        "Default is `sqlite:sessions.sqlite3`."
+    ),
+    default="sqlite:sessions.sqlite3",
+)
+parser.add_argument(
+    "--request-workers",
+    help="The number of sessions to align at once. Default is 4.",
+    default=4,
+    type=int,
+)
+parser.add_argument(
+    "--batch-windows",
+    help=(
+        "The most audio windows, from all the sessions being aligned, to run "
+        "through the model at once. Default is 8."
+    ),
+    default=8,
+    type=int,
+)
+parser.add_argument(
+    "--batch-wait-ms",
+    help=(
+        "How long a batch waits for windows from other sessions before it is "
+        "run. Default is 10."
+    ),
+    default=10,
+    type=float,
+)
+parser.add_argument(
+    "-b",
+    "--batch-size",
+    help=(
+        "The number of audio windows each session sends to the model at once. "
+        "Default is 1, or the batch size from this machine's tuning profile."
+    ),
+    default=None,
+    type=int,
+)
+parser.add_argument(
+    "--no-tuning",
+    help=(
+        "Ignore this machine's tuning profile (see autotune.py) and use the "
+        "default window length, batch size and thread counts."
+    ),
+    action="store_true",
+)
+parser.add_argument(
+    "--precision",
+    help=(
+        "The numeric precision to run the models in. `int8` quantizes the "
+        "models' linear layers, which is faster on CPU but can move timestamps "
+        "slightly. Default is `fp32`."
+    ),
+    choices=PRECISIONS,
+    default="fp32",
+)
+parser.add_argument(
+    "--backend",
+    help=(
+        "How to run the alignment model: `eager` PyTorch, `torchscript`, "
+        "`compile` (torch.compile) or `onnx` (ONNX Runtime, needs onnxruntime "
+        "and onnxscript). Only supported with fp32 precision. Default is `eager`."
+    ),
+    choices=BACKENDS,
+    default="eager",
+)
+parser.add_argument(
+    "--cache-dir",
+    help=(
+        "A folder to cache model emissions and identified languages in. "
+        "Default is `emission_cache`."
+    ),
+    default="emission_cache",
+)
+parser.add_argument(
+    "--cache-size-mb",
+    help=(
+        "The maximum size of the emission cache in MB. 0 disables the cache. "
+        "Default is 1024."
+    ),
+    default=1024,
+    type=float,
+)
+
+
+class AlignmentService:
+    """
+    Aligns sessions on a thread pool, keeping their documents in `store`.
+    """
+
+    def __init__(
+        self,
+        store: SessionStore,
+        model: Any,
+        dictionary: Any,
+        emission_config: Any = None,
+        emission_cache: Any = None,
+        language_cache: Any = None,
+        precision: str = "fp32",
+        workers: int = 4,
+    ):
+        self.store = store
+        self.model = model
+        self.dictionary = dictionary
+        self.emission_config = emission_config
+        self.emission_cache = emission_cache
+        self.language_cache = language_cache
+        self.precision = precision
+        self.executor = ThreadPoolExecutor(max(1, workers))
+
+        self.lock = threading.Lock()
+        # The LID model is loaded on first use and isn't shared between threads.
+        self.lid_lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.done = 0
+        self.failed = 0
+        self.latencies = Latencies()
+
+    def submit(
+        self,
+        directory: str,
+        match: Match,
+        language: str | None,
+        separator: str,
+        max_silence_padding_ms: int,
+    ) -> SessionDoc:
+        """
+        Start aligning an uploaded pair, whose files are in `directory`. The
+        directory is removed once the session is done.
+        """
+        doc: SessionDoc = {
+            "sessionId": uuid.uuid4().hex,
+            "status": Status.IN_PROGRESS,
+            "timestamps": None,
+        }
+        self.store.put(doc)
+        with self.lock:
+            self.queued += 1
+        self.executor.submit(
+            self.align,
+            doc["sessionId"],
+            directory,
+            match,
+            language,
+            separator,
+            max_silence_padding_ms,
+            time.perf_counter(),
+        )
+        return doc
+
+    def align(
+        self,
+        session_id: str,
+        directory: str,
+        match: Match,
+        language: str | None,
+        separator: str,
+        max_silence_padding_ms: int,
+        submitted: float,
+    ):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            if language is None:
+                with self.lid_lock:
+                    language = identify_match_languages(
+                        [match], self.precision, 1, self.language_cache
+                    )[0]
+            timestamps = align_match(
+                match,
+                language,
+                separator,
+                self.model,
+                self.dictionary,
+                max_silence_padding_ms,
+                self.emission_config,
+                self.emission_cache,
+                spinner=Halo(enabled=False),
+            )
+            self.store.update(session_id, Status.DONE, timestamps)
+            succeeded = True
+        except Exception as e:
+            Halo().fail(f"Session {session_id} failed. Error: {e}.")
+            self.store.update(session_id, Status.FAILED)
+            succeeded = False
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        self.latencies.add(time.perf_counter() - submitted)
+        with self.lock:
+            self.running -= 1
+            if succeeded:
+                self.done += 1
+            else:
+                self.failed += 1
+
+    def metrics(self) -> dict[str, Any]:
+        with self.lock:
+            sessions = {
+                "queued": self.queued,
+                "running": self.running,
+                "done": self.done,
+                "failed": self.failed,
+            }
+        return {**sessions, "latency": self.latencies.summary()}
+
+
+def create_app(argv: list[str] | None = None) -> Flask:
+    """
+    Load the model and create the app. `argv` takes the same options as the
+    command line.
+    """
+    args = parser.parse_args(argv if argv is not None else [])
+    if args.precision != "fp32" and args.backend != "eager":
+        parser.error("--backend only supports fp32 precision.")
+
+    emission_config = load_emission_config(args.batch_size, not args.no_tuning)
+    model, dictionary = load_model(args.precision, args.backend)
+    batcher = MicroBatcher(model, args.batch_windows, args.batch_wait_ms)
+
+    from emission_cache import EmissionCache
+    from lid import LanguageCache
+
+    emission_cache = None
+    language_cache = None
+    if args.cache_size_mb > 0:
+        emission_cache = EmissionCache(
+            args.cache_dir,
+            args.cache_size_mb,
+            model_name,
+            args.precision,
+            args.backend,
+        )
+        language_cache = LanguageCache(args.cache_dir)
+
+    # Sessions that were being aligned when the server last stopped will never
+    # finish, so fail them rather than leave clients polling forever.
+    store = open_session_store(args.session_store)
+    stale = store.fail_in_progress()
+    if stale:
+        Halo().warn(f"Marked {len(stale)} unfinished sessions as failed.")
+
+    service = AlignmentService(
+        store,
+        batcher,
+        dictionary,
+        emission_config,
+        emission_cache,
+        language_cache,
+        args.precision,
+        args.request_workers,
+    )
+    start_time = time.time()
+    app = Flask(__name__)
+
+    @app.post("/sessions")
+    def create_session():
+        """
+        Align an `audio` file and a `text` file uploaded as multipart form
+        data. `language`, `separator` and `max_silence_padding_ms` can be
+        given as form fields, as with main.py. Responds straight away with the
+        new session, which can be polled until it is done.
+        """
+        if "audio" not in request.files or "text" not in request.files:
+            return jsonify({"error": "Upload an `audio` and a `text` file."}), 400
+        language = request.form.get("language") or None
+        if language is not None and not can_align(language):
+            return jsonify({"error": f"Unsupported language: {language}"}), 400
+        try:
+            max_silence_padding_ms = int(request.form.get("max_silence_padding_ms", -1))
+        except ValueError:
+            return jsonify({"error": "Invalid max_silence_padding_ms."}), 400
+
+        # The uploaded names are only shown in the timestamps. The files are
+        # saved under fixed names, since sanitizing a name (e.g. with
+        # secure_filename) strips non-Latin ones down to nothing.
+        file_names = {
+            field: os.path.basename(request.files[field].filename or "")
+            for field in ["audio", "text"]
+        }
+        extensions = {}
+        for field, allowed in [
+            ("audio", AUDIO_EXTENSIONS),
+            ("text", TEXT_EXTENSIONS),
+        ]:
+            extensions[field] = os.path.splitext(file_names[field])[1]
+            if extensions[field] not in allowed:
+                return jsonify({"error": f"Unsupported {field} file type."}), 400
+
+        directory = tempfile.mkdtemp(prefix="session-")
+        files = []
+        for field in ["audio", "text"]:
+            path = os.path.join(directory, field + extensions[field])
+            request.files[field].save(path)
+            files.append((file_names[field], path))
+        match: Match = (files[0], files[1])
+
+        doc = service.submit(
+            directory,
+            match,
+            language,
+            request.form.get("separator", "lineBreak"),
+            max_silence_padding_ms,
+        )
+        return jsonify(to_record(doc)), 202
+
+    @app.get("/sessions/<session_id>")
+    def get_session(session_id: str):
+        doc = service.store.get(session_id)
+        if doc is None:
+            return jsonify({"error": "Session not found."}), 404
+        return jsonify(to_record(doc))
+
+    @app.get("/metrics")
+    def get_metrics():
+        return jsonify(
+            {
+                "uptime_seconds": time.time() - start_time,
+                "sessions": service.metrics(),
+                "batcher": batcher.metrics(),
+                "models": model_stats,
+            }
+        )
+
+    return app
+
+
+def main():
+    args = parser.parse_args()
+    app = create_app(sys.argv[1:])
+    app.run(args.host, args.port, threaded=True)
+
+
+# Only start the server when run directly, so gunicorn can import create_app.
+if __name__ == "__main__":
+    main()
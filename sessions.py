@@ -0,0 +1,206 @@
+"""
+Stores for the server's session documents. Sessions can be kept in a SQLite
+database or a folder of JSON files on the local machine, or in a Firestore
+collection (which needs firebase-admin and Google credentials). Pick one
+with a URI like `sqlite:sessions.sqlite3`, `file:sessions` or
+`firestore:sessions`.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any
+
+from timestamp_types import FileTimestamps, SessionDoc, Status
+
+
+def to_record(doc: SessionDoc) -> dict[str, Any]:
+    return {**doc, "status": doc["status"].value}
+
+
+def from_record(record: dict[str, Any]) -> SessionDoc:
+    return {
+        "sessionId": record["sessionId"],
+        "status": Status(record["status"]),
+        "timestamps": record["timestamps"],
+    }
+
+
+class SessionStore(ABC):
+    """
+    Keeps each session's document, keyed by session id.
+    """
+
+    @abstractmethod
+    def put(self, doc: SessionDoc): ...
+
+    @abstractmethod
+    def get(self, session_id: str) -> SessionDoc | None: ...
+
+    @abstractmethod
+    def get_in_progress(self) -> list[str]:
+        """
+        Get the ids of the sessions that are still in progress.
+        """
+
+    def fail_in_progress(self) -> list[str]:
+        """
+        Mark every session that is still in progress as failed, e.g. when the
+        server restarts and the sessions it was aligning were lost. Returns
+        their ids.
+        """
+        session_ids = self.get_in_progress()
+        for session_id in session_ids:
+            self.update(session_id, Status.FAILED)
+        return session_ids
+
+    def update(
+        self,
+        session_id: str,
+        status: Status,
+        timestamps: FileTimestamps | None = None,
+    ):
+        self.put({"sessionId": session_id, "status": status, "timestamps": timestamps})
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    timestamps TEXT,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+
+    def put(self, doc: SessionDoc):
+        timestamps = doc["timestamps"]
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                (
+                    doc["sessionId"],
+                    doc["status"].value,
+                    json.dumps(timestamps) if timestamps is not None else None,
+                    time.time(),
+                ),
+            )
+
+    def get(self, session_id: str) -> SessionDoc | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT status, timestamps FROM sessions WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "sessionId": session_id,
+            "status": Status(row[0]),
+            "timestamps": json.loads(row[1]) if row[1] is not None else None,
+        }
+
+    def get_in_progress(self) -> list[str]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT session_id FROM sessions WHERE status = ?",
+                (Status.IN_PROGRESS.value,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class FileSessionStore(SessionStore):
+    """
+    Keeps each session in `<directory>/<session id>.json`.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def put(self, doc: SessionDoc):
+        # Written to a temp file and renamed into place so readers never see a
+        # partially written document.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(to_record(doc), f)
+            os.replace(tmp_path, self.get_path(doc["sessionId"]))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get(self, session_id: str) -> SessionDoc | None:
+        try:
+            with open(self.get_path(session_id), encoding="utf-8") as f:
+                return from_record(json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def get_in_progress(self) -> list[str]:
+        session_ids = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            doc = self.get(name.removesuffix(".json"))
+            if doc is not None and doc["status"] == Status.IN_PROGRESS:
+                session_ids.append(doc["sessionId"])
+        return session_ids
+
+
+class FirestoreSessionStore(SessionStore):
+    """
+    Keeps each session as a document in a Firestore collection, using the
+    default Google credentials.
+    """
+
+    def __init__(self, collection: str):
+        import firebase_admin
+        from firebase_admin import firestore
+
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app()
+        self.collection = firestore.client().collection(collection)
+
+    def put(self, doc: SessionDoc):
+        self.collection.document(doc["sessionId"]).set(to_record(doc))
+
+    def get(self, session_id: str) -> SessionDoc | None:
+        snapshot = self.collection.document(session_id).get()
+        if not snapshot.exists:
+            return None
+        return from_record(snapshot.to_dict())
+
+    def get_in_progress(self) -> list[str]:
+        query = self.collection.where("status", "==", Status.IN_PROGRESS.value)
+        return [snapshot.id for snapshot in query.stream()]
+
+
+def open_session_store(uri: str) -> SessionStore:
+    """
+    Open the session store a URI like `sqlite:<path>`, `file:<folder>` or
+    `firestore:<collection>` points to.
+    """
+    kind, _, location = uri.partition(":")
+    if not location:
+        raise ValueError(f"Invalid session store: {uri}")
+    if kind == "sqlite":
+        return SQLiteSessionStore(location)
+    if kind == "file":
+        return FileSessionStore(location)
+    if kind == "firestore":
+        return FirestoreSessionStore(location)
+    raise ValueError(f"Unknown session store: {kind}")
@@ -0,0 +1,110 @@
+"""
+Synthetic models, audio and text, so benchmarks and tuning can run without
+downloading the checkpoint or having real recordings.
+"""
+
+import os
+import random
+import wave
+
+import numpy as np
+import torch
+
+from audio import SAMPLING_FREQ, DecodedAudio
+from mms.align_utils import DEVICE, build_model
+from timestamp_types import Match
+
+# The tokens of the MMS alignment model's dictionary, in order.
+SYNTHETIC_TOKENS = ["<blank>", "<pad>", "</s>", "<unk>"] + list(
+    "aienoutsrmkldghybpwcvjzf'qx"
+)
+
+# Words covering the scripts, punctuation, brackets, digits and mappings that
+# norm_config handles.
+SYNTHETIC_WORDS = [
+    "In",
+    "the",
+    "beginning",
+    "(Gen 1:1)",
+    "(aside)",
+    "&lt;i&gt;",
+    "&nbsp",
+    "don’t",
+    "«word»",
+    "¿Qué?",
+    "Привет,",
+    "ٱلله",
+    "مرحبا،",
+    "שָׁלוֹם",
+    "สวัสดี",
+    "中文。",
+    "123",
+    "٣٤",
+    "Jává",
+]
+
+
+def get_random_model(seed: int):
+    """
+    Build the MMS alignment model with seeded random weights.
+    """
+    torch.manual_seed(seed)
+    return build_model().eval().to(DEVICE)
+
+
+def get_synthetic_dictionary() -> dict[str, int]:
+    """
+    Get a dictionary with the same tokens as the model's, including the
+    <star> token `load_model` adds.
+    """
+    dictionary = {token: i for i, token in enumerate(SYNTHETIC_TOKENS)}
+    dictionary["<star>"] = len(dictionary)
+    return dictionary
+
+
+def get_synthetic_audio(duration: float, seed: int) -> DecodedAudio:
+    """
+    Generate `duration` seconds of noise as decoded 16 kHz audio.
+    """
+    rng = np.random.default_rng(seed)
+    samples = rng.standard_normal(int(duration * SAMPLING_FREQ)) * 3000
+    return DecodedAudio(
+        path="<synthetic>",
+        samples=samples.astype(np.int16),
+        sample_rate=SAMPLING_FREQ,
+    )
+
+
+def get_synthetic_corpus(lines: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choice(SYNTHETIC_WORDS) for _ in range(rng.randint(5, 30)))
+        for _ in range(lines)
+    ]
+
+
+def write_synthetic_wav(path: str, duration: float, seed: int):
+    """
+    Write `duration` seconds of noise to a 16 kHz mono wav file.
+    """
+    audio = get_synthetic_audio(duration, seed)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(audio.sample_rate)
+        f.writeframes(audio.samples.tobytes())
+
+
+def write_synthetic_pair(
+    directory: str, name: str, duration: float, verses: int, seed: int
+) -> Match:
+    """
+    Write a wav file and a matching text file with one verse per line, and
+    return them as a match.
+    """
+    audio_path = os.path.join(directory, f"{name}.wav")
+    text_path = os.path.join(directory, f"{name}.txt")
+    write_synthetic_wav(audio_path, duration, seed)
+    with open(text_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(get_synthetic_corpus(verses, seed)))
+    return ((f"{name}.wav", audio_path), (f"{name}.txt", text_path))
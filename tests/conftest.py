@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules live at the top level of the repo rather than in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,203 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import align_bible
+import bibles
+from synthetic import write_synthetic_wav
+
+CHAPTERS = [f"MAT.{chapter}" for chapter in range(1, 9)]
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    A stand-in for Bible Brain's download API, serving a verse of text and a
+    short WAV file for every chapter, and logging the chapters asked for.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if parts[0] == "audio":
+            body = self.server.wav  # type: ignore
+        else:
+            # /api/download/<id>/<book>/<chapter>
+            bible_id, book, chapter = parts[2:]
+            self.server.requested.append(f"{book}.{chapter}")  # type: ignore
+            if bible_id.endswith("DA"):
+                port = self.server.server_address[1]
+                data = [{"path": f"http://127.0.0.1:{port}/audio/{book}.{chapter}"}]
+            else:
+                data = [
+                    {
+                        "verse_start": 1,
+                        "verse_end": 1,
+                        "verse_text": "in the beginning",
+                        "book_name_alt": book,
+                    }
+                ]
+            body = json.dumps({"data": data}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    write_synthetic_wav(str(tmp_path / "chapter.wav"), 1, 0)
+    server.wav = (tmp_path / "chapter.wav").read_bytes()  # type: ignore
+    server.requested = []  # type: ignore
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    monkeypatch.setattr(
+        bibles, "bb_api_url", f"http://127.0.0.1:{server.server_address[1]}/api"
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run(monkeypatch, output: str, prefetch: int, get_timings) -> None:
+    monkeypatch.setattr(align_bible, "bible_chapters", CHAPTERS)
+    monkeypatch.setattr(align_bible, "load_model", lambda *args: (None, None))
+    monkeypatch.setattr(align_bible, "get_timings", get_timings)
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "align_bible.py",
+            "-o",
+            output,
+            "-l",
+            "urd",
+            "--prefetch",
+            str(prefetch),
+            "--download-workers",
+            "4",
+            "--cache-size-mb",
+            "0",
+            "--no-tuning",
+        ],
+    )
+    align_bible.main()
+
+
+def write_timings(chapter_info) -> bool:
+    with open(chapter_info["paths"]["text"], encoding="utf-8") as f:
+        text = json.load(f)
+    text["verses"][0]["timings"] = [0.0, 1.0]
+    with open(chapter_info["paths"]["text"], "w", encoding="utf-8") as f:
+        json.dump(text, f)
+    return True
+
+
+def probe(path: str) -> float:
+    from audio import probe_duration
+
+    return probe_duration(path)
+
+
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_prefetch_stays_ahead_by_at_most_prefetch(
+    server, tmp_path, monkeypatch, prefetch
+):
+    aligned = []
+
+    def get_timings(language, chapter_info, *args):
+        chapter_id = chapter_info["chapter_id"]
+        # Downloads never get more than `prefetch` chapters ahead.
+        furthest = max(CHAPTERS.index(requested) for requested in server.requested)
+        assert furthest <= CHAPTERS.index(chapter_id) + prefetch
+        assert json.load(open(chapter_info["paths"]["text"]))["verses"]
+        assert probe(chapter_info["paths"]["audio"])
+        aligned.append(chapter_id)
+        # Take long enough that unbounded downloads would race ahead.
+        time.sleep(0.1)
+        return write_timings(chapter_info)
+
+    output = str(tmp_path / "bible")
+    run(monkeypatch, output, prefetch, get_timings)
+    assert aligned == CHAPTERS
+
+    # A second run finds everything aligned and downloads nothing.
+    server.requested.clear()
+    run(monkeypatch, output, prefetch, get_timings)
+    assert aligned == CHAPTERS
+    assert server.requested == []
+
+
+
+def test_removed_or_changed_files_are_redone(server, tmp_path, monkeypatch):
+    aligned = []
+
+    def get_timings(language, chapter_info, *args):
+        text = json.load(open(chapter_info["paths"]["text"]))
+        if text["verses"][0].get("timings") is not None:
+            return True
+        aligned.append(chapter_info["chapter_id"])
+        return write_timings(chapter_info)
+
+    output = str(tmp_path / "bible")
+    run(monkeypatch, output, 2, get_timings)
+    assert aligned == CHAPTERS
+
+    text_paths = {
+        chapter_id: bibles.get_chapter_info(chapter_id, output)["paths"]["text"]
+        for chapter_id in CHAPTERS
+    }
+    # Remove one chapter's text, and another's timings.
+    os.remove(text_paths["MAT.2"])
+    with open(text_paths["MAT.5"], encoding="utf-8") as f:
+        text = json.load(f)
+    del text["verses"][0]["timings"]
+    with open(text_paths["MAT.5"], "w", encoding="utf-8") as f:
+        json.dump(text, f)
+    # Touching a file without changing it doesn't count.
+    os.utime(text_paths["MAT.7"], (0, 0))
+
+    aligned.clear()
+    server.requested.clear()
+    run(monkeypatch, output, 2, get_timings)
+    assert aligned == ["MAT.2", "MAT.5"]
+    # Only the removed text was downloaded again. The audio is still there.
+    assert server.requested == ["MAT.2"]
+
+
+def test_verify_keeps_audio_when_lookup_fails(tmp_path, monkeypatch):
+    chapter_info = bibles.get_chapter_info("MAT.1", str(tmp_path))
+    os.makedirs(chapter_info["paths"]["book"])
+    audio_path = chapter_info["paths"]["audio"]
+    write_synthetic_wav(audio_path, 1, 0)
+    data = open(audio_path, "rb").read()
+
+    # get_bb_audio reports failures and returns without downloading anything.
+    monkeypatch.setattr(align_bible, "get_bb_audio", lambda *args, **kwargs: None)
+    align_bible.get_audio(chapter_info, "bb", "URDIRVN1DA", verify=True)
+
+    assert open(audio_path, "rb").read() == data
+    assert not os.path.exists(f"{audio_path}.part")
+
+
+def test_downloads_dont_start_spinners(server, tmp_path, monkeypatch):
+    started = []
+    monkeypatch.setattr(
+        bibles.Halo, "start", lambda self, *args: started.append(self) or self
+    )
+
+    def get_timings(language, chapter_info, *args):
+        return write_timings(chapter_info)
+
+    run(monkeypatch, str(tmp_path / "bible"), 2, get_timings)
+    # Only the aligning spinner (stubbed out here) may animate.
+    assert started == []
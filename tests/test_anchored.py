@@ -0,0 +1,93 @@
+import random
+
+import pytest
+import torch
+
+import mms.align_utils as align_utils
+from mms.align_utils import (
+    ANCHOR_WINDOW_CHUNKS,
+    force_align,
+    force_align_anchored,
+    get_spans,
+    get_token_indices,
+    merge_repeats,
+)
+
+LETTERS = "abcdefgh"
+
+
+def get_dictionary() -> dict[str, int]:
+    dictionary = {"<blank>": 0}
+    for letter in LETTERS:
+        dictionary[letter] = len(dictionary)
+    dictionary["<star>"] = len(dictionary)
+    return dictionary
+
+
+def get_peaked_emissions(seed: int, verses: int):
+    """
+    Get verses of random letters and emissions that clearly say where each
+    letter is, with silence between the verses. The last column is all zeros
+    for <star>, as in get_alignments.
+    """
+    rng = random.Random(seed)
+    dictionary = get_dictionary()
+    tokens = ["<star>"] + [
+        " ".join(rng.choices(LETTERS, k=rng.randint(3, 8))) for _ in range(verses)
+    ]
+
+    labels = [0] * rng.randint(5, 20)
+    for token in tokens[1:]:
+        for letter in token.split(" "):
+            labels += [0] * rng.randint(1, 2)
+            labels += [dictionary[letter]] * rng.randint(2, 4)
+        labels += [0] * rng.randint(10, 30)
+
+    emissions = torch.full((len(labels), len(dictionary)), -10.0)
+    emissions[torch.arange(len(labels)), torch.tensor(labels)] = 0.0
+    emissions[:, -1] = 0.0
+    return tokens, emissions, dictionary
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_anchored_matches_whole_file_on_peaked_emissions(seed: int, monkeypatch):
+    tokens, emissions, dictionary = get_peaked_emissions(seed, 150)
+    idx_to_token = list(dictionary)
+    chunk_frames = 400
+
+    path = force_align(emissions, get_token_indices(tokens, dictionary), dictionary)
+    expected = get_spans(tokens, merge_repeats(path, idx_to_token))
+
+    # Record the size of every alignment the anchored version runs.
+    sizes = []
+
+    def recording_force_align(emissions, token_indices, dictionary):
+        sizes.append((emissions.size(0), len(token_indices)))
+        return force_align(emissions, token_indices, dictionary)
+
+    monkeypatch.setattr(align_utils, "force_align", recording_force_align)
+    segments = force_align_anchored(
+        emissions, tokens, dictionary, idx_to_token, chunk_frames
+    )
+
+    assert get_spans(tokens, segments) == expected
+    # No alignment, coarse or fine, is over more than a window of frames,
+    # however long the file is.
+    assert emissions.size(0) > 10 * chunk_frames
+    assert max(frames for frames, _ in sizes) <= ANCHOR_WINDOW_CHUNKS * chunk_frames
+
+
+def test_anchored_aligns_every_token_on_random_emissions():
+    tokens, emissions, dictionary = get_peaked_emissions(0, 50)
+    generator = torch.Generator().manual_seed(0)
+    emissions = torch.log_softmax(
+        torch.randn(emissions.shape, generator=generator), dim=-1
+    )
+    emissions[:, -1] = 0.0
+
+    segments = force_align_anchored(
+        emissions, tokens, dictionary, list(dictionary), 200
+    )
+    spans = get_spans(tokens, segments)
+    assert len(spans) == len(tokens)
+    assert segments[0].start == 0 and segments[-1].end == emissions.size(0) - 1
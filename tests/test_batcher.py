@@ -0,0 +1,86 @@
+import threading
+
+import torch
+
+from batcher import MicroBatcher
+from mms.align_utils import get_num_frames
+
+
+class FakeModel:
+    """
+    Outputs, for each frame of each row, the sum of the row and the frame's
+    index, so every row's emissions depend only on its own samples. Records
+    the shape of every batch it's called with.
+    """
+
+    device = torch.device("cpu")
+
+    def __init__(self):
+        self.calls: list[tuple[int, ...]] = []
+
+    def __call__(self, waveforms: torch.Tensor, lengths: torch.Tensor | None):
+        self.calls.append(tuple(waveforms.shape))
+        num_frames = get_num_frames(waveforms.size(1))
+        emissions = waveforms.sum(dim=1, keepdim=True) + torch.arange(num_frames)
+        out_lengths = None
+        if lengths is not None:
+            out_lengths = torch.tensor([get_num_frames(int(n)) for n in lengths])
+        return emissions.unsqueeze(-1), out_lengths
+
+
+def test_concurrent_calls_are_batched():
+    model = FakeModel()
+    batcher = MicroBatcher(model, max_windows=8, max_wait_ms=1000)
+    # Calls with different numbers of windows, of different lengths, some with
+    # lengths and some without.
+    calls = [
+        (torch.rand(1, 16000), None),
+        (torch.rand(2, 24000), torch.tensor([24000, 20000])),
+        (torch.rand(3, 8000), None),
+    ]
+    results: list = [None] * len(calls)
+    barrier = threading.Barrier(len(calls))
+
+    def call(i: int):
+        barrier.wait()
+        results[i] = batcher(*calls[i])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(calls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # All six windows went through the model at once, padded to the longest.
+    assert model.calls == [(6, 24000)]
+    assert batcher.metrics()["batches"] == 1
+
+    # Each caller gets its own rows back, as if it had called the model alone.
+    for (waveforms, lengths), (emissions, out_lengths) in zip(calls, results):
+        expected, expected_lengths = FakeModel()(waveforms, lengths)
+        assert emissions.shape == expected.shape
+        assert torch.allclose(emissions, expected)
+        if lengths is None:
+            assert out_lengths is None
+        else:
+            assert torch.equal(out_lengths, expected_lengths)
+
+
+def test_calls_that_dont_fit_start_the_next_batch():
+    model = FakeModel()
+    batcher = MicroBatcher(model, max_windows=4, max_wait_ms=1000)
+    barrier = threading.Barrier(2)
+    results = []
+
+    def call(windows: int):
+        barrier.wait()
+        results.append(batcher(torch.rand(windows, 8000)))
+
+    threads = [threading.Thread(target=call, args=(3,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert model.calls == [(3, 8000), (3, 8000)]
+    assert [emissions.size(0) for emissions, _ in results] == [3, 3]
@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+import torch
+
+import emission_cache
+from audio import DecodedAudio
+from emission_cache import EmissionCache
+
+
+def get_cache(tmp_path, **kwargs) -> EmissionCache:
+    model_path = tmp_path / "model.pt"
+    model_path.write_bytes(b"checkpoint")
+    return EmissionCache(str(tmp_path / "cache"), 10, str(model_path), **kwargs)
+
+
+def test_get_returns_entry_evicted_after_reading(tmp_path, monkeypatch):
+    cache = get_cache(tmp_path)
+    emissions = torch.rand(5, 3)
+    cache.put("key", emissions)
+
+    # Another process evicts the entry between the read and the utime.
+    def evicted(path):
+        os.remove(path)
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(emission_cache.os, "utime", evicted)
+    assert torch.allclose(cache.get("key"), emissions, atol=1e-3)
+    assert cache.get("key") is None
+
+
+def test_key_depends_on_backend(tmp_path):
+    audio = DecodedAudio("audio.wav", np.zeros(16000, dtype=np.int16), 16000)
+    eager = get_cache(tmp_path).get_key(audio, 30, 2)
+    onnx = get_cache(tmp_path, backend="onnx").get_key(audio, 30, 2)
+    assert eager != onnx
+    assert get_cache(tmp_path, backend="eager").get_key(audio, 30, 2) == eager
@@ -0,0 +1,234 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import http_client
+from http_client import HttpClient, TokenBucket
+
+# Bigger than the 1 MB chunks downloads are written in.
+DATA = bytes(range(256)) * 10000
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Serves DATA at /file and JSON at /json, misbehaving first in the ways
+    listed in `server.failures` (a list popped one per request).
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get("Range")))  # type: ignore
+        failure = server.failures.pop(0) if server.failures else None  # type: ignore
+        if failure == "reset":
+            # Close the connection without sending anything.
+            self.close_connection = True
+            return
+        if isinstance(failure, int):
+            self.send_response(failure)
+            if failure == 429:
+                self.send_header("Retry-After", "0.2")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.path == "/json":
+            body = json.dumps({"ok": True}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if self.path == "/gzip" and "gzip" in self.headers.get("Accept-Encoding", ""):
+            # Compress the body if the client allows it, like many CDNs. The
+            # size and checksum are then those of the compressed bytes.
+            body = gzip.compress(DATA)
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", f'"{hashlib.md5(body).hexdigest()}"')
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        md5 = hashlib.md5(DATA).hexdigest()
+        if failure == "bad-md5":
+            md5 = hashlib.md5(b"something else").hexdigest()
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header is not None:
+            start = int(range_header.removeprefix("bytes=").removesuffix("-"))
+            if start >= len(DATA):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(DATA)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(DATA) - 1}/{len(DATA)}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(DATA) - start))
+        self.send_header("ETag", f'"{md5}"')
+        self.end_headers()
+        if failure == "truncate":
+            # Send half of what was promised, then hang up.
+            self.wfile.write(DATA[start : start + (len(DATA) - start) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(DATA[start:])
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.requests = []  # type: ignore
+    server.failures = []  # type: ignore
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_url(server, path: str) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Always wait the longest backoff, so the waits can be checked.
+    monkeypatch.setattr(http_client.random, "uniform", lambda low, high: high)
+    return HttpClient(max_retries=3, backoff_seconds=0.05)
+
+
+def test_retries_server_errors_with_backoff(server, client):
+    server.failures = [503, 500]
+    started = time.perf_counter()
+    assert client.get_json(get_url(server, "/json"), "json") == {"ok": True}
+    # 0.05 then 0.1 seconds of backoff.
+    assert time.perf_counter() - started >= 0.15
+    assert len(server.requests) == 3
+    assert client.stats["json"].retries == 2
+    assert client.stats["json"].errors == 0
+
+
+def test_honours_retry_after(server, client):
+    server.failures = [429]
+    started = time.perf_counter()
+    client.get_json(get_url(server, "/json"), "json")
+    assert time.perf_counter() - started >= 0.2
+
+
+def test_retries_connection_resets(server, client):
+    server.failures = ["reset", "reset"]
+    assert client.get_json(get_url(server, "/json"), "json") == {"ok": True}
+    assert len(server.requests) == 3
+
+
+def test_gives_up_after_max_retries(server, client):
+    server.failures = [502] * 10
+    with pytest.raises(requests.HTTPError):
+        client.get(get_url(server, "/json"), "json")
+    assert len(server.requests) == 4
+    assert client.stats["json"].errors == 1
+
+
+def test_doesnt_retry_client_errors(server, client):
+    server.failures = [404]
+    with pytest.raises(requests.HTTPError):
+        client.get(get_url(server, "/json"), "json")
+    assert len(server.requests) == 1
+
+
+def test_download_resumes_with_range(server, client, tmp_path):
+    server.failures = ["truncate"]
+    output = tmp_path / "file.mp3"
+    client.download(get_url(server, "/file"), str(output), "file")
+    assert output.read_bytes() == DATA
+    assert not (tmp_path / "file.mp3.part").exists()
+    # The second request only asked for what the first didn't deliver.
+    assert len(server.requests) == 2
+    assert server.requests[0] == ("/file", None)
+    offset = int(server.requests[1][1].removeprefix("bytes=").removesuffix("-"))
+    assert 0 < offset <= len(DATA) // 2
+
+
+def test_download_of_complete_part_gets_416(server, client, tmp_path):
+    output = tmp_path / "file.mp3"
+    (tmp_path / "file.mp3.part").write_bytes(DATA)
+    client.download(get_url(server, "/file"), str(output), "file")
+    assert output.read_bytes() == DATA
+    assert server.requests == [("/file", f"bytes={len(DATA)}-")]
+
+
+def test_download_starts_over_when_part_is_too_big(server, client, tmp_path):
+    output = tmp_path / "file.mp3"
+    (tmp_path / "file.mp3.part").write_bytes(DATA + b"extra")
+    client.download(get_url(server, "/file"), str(output), "file")
+    assert output.read_bytes() == DATA
+    assert server.requests == [
+        ("/file", f"bytes={len(DATA) + 5}-"),
+        ("/file", None),
+    ]
+
+
+def test_download_rejects_checksum_mismatch(server, client, tmp_path):
+    server.failures = ["bad-md5"] * 10
+    output = tmp_path / "file.mp3"
+    with pytest.raises(ValueError, match="Checksum"):
+        client.download(get_url(server, "/file"), str(output), "file")
+    assert not output.exists()
+    assert not (tmp_path / "file.mp3.part").exists()
+    # Each attempt started over rather than resuming a bad file.
+    assert server.requests == [("/file", None)] * 4
+
+
+def test_download_retries_checksum_mismatch(server, client, tmp_path):
+    server.failures = ["bad-md5"]
+    output = tmp_path / "file.mp3"
+    client.download(get_url(server, "/file"), str(output), "file")
+    assert output.read_bytes() == DATA
+
+
+def test_download_asks_for_uncompressed_bytes(server, client, tmp_path):
+    output = tmp_path / "file.mp3"
+    client.download(get_url(server, "/gzip"), str(output), "file")
+    assert output.read_bytes() == DATA
+    assert server.requests == [("/gzip", None)]
+
+
+def test_token_bucket_paces_requests():
+    bucket = TokenBucket(rate=20, capacity=2)
+    started = time.perf_counter()
+    for _ in range(6):
+        bucket.acquire()
+    # The first two are a burst, the other four wait 1/20 s each.
+    elapsed = time.perf_counter() - started
+    assert 0.18 <= elapsed < 1
+
+
+def test_client_rate_limits_provider(server):
+    client = HttpClient(rate_limits={"test": (20, 1)})
+    started = time.perf_counter()
+    for _ in range(5):
+        client.get(get_url(server, "/json"), "json", "test")
+    assert time.perf_counter() - started >= 0.18
+    # Requests without a provider aren't limited.
+    started = time.perf_counter()
+    for _ in range(5):
+        client.get(get_url(server, "/json"), "json")
+    assert time.perf_counter() - started < 0.18
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import torch
+
+import jobs
+from job_queue import CANCELLED, DONE, FAILED, JobQueue
+
+
+class SlowModel:
+    """
+    Stands in for the alignment model, taking a while for each window.
+    """
+
+    device = torch.device("cpu")
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, waveforms, lengths=None):
+        self.calls += 1
+        time.sleep(0.01)
+        return waveforms, lengths
+
+
+def align_windows(match, model, windows, **kwargs):
+    """
+    Stands in for align_match, calling the model once per window.
+    """
+    for _ in range(windows):
+        model(torch.zeros(1, 1))
+    return {"audio_file": match[0][0], "text_file": match[1][0], "sections": []}
+
+
+def setup_job(tmp_path, monkeypatch, windows: int):
+    monkeypatch.setattr(jobs, "HEARTBEAT_SECONDS", 0.05)
+    monkeypatch.setattr(jobs, "align_match", align_windows)
+    written = []
+    monkeypatch.setattr(jobs, "write_outputs", lambda *args: written.append(args))
+    model = SlowModel()
+    monkeypatch.setitem(
+        jobs.worker_state, "align_args", {"model": model, "windows": windows}
+    )
+
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    queue.enqueue(
+        str(tmp_path / "a.mp3"), str(tmp_path / "a.txt"), str(tmp_path), "eng"
+    )
+    job = queue.claim("worker")
+    assert job is not None
+    return queue, job, model, written
+
+
+def test_run_job_writes_outputs(tmp_path, monkeypatch):
+    queue, job, model, written = setup_job(tmp_path, monkeypatch, 5)
+    assert jobs.run_job(queue, job, "worker")
+    assert model.calls == 5
+    assert len(written) == 1
+    assert queue.get(job["id"])["status"] == DONE
+
+
+def test_cancelled_job_stops_aligning(tmp_path, monkeypatch):
+    queue, job, model, written = setup_job(tmp_path, monkeypatch, 1000)
+
+    def cancel():
+        time.sleep(0.1)
+        other = JobQueue(queue.path)
+        other.cancel([job["id"]])
+        other.close()
+
+    canceller = threading.Thread(target=cancel)
+    canceller.start()
+    started = time.perf_counter()
+    assert not jobs.run_job(queue, job, "worker")
+    canceller.join()
+
+    # It stopped within a heartbeat or so, rather than aligning all 1000
+    # windows (10 seconds).
+    assert time.perf_counter() - started < 2
+    assert model.calls < 1000
+    assert not written
+    assert queue.get(job["id"])["status"] == CANCELLED
+
+
+def test_unsupported_language_fails_without_retrying(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "identify_match_languages", lambda *args: ["xyz"])
+    monkeypatch.setattr(jobs, "align_match", align_windows)
+    monkeypatch.setitem(jobs.worker_state, "align_args", {"windows": 0})
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    job_id = queue.enqueue(
+        str(tmp_path / "a.mp3"), str(tmp_path / "a.txt"), str(tmp_path)
+    )
+
+    # A retried job would sit in the queue and keep the worker waiting.
+    worker = threading.Thread(
+        target=jobs.work, args=(queue.path, 0.01, 120, True), daemon=True
+    )
+    worker.start()
+    worker.join(5)
+    assert not worker.is_alive()
+
+    job = queue.get(job_id)
+    assert job["status"] == FAILED
+    assert job["attempts"] == 1
+    assert job["error"] == "Detected language xyz not supported."
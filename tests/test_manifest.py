@@ -0,0 +1,30 @@
+from manifest import Manifest
+
+
+def test_records_inputs_as_they_were_before_alignment(tmp_path):
+    folder = tmp_path / "input"
+    folder.mkdir()
+    (folder / "a.mp3").write_bytes(b"audio")
+    (folder / "a.txt").write_text("text")
+    output = tmp_path / "output"
+    output.mkdir()
+    (output / "a.json").write_text("{}")
+    match = (
+        ("a.mp3", str(folder / "a.mp3")),
+        ("a.txt", str(folder / "a.txt")),
+    )
+    params = {"language": "eng"}
+
+    manifest = Manifest(str(output), str(folder), params)
+    manifest.snapshot([match])
+    # The text is edited while the pair is being aligned.
+    (folder / "a.txt").write_text("edited text")
+    manifest.record(match, [str(output / "a.json")])
+
+    assert not Manifest(str(output), str(folder), params).is_up_to_date(match)
+
+    manifest = Manifest(str(output), str(folder), params)
+    manifest.snapshot([match])
+    manifest.record(match, [str(output / "a.json")])
+    assert Manifest(str(output), str(folder), params).is_up_to_date(match)
+    assert not Manifest(str(output), str(folder), {}).is_up_to_date(match)
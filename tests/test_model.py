@@ -0,0 +1,37 @@
+import torch
+
+from model import load_quantized
+
+
+def build():
+    return torch.nn.Sequential(torch.nn.Linear(8, 4))
+
+
+def load():
+    torch.manual_seed(0)
+    return build()
+
+
+def test_load_quantized_saves_and_reloads(tmp_path):
+    path = str(tmp_path / "model.int8.pt")
+    inputs = torch.rand(2, 8)
+    expected = load_quantized(path, "source", build, load)(inputs)
+    assert [p.name for p in tmp_path.iterdir()] == ["model.int8.pt"]
+
+    def fail():
+        raise AssertionError("The cached weights should be used.")
+
+    assert torch.equal(load_quantized(path, "source", build, fail)(inputs), expected)
+
+
+def test_load_quantized_replaces_corrupt_file(tmp_path):
+    path = tmp_path / "model.int8.pt"
+    load_quantized(str(path), "source", build, load)
+    path.write_bytes(path.read_bytes()[:100])
+
+    inputs = torch.rand(2, 8)
+    model = load_quantized(str(path), "source", build, load)
+    assert torch.equal(
+        load_quantized(str(path), "source", build, lambda: None)(inputs),
+        model(inputs),
+    )
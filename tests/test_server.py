@@ -0,0 +1,105 @@
+import io
+import os
+import time
+
+import pytest
+import torch
+
+import server
+from sessions import SQLiteSessionStore
+from timestamp_types import SessionDoc, Status
+
+
+class FakeModel:
+    device = torch.device("cpu")
+
+
+@pytest.fixture
+def store_path(tmp_path) -> str:
+    return str(tmp_path / "sessions.sqlite3")
+
+
+@pytest.fixture
+def aligned(monkeypatch) -> list:
+    """
+    Stub out the model and alignment, recording each aligned match and its
+    language.
+    """
+    aligned = []
+
+    def align_match(match, language, *args, **kwargs):
+        (audio_file, audio_path), (text_file, text_path) = match
+        assert os.path.exists(audio_path) and os.path.exists(text_path)
+        aligned.append((audio_file, text_file, language))
+        return {"audio_file": audio_file, "text_file": text_file, "sections": []}
+
+    monkeypatch.setattr(server, "load_model", lambda *args: (FakeModel(), {}))
+    monkeypatch.setattr(server, "align_match", align_match)
+    return aligned
+
+
+def get_client(store_path: str):
+    app = server.create_app(
+        ["--session-store", f"sqlite:{store_path}", "--cache-size-mb", "0"]
+    )
+    return app.test_client()
+
+
+def upload(client, audio_name: str, text_name: str, language: str = "urd"):
+    return client.post(
+        "/sessions",
+        data={
+            "audio": (io.BytesIO(b"audio"), audio_name),
+            "text": (io.BytesIO("متن".encode("utf-8")), text_name),
+            "language": language,
+        },
+        content_type="multipart/form-data",
+    )
+
+
+def test_session_keeps_non_latin_names(store_path, aligned):
+    client = get_client(store_path)
+    response = upload(client, "پیدائش 1.mp3", "پیدائش 1.txt")
+    assert response.status_code == 202
+    session_id = response.get_json()["sessionId"]
+
+    for _ in range(100):
+        doc = client.get(f"/sessions/{session_id}").get_json()
+        if doc["status"] != "in_progress":
+            break
+        time.sleep(0.05)
+    assert doc == {
+        "sessionId": session_id,
+        "status": "done",
+        "timestamps": {
+            "audio_file": "پیدائش 1.mp3",
+            "text_file": "پیدائش 1.txt",
+            "sections": [],
+        },
+    }
+    assert aligned == [("پیدائش 1.mp3", "پیدائش 1.txt", "urd")]
+    assert client.get("/sessions/missing").status_code == 404
+
+
+def test_rejects_unsupported_uploads(store_path, aligned):
+    client = get_client(store_path)
+    response = upload(client, "audio.ogg", "text.txt")
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Unsupported audio file type."}
+
+    response = upload(client, "audio.mp3", "text.txt", language="xyz")
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Unsupported language: xyz"}
+    assert aligned == []
+
+
+def test_fails_sessions_left_in_progress(store_path, aligned):
+    doc: SessionDoc = {
+        "sessionId": "stale",
+        "status": Status.IN_PROGRESS,
+        "timestamps": None,
+    }
+    SQLiteSessionStore(store_path).put(doc)
+
+    client = get_client(store_path)
+    assert client.get("/sessions/stale").get_json()["status"] == "failed"
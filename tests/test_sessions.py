@@ -0,0 +1,79 @@
+import pytest
+
+from sessions import (
+    FileSessionStore,
+    SessionStore,
+    SQLiteSessionStore,
+    open_session_store,
+)
+from timestamp_types import SessionDoc, Status
+
+TIMESTAMPS = {
+    "audio_file": "創世記 1.mp3",
+    "text_file": "創世記 1.txt",
+    "sections": [
+        {
+            "verse_id": "1",
+            "timings": [0.0, 1.5],
+            "timings_str": ["00:00:00,000", "00:00:01,500"],
+            "text": "起初，神創造天地。",
+            "uroman_tokens": "q i c h u",
+        }
+    ],
+}
+
+
+@pytest.fixture(params=["sqlite", "file"])
+def store(request, tmp_path) -> SessionStore:
+    if request.param == "sqlite":
+        return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"))
+    return FileSessionStore(str(tmp_path / "sessions"))
+
+
+def test_round_trip(store: SessionStore):
+    doc: SessionDoc = {
+        "sessionId": "a",
+        "status": Status.IN_PROGRESS,
+        "timestamps": None,
+    }
+    store.put(doc)
+    assert store.get("a") == doc
+    assert store.get("b") is None
+
+    store.update("a", Status.DONE, TIMESTAMPS)  # type: ignore
+    assert store.get("a") == {
+        "sessionId": "a",
+        "status": Status.DONE,
+        "timestamps": TIMESTAMPS,
+    }
+
+
+def test_fail_in_progress(store: SessionStore):
+    for session_id, status in [
+        ("a", Status.IN_PROGRESS),
+        ("b", Status.DONE),
+        ("c", Status.IN_PROGRESS),
+    ]:
+        store.put({"sessionId": session_id, "status": status, "timestamps": None})
+
+    assert sorted(store.fail_in_progress()) == ["a", "c"]
+    assert [store.get(id)["status"] for id in "abc"] == [  # type: ignore
+        Status.FAILED,
+        Status.DONE,
+        Status.FAILED,
+    ]
+    assert store.get_in_progress() == []
+
+
+def test_open_session_store(tmp_path):
+    assert isinstance(
+        open_session_store(f"sqlite:{tmp_path / 'sessions.sqlite3'}"),
+        SQLiteSessionStore,
+    )
+    assert isinstance(
+        open_session_store(f"file:{tmp_path / 'sessions'}"), FileSessionStore
+    )
+    with pytest.raises(ValueError):
+        open_session_store("redis:sessions")
+    with pytest.raises(TypeError):
+        SessionStore()  # type: ignore
@@ -0,0 +1,116 @@
+import math
+import random
+
+import pytest
+
+from mms.align_utils import Segment, get_spans
+
+SIL = "<blank>"
+
+
+def get_spans_reference(tokens, segments, max_silence_padding_frames=-1):
+    """
+    get_spans as it was before it was vectorized, walking the segments one at
+    a time.
+    """
+    ltr_idx = 0
+    tokens_idx = 0
+    intervals = []
+    start, end = (0, 0)
+
+    for seg_idx, seg in enumerate(segments):
+        if tokens_idx == len(tokens):
+            assert seg_idx == len(segments) - 1
+            assert seg.label == SIL
+            continue
+        cur_token = tokens[tokens_idx].split(" ")
+        ltr = cur_token[ltr_idx]
+        if seg.label == SIL:
+            continue
+        assert seg.label == ltr
+        if (ltr_idx) == 0:
+            start = seg_idx
+        if ltr_idx == len(cur_token) - 1:
+            ltr_idx = 0
+            tokens_idx += 1
+            intervals.append((start, seg_idx))
+            while tokens_idx < len(tokens) and len(tokens[tokens_idx]) == 0:
+                intervals.append((seg_idx, seg_idx))
+                tokens_idx += 1
+        else:
+            ltr_idx += 1
+    spans = []
+
+    for idx, (start, end) in enumerate(intervals):
+        span = segments[start : end + 1]
+        if start > 0:
+            prev_seg = segments[start - 1]
+            if prev_seg.label == SIL:
+                pad_start = (
+                    prev_seg.start
+                    if (idx == 0)
+                    else int((prev_seg.start + prev_seg.end) / 2)
+                )
+                if max_silence_padding_frames > -1:
+                    pad_start = max(
+                        pad_start, span[0].start - max_silence_padding_frames
+                    )
+                span = [Segment(SIL, pad_start, span[0].start)] + span
+        if end + 1 < len(segments):
+            next_seg = segments[end + 1]
+            if next_seg.label == SIL:
+                pad_end = (
+                    next_seg.end
+                    if (idx == len(intervals) - 1)
+                    else math.floor((next_seg.start + next_seg.end) / 2)
+                )
+                if max_silence_padding_frames > -1:
+                    pad_end = min(pad_end, span[-1].end + max_silence_padding_frames)
+                span = span + [Segment(SIL, span[-1].end, pad_end)]
+        spans.append(span)
+
+    return spans
+
+
+def get_random_alignment(rng: random.Random):
+    """
+    Get random tokens and segments like merge_repeats would produce for them:
+    one segment per letter, in order, with silences of random length in
+    between (always between repeated letters) and maybe at either end.
+    """
+    tokens = ["<star>"]
+    for _ in range(rng.randint(0, 12)):
+        if rng.random() < 0.15:
+            tokens.append("")
+        else:
+            tokens.append(" ".join(rng.choices("abcd", k=rng.randint(1, 5))))
+
+    segments = []
+    frame = 0
+
+    def add(label):
+        nonlocal frame
+        length = rng.randint(1, 20)
+        segments.append(Segment(label, frame, frame + length - 1))
+        frame += length
+
+    previous = None
+    for token in tokens:
+        for letter in token.split(" ") if token else []:
+            if letter == previous or rng.random() < 0.5:
+                add(SIL)
+            add(letter)
+            previous = letter
+    if rng.random() < 0.5:
+        add(SIL)
+    return tokens, segments
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_get_spans_matches_reference(seed: int):
+    rng = random.Random(seed)
+    tokens, segments = get_random_alignment(rng)
+    for max_silence_padding_frames in [-1, 0, rng.randint(1, 30)]:
+        assert get_spans(
+            tokens, segments, max_silence_padding_frames
+        ) == get_spans_reference(tokens, segments, max_silence_padding_frames)
@@ -0,0 +1,26 @@
+import shutil
+
+import pytest
+
+from mms.align_utils import romanize_lines, romanize_lines_cli
+
+LINES = [
+    "in the beginning god created the heaven and the earth",
+    "в начале сотворил бог небо и землю",
+    "فِي الْبَدْءِ خَلَقَ اللهُ السَّمَاوَاتِ وَالأَرْضَ",
+    "ابتدا میں خدا نے آسمان اور زمین کو پیدا کیا",
+    "आदि में परमेश्वर ने आकाश और पृथ्वी की सृष्टि की",
+    "起初，神創造天地。",
+    "태초에 하나님이 천지를 창조하시니라",
+    "ἐν ἀρχῇ ἐποίησεν ὁ θεὸς τὸν οὐρανὸν καὶ τὴν γῆν",
+    "በመጀመሪያ እግዚአብሔር ሰማይንና ምድርን ፈጠረ",
+    "בְּרֵאשִׁית בָּרָא אֱלֹהִים אֵת הַשָּׁמַיִם וְאֵת הָאָרֶץ",
+    "",
+    "1:1 ¿qué? — «ñandú» 42",
+]
+
+
+@pytest.mark.skipif(shutil.which("uroman") is None, reason="needs the uroman CLI")
+@pytest.mark.parametrize("iso", [None, "ukr"])
+def test_romanize_lines_matches_cli(iso):
+    assert romanize_lines(LINES, iso) == romanize_lines_cli(LINES, iso)
@@ -0,0 +1,170 @@
+"""
+Per-file, per-stage timings for the alignment pipeline. Stages are wrapped in
+`span(...)`, which does nothing unless tracing has been started. Traces can be
+exported in the Chrome trace event format (open them in chrome://tracing or
+https://ui.perfetto.dev) and summarised as a table.
+"""
+
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Iterator
+
+# Stages that --profile captures.
+HOT_STAGES = {"emissions", "forced_align"}
+
+
+class Tracer:
+    """
+    Collects complete ("X") trace events. Timestamps come from the monotonic
+    clock, which is shared between processes, so events recorded in worker
+    processes can be merged in.
+    """
+
+    def __init__(self):
+        self.events: list[dict[str, Any]] = []
+        self.start_time = time.perf_counter_ns()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **args: Any) -> Iterator[dict[str, Any]]:
+        """
+        Time a stage. The yielded args can be added to inside the span.
+        """
+        start_time = time.perf_counter_ns()
+        try:
+            yield args
+        finally:
+            end_time = time.perf_counter_ns()
+            with self.lock:
+                self.events.append(
+                    {
+                        "name": name,
+                        "ph": "X",
+                        "ts": start_time / 1000,
+                        "dur": (end_time - start_time) / 1000,
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                        "args": args,
+                    }
+                )
+
+    def take_events(self) -> list[dict[str, Any]]:
+        """
+        Remove and return the events recorded so far.
+        """
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+    def add_events(self, events: list[dict[str, Any]]):
+        with self.lock:
+            self.events.extend(events)
+
+    def export_chrome(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self) -> str:
+        """
+        Get a table of the time spent in each stage, and the real-time factor
+        over all of the decoded audio.
+        """
+        stages: dict[str, list[float]] = {}
+        for event in self.events:
+            stages.setdefault(event["name"], []).append(event["dur"] / 1e6)
+
+        wall_time = (time.perf_counter_ns() - self.start_time) / 1e9
+        audio_seconds = sum(
+            event["args"].get("audio_seconds", 0)
+            for event in self.events
+            if event["name"] == "decode"
+        )
+
+        rows = [f"{'stage':<20} {'calls':>7} {'total s':>10} {'mean ms':>10} {'% wall':>7}"]
+        for name, durations in sorted(stages.items(), key=lambda item: -sum(item[1])):
+            total = sum(durations)
+            rows.append(
+                f"{name:<20} {len(durations):>7} {total:>10.2f} "
+                f"{total / len(durations) * 1000:>10.1f} "
+                f"{total / wall_time * 100 if wall_time else 0:>6.1f}%"
+            )
+        rows.append(f"wall time: {wall_time:.2f}s, audio: {audio_seconds:.2f}s")
+        if audio_seconds:
+            rows.append(f"real-time factor: {wall_time / audio_seconds:.3f}")
+        return "\n".join(rows)
+
+
+# The tracer for this process, if tracing is on.
+tracer: Tracer | None = None
+
+# How the run is being profiled ("cprofile" or "torch"), if it is.
+profile_kind: str | None = None
+profiler: cProfile.Profile | None = None
+
+
+def start_tracing() -> Tracer:
+    global tracer
+    tracer = Tracer()
+    return tracer
+
+
+def span(name: str, **args: Any):
+    """
+    Time a stage if tracing is on, and mark it for the profiler if profiling
+    is on.
+    """
+    if tracer is None:
+        return nullcontext(args)
+    if profile_kind == "torch" or (profile_kind == "cprofile" and name in HOT_STAGES):
+        return profile_span(tracer, name, args)
+    return tracer.span(name, **args)
+
+
+@contextmanager
+def profile_span(tracer: Tracer, name: str, args: dict[str, Any]):
+    with tracer.span(name, **args) as span_args:
+        if profiler is not None:
+            profiler.enable()
+            try:
+                yield span_args
+            finally:
+                profiler.disable()
+        else:
+            import torch
+
+            with torch.profiler.record_function(name):
+                yield span_args
+
+
+@contextmanager
+def profiling(kind: str, path: str):
+    """
+    Profile the run while the context is open and save the results to
+    `path`. With `cprofile`, only the hot stages (see HOT_STAGES) are
+    profiled, and the stats are saved for pstats or snakeviz. With `torch`,
+    the torch.profiler trace of the whole run is saved as a Chrome trace, with
+    each traced stage labelled.
+    """
+    global profile_kind, profiler
+
+    profile_kind = kind
+    try:
+        if kind == "cprofile":
+            profiler = cProfile.Profile()
+            yield
+            profiler.dump_stats(path)
+        else:
+            import torch
+
+            with torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU]
+            ) as torch_profiler:
+                yield
+            torch_profiler.export_chrome_trace(path)
+    finally:
+        profile_kind = None
+        profiler = None
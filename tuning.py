@@ -0,0 +1,97 @@
+"""
+Per-host tuning profiles. `autotune.py` measures which emission window,
+batch size and torch thread counts give the best real-time factor on a
+machine and saves them here, and `main.py` and `align_bible.py` pick them up
+on the next run.
+"""
+
+import json
+import os
+import socket
+from typing import Any, TypedDict
+
+from halo import Halo
+
+TUNING_DIR = "tuning"
+
+
+class TuningProfile(TypedDict):
+    """
+    The fastest settings autotune found for a host.
+    """
+
+    host: str
+    cpu_count: int
+    torch_version: str
+    interval: float
+    context: float
+    batch_size: int
+    threads: int
+    interop_threads: int
+    real_time_factor: float
+
+
+def get_profile_path(directory: str = TUNING_DIR) -> str:
+    return os.path.join(directory, f"{socket.gethostname()}.json")
+
+
+def save_profile(profile: TuningProfile, directory: str = TUNING_DIR):
+    os.makedirs(directory, exist_ok=True)
+    with open(get_profile_path(directory), "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+
+
+def load_profile(directory: str = TUNING_DIR) -> TuningProfile | None:
+    """
+    Load this host's tuning profile. Profiles tuned for a different number of
+    CPUs (e.g. a resized VM) are ignored.
+    """
+    try:
+        with open(get_profile_path(directory), encoding="utf-8") as f:
+            profile: TuningProfile = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if profile.get("cpu_count") != os.cpu_count():
+        return None
+    return profile
+
+
+def apply_threads(threads: int, interop_threads: int):
+    """
+    Set torch's intra-op and inter-op thread counts. The inter-op count can
+    only be set before torch first uses it, so it is left alone after that.
+    """
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        pass
+
+
+def load_emission_config(batch_size: int | None = None, use_profile: bool = True) -> Any:
+    """
+    Get the EmissionConfig to align with: this host's tuned settings if it
+    has a profile, otherwise the defaults. An explicit `batch_size` overrides
+    the profile's. The profile's thread counts are applied as well.
+    """
+    from mms.align_utils import EmissionConfig
+
+    profile = load_profile() if use_profile else None
+    if profile is None:
+        return EmissionConfig(batch_size=batch_size or 1)
+
+    apply_threads(profile["threads"], profile["interop_threads"])
+    config = EmissionConfig(
+        interval=profile["interval"],
+        context=profile["context"],
+        batch_size=batch_size or profile["batch_size"],
+    )
+    Halo().info(
+        f"Using tuning profile {get_profile_path()}: {profile['threads']} threads, "
+        f"{config.interval:g}s windows, {config.context:g} context, "
+        f"batch size {config.batch_size}."
+    )
+    return config
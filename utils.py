@@ -1,21 +1,19 @@
 import json
 import math
+import multiprocessing
 import os
 import re
 import time
 import traceback
-from typing import Any
+from typing import Any, Iterator
 
-import ffmpeg
 from halo import Halo
 
-from lid import identify_language
-from mms.align_utils import get_alignments, get_spans, get_uroman_tokens
+import tracing
+from languages import can_align
 from mms.text_normalization import text_normalize
 from timestamp_types import File, FileTimestamps, Match, Section
 
-mms_languages = json.load(open("data/mms_languages.json"))
-
 
 def match_files(
     files: list[File],
@@ -54,226 +52,505 @@ def match_files(
     return [match for match in matched_files.values() if None not in match]
 
 
-def align_matches(
-    folder: str,
+def read_lines(text_name: str, text_path: str, separator: str) -> list[str]:
+    """
+    Read the lines to timestamp from a text file.
+    """
+    text_extension = text_name.split(".")[-1]
+
+    text_file = open(text_path, "r", encoding="utf-8")
+    lines_to_timestamp = []
+
+    if text_extension == "json":
+        verses = json.load(text_file)
+        for verse in verses:
+            lines_to_timestamp.append(verse["text"])
+
+    elif text_extension == "txt":
+        # Read the separator from the query parameter and adjust
+        # it so it can be used in the split function.
+        if separator == "lineBreak":
+            separator = "\n"
+        elif separator == "squareBracket":
+            separator = "["
+        elif separator == "downArrow":
+            separator = "⬇️"
+
+        lines_to_timestamp = text_file.read().strip(separator).split(separator)
+        lines_to_timestamp = [line for line in lines_to_timestamp if line.strip()]
+    elif text_extension == "usfm":
+        # Define the tags to ignore
+        ignore_tags = [
+            "\\c",
+            "\\p",
+            "\\s",
+            "\\s1",
+            "\\s2",
+            "\\f",
+            "\\ft",
+            "\\fr",
+            "\\x",
+            "\\xt",
+            "\\xo",
+            "\\r",
+            "\\t",
+            "\\m",
+        ]
+
+        # Compile a regex to match tags we want to ignore
+        ignore_regex = re.compile(r"|".join(re.escape(tag) for tag in ignore_tags))
+        current_verse = ""
+        for line in text_file:
+            if ignore_regex.match(line.strip()):
+                continue
+
+            if line.startswith(r"\v"):  # USFM verse marker
+                if current_verse:
+                    cleaned_verse = re.sub(r"\\[a-z]+\s?", "", current_verse.strip())
+                    lines_to_timestamp.append(cleaned_verse)
+                current_verse = line.strip()  # Start a new verse
+            else:
+                current_verse += " " + line.strip()
+
+        if current_verse:  # Append the last verse after the loop
+            cleaned_verse = re.sub(r"\\[a-z]+\s?", "", current_verse.strip())
+            lines_to_timestamp.append(cleaned_verse)
+
+    text_file.close()
+    return lines_to_timestamp
+
+
+def write_outputs(output: str, match: Match, timestamps: FileTimestamps) -> list[str]:
+    """
+    Write the JSON and SRT files for a match to the output folder and return
+    their paths.
+    """
+    assert match[0] is not None
+
+    # Create JSON file
+    base_name = os.path.splitext(match[0][0])[0]
+    output_file = os.path.join(output, f"{base_name}.json")
+    with open(output_file, "w") as f:
+        json.dump(timestamps, f)
+
+    # Create SRT file
+    srt_file = os.path.join(output, f"{base_name}.srt")
+    with open(srt_file, "w") as f:
+        for i, section in enumerate(timestamps["sections"], 1):
+            start_time = section["timings"][0]
+            end_time = section["timings"][1]
+
+            # Convert timestamps to SRT format (HH:MM:SS,mmm)
+            start_srt = time.strftime("%H:%M:%S,", time.gmtime(start_time)) + f"{int((start_time % 1) * 1000):03d}"
+            end_srt = time.strftime("%H:%M:%S,", time.gmtime(end_time)) + f"{int((end_time % 1) * 1000):03d}"
+
+            # Write SRT entry
+            f.write(f"{i}\n")
+            f.write(f"{start_srt} --> {end_srt}\n")
+            f.write(f"{section['text']}\n\n")
+
+    return [output_file, srt_file]
+
+
+def get_file_timestamps(
+    match: Match,
+    lines: list[str],
+    uroman_lines: list[str],
+    spans: list[Any],
+    stride: float,
+) -> FileTimestamps:
+    """
+    Turn the aligned spans of each line (after the leading <star>) into
+    timestamped sections.
+    """
+    assert match[0] is not None and match[1] is not None
+    chapter_id = ".".join(match[0][0].split(".")[0:-1])
+
+    sections = []
+
+    for i, t in enumerate(lines):
+        if i == 0:
+            continue
+
+        span = spans[i]
+        seg_start_idx = span[0].start
+        seg_end_idx = span[-1].end
+
+        audio_start_sec = round(seg_start_idx * stride / 1000, 2)
+        audio_end_sec = round(seg_end_idx * stride / 1000, 2)
+
+        section: Section = {
+            "verse_id": f"{chapter_id}.{i}",
+            "timings": (audio_start_sec, audio_end_sec),
+            "timings_str": (
+                time.strftime("%H:%M:%S", time.gmtime(audio_start_sec)),
+                time.strftime("%H:%M:%S", time.gmtime(audio_end_sec)),
+            ),
+            "text": t,
+            "uroman_tokens": uroman_lines[i],
+        }
+
+        sections.append(section)
+
+    return {
+        "audio_file": match[0][0],
+        "text_file": match[1][0],
+        "sections": sections,
+    }
+
+
+def align_match(
+    match: Match,
     language: str | None,
     separator: str,
-    matches: list[Match],
     model: Any,
     dictionary: Any,
     max_silence_padding_ms: int,
-):
+    emission_config: Any = None,
+    emission_cache: Any = None,
+    chunk_seconds: float = 0,
+    low_memory: bool = False,
+    audio: Any = None,
+    spinner: Halo | None = None,
+) -> FileTimestamps:
     """
-    Align audio and text files and return a list of FileTimestamps.
+    Align a single audio and text file pair. `audio` can be passed in if the
+    audio file has already been decoded.
     """
-    spinner = Halo("Aligning...").start()
+    from audio import decode_audio
+    from mms.align_utils import get_alignments, get_spans, get_uroman_tokens
 
-    file_timestamps: list[FileTimestamps] = []
+    assert match[0] is not None and match[1] is not None
+    spinner = spinner or Halo()
 
-    progress = 0
-    total_length = 0
+    audio_path = match[0][1]
 
-    for index, match in enumerate(matches):
-        if match[0] is None or match[1] is None:
-            continue
-        try:
-            audio_path = match[0][1]
-            audio_type = match[0][0].split(".")[-1]
-            chapter_id = ".".join(match[0][0].split(".")[0:-1])
-            wav_output = audio_path.replace(f".{audio_type}", "_output.wav")
+    if audio is None:
+        spinner.text = f"Decoding {audio_path}..."
+        spinner.start()
+        with tracing.span("decode", file=match[0][0]) as span_args:
+            audio = decode_audio(audio_path, low_memory=low_memory)
+            span_args["audio_seconds"] = audio.duration
+        spinner.succeed(f"Decoded {audio.duration:.2f} seconds of audio.")
+
+    with tracing.span("read_text", file=match[1][0]):
+        lines_to_timestamp = read_lines(match[1][0], match[1][1], separator)
+
+    with tracing.span("normalize", file=match[1][0]):
+        norm_lines_to_timestamp = [
+            text_normalize(line.strip(), language if language is not None else "eng")
+            for line in lines_to_timestamp
+        ]
+    with tracing.span("uroman", file=match[1][0]):
+        uroman_lines_to_timestamp = get_uroman_tokens(
+            norm_lines_to_timestamp, language
+        )
+    uroman_lines_to_timestamp = ["<star>"] + uroman_lines_to_timestamp
+    lines_to_timestamp = ["<star>"] + lines_to_timestamp
+    norm_lines_to_timestamp = ["<star>"] + norm_lines_to_timestamp
+    spinner.succeed("Text normalized and romanized.")
+
+    spinner.text = "Aligning..."
+    spinner.start()
+
+    # segments: List of Segments (character level timing objects)
+    # stride: ms per frame
+    segments, stride = get_alignments(
+        audio,
+        uroman_lines_to_timestamp,
+        model,
+        dictionary,
+        emission_config,
+        emission_cache,
+        chunk_seconds,
+    )
+
+    if max_silence_padding_ms >= 0:
+        max_silence_padding_frames = round(max_silence_padding_ms / stride)
+        spinner.info(
+            f"Max Silence Padding: {max_silence_padding_ms}ms -> "
+            f"{max_silence_padding_frames} frames"
+        )
+    else:
+        max_silence_padding_frames = -1
+
+    with tracing.span("spans", file=match[0][0]):
+        spans = get_spans(
+            uroman_lines_to_timestamp, segments, max_silence_padding_frames
+        )
+
+    return get_file_timestamps(
+        match, lines_to_timestamp, uroman_lines_to_timestamp, spans, stride
+    )
+
+
+# State shared with worker processes, set up once per worker by init_worker.
+worker_state: dict[str, Any] = {}
+
+
+def init_worker(
+    align_args: dict[str, Any], threads: int, cpu_sets: Any, trace: bool = False
+):
+    import torch
+
+    # Split the cores between workers instead of every worker starting a
+    # thread per core.
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Already set in the parent before forking.
+        pass
+
+    if cpu_sets is not None:
+        os.sched_setaffinity(0, cpu_sets.get())
+
+    worker_state["align_args"] = align_args
+
+    # Start with an empty trace rather than a copy of the parent's.
+    tracing.tracer = None
+    if trace:
+        tracing.start_tracing()
 
-            spinner.text = f"Converting audio to {wav_output}..."
-            spinner.start()
 
-            total_length += float(ffmpeg.probe(audio_path)["streams"][0]["duration"])
-            stream = ffmpeg.input(audio_path)
-            stream = ffmpeg.output(stream, wav_output, acodec="pcm_s16le", ar=16000)
-            stream = ffmpeg.overwrite_output(stream)
-            ffmpeg.run(
-                stream,
-                overwrite_output=True,
-                cmd=["ffmpeg", "-loglevel", "error"],  # type: ignore
+def align_in_worker(
+    task: tuple[Match, str],
+) -> tuple[Match, FileTimestamps | None, str | None, list[dict[str, Any]]]:
+    """
+    Align a match in its language in a worker process, returning the error instead of
+    raising it so one bad file doesn't take down the pool. The match is
+    returned with its result since results come back in the order they
+    finish, and the trace events recorded for the file are returned too, so
+    the parent can merge them.
+    """
+    match, language = task
+    timestamps, error = None, None
+    try:
+        assert match[0] is not None
+        with tracing.span("align_file", file=match[0][0]):
+            timestamps = align_match(
+                match,
+                **{**worker_state["align_args"], "language": language},
+                spinner=Halo(enabled=False),
             )
-            spinner.succeed(f"Audio converted to {wav_output}.")
-
-            # Identify the session language. This is time
-            # consuming so we only do it for the first file and assume
-            # all files are the same language.
-            if index == 0 and language is None:
-                # Cut down audio to 10 seconds for language
-                # identification.
-                spinner.text = "Identifying language..."
-                spinner.start()
-                cut_output = f"{folder}/cut_output.wav"
-                stream = ffmpeg.input(wav_output)
-                stream = ffmpeg.output(stream, cut_output, t=30)
-                stream = ffmpeg.overwrite_output(stream)
-                ffmpeg.run(
-                    stream,
-                    overwrite_output=True,
-                    cmd=["ffmpeg", "-loglevel", "error"],  # type: ignore
-                )
+    except Exception:
+        error = traceback.format_exc()
 
-                language = identify_language(cut_output)
+    events = tracing.tracer.take_events() if tracing.tracer is not None else []
+    return match, timestamps, error, events
 
-                # Check if language is valid.
-                language_match = next(
-                    (item for item in mms_languages if item["iso"] == language), None
-                )
 
-                if language_match is None or not language_match["align"]:
-                    spinner.fail(f"Detected language {language} not supported.")
-                    return
-                else:
-                    spinner.succeed(f"Valid language identified as {language}.")
-
-                # Remove the cut file
-                os.remove(cut_output)
-
-            text_path = match[1][1]
-
-            text_extension = match[1][0].split(".")[-1]
-
-            text_file = open(text_path, "r", encoding="utf-8")
-            lines_to_timestamp = []
-
-            if text_extension == "json":
-                verses = json.load(text_file)
-                for verse in verses:
-                    lines_to_timestamp.append(verse["text"])
-
-            elif text_extension == "txt":
-                # Read the separator from the query parameter and adjust
-                # it so it can be used in the split function.
-                if separator == "lineBreak":
-                    separator = "\n"
-                elif separator == "squareBracket":
-                    separator = "["
-                elif separator == "downArrow":
-                    separator = "⬇️"
-
-                lines_to_timestamp = text_file.read().strip(separator).split(separator)
-                lines_to_timestamp = [line for line in lines_to_timestamp if line.strip()]
-            elif text_extension == "usfm":
-                # Define the tags to ignore
-                ignore_tags = [
-                    "\\c",
-                    "\\p",
-                    "\\s",
-                    "\\s1",
-                    "\\s2",
-                    "\\f",
-                    "\\ft",
-                    "\\fr",
-                    "\\x",
-                    "\\xt",
-                    "\\xo",
-                    "\\r",
-                    "\\t",
-                    "\\m",
-                ]
-
-                # Compile a regex to match tags we want to ignore
-                ignore_regex = re.compile(
-                    r"|".join(re.escape(tag) for tag in ignore_tags)
+def identify_match_languages(
+    matches: list[Match],
+    precision: str = "fp32",
+    clips: int = 1,
+    cache: Any = None,
+) -> list[str]:
+    """
+    Identify the language of each match's audio. Only the clips LID needs are
+    decoded, and files are identified LID_BATCH_SIZE at a time.
+    """
+    from audio import decode_audio
+    from lid import LID_BATCH_SIZE, LID_SECONDS, identify_languages
+
+    languages = []
+    for i in range(0, len(matches), LID_BATCH_SIZE):
+        audios = []
+        for match in matches[i : i + LID_BATCH_SIZE]:
+            assert match[0] is not None
+            with tracing.span("decode", file=match[0][0]):
+                audios.append(
+                    decode_audio(match[0][1], duration=clips * LID_SECONDS)
                 )
-                current_verse = ""
-                for line in text_file:
-                    if ignore_regex.match(line.strip()):
-                        continue
-
-                    if line.startswith(r"\v"):  # USFM verse marker
-                        if current_verse:
-                            cleaned_verse = re.sub(
-                                r"\\[a-z]+\s?", "", current_verse.strip()
-                            )
-                            lines_to_timestamp.append(cleaned_verse)
-                        current_verse = line.strip()  # Start a new verse
-                    else:
-                        current_verse += " " + line.strip()
-
-                if current_verse:  # Append the last verse after the loop
-                    cleaned_verse = re.sub(r"\\[a-z]+\s?", "", current_verse.strip())
-                    lines_to_timestamp.append(cleaned_verse)
+        with tracing.span("lid", files=len(audios)):
+            languages += identify_languages(audios, precision, clips, cache)
+    return languages
 
-            norm_lines_to_timestamp = [
-                text_normalize(
-                    line.strip(), language if language is not None else "eng"
-                )
-                for line in lines_to_timestamp
-            ]
-            uroman_lines_to_timestamp = get_uroman_tokens(
-                norm_lines_to_timestamp, language
-            )
-            uroman_lines_to_timestamp = ["<star>"] + uroman_lines_to_timestamp
-            lines_to_timestamp = ["<star>"] + lines_to_timestamp
-            norm_lines_to_timestamp = ["<star>"] + norm_lines_to_timestamp
-            spinner.succeed("Text normalized and romanized.")
 
-            spinner.text = "Aligning..."
-            spinner.start()
+def get_cpu_sets(workers: int) -> list[set[int]]:
+    """
+    Split the CPUs this process may run on into one contiguous set per worker.
+    """
+    cpus = sorted(os.sched_getaffinity(0))
+    size = max(1, len(cpus) // workers)
+    return [set(cpus[i * size : (i + 1) * size] or cpus) for i in range(workers)]
 
-            # segments: List of Segments (character level timing objects)
-            # stride: ms per frame
-            segments, stride = get_alignments(
-                wav_output,
-                uroman_lines_to_timestamp,
-                model,
-                dictionary,
-            )
 
-            if max_silence_padding_ms >= 0:
-                max_silence_padding_frames = round(max_silence_padding_ms / stride)
-                spinner.info(f"Max Silence Padding: {max_silence_padding_ms}ms -> {max_silence_padding_frames} frames")
-            else:
-                max_silence_padding_frames = -1
-            
-            spans = get_spans(uroman_lines_to_timestamp, segments, max_silence_padding_frames)
-
-            sections = []
-
-            for i, t in enumerate(lines_to_timestamp):
-                if i == 0:
-                    continue
-
-                span = spans[i]
-                seg_start_idx = span[0].start
-                seg_end_idx = span[-1].end
-
-                audio_start_sec = round(seg_start_idx * stride / 1000, 2)
-                audio_end_sec = round(seg_end_idx * stride / 1000, 2)
-
-                section: Section = {
-                    "verse_id": f"{chapter_id}.{i}",
-                    "timings": (audio_start_sec, audio_end_sec),
-                    "timings_str": (
-                        time.strftime("%H:%M:%S", time.gmtime(audio_start_sec)),
-                        time.strftime("%H:%M:%S", time.gmtime(audio_end_sec)),
-                    ),
-                    "text": t,
-                    "uroman_tokens": uroman_lines_to_timestamp[i],
-                }
-
-                sections.append(section)
+def align_matches(
+    folder: str,
+    language: str | None,
+    separator: str,
+    matches: list[Match],
+    model: Any,
+    dictionary: Any,
+    max_silence_padding_ms: int,
+    emission_config: Any = None,
+    emission_cache: Any = None,
+    workers: int = 1,
+    pin_workers: bool = False,
+    chunk_seconds: float = 0,
+    low_memory: bool = False,
+    precision: str = "fp32",
+    per_file_language: bool = False,
+    language_clips: int = 1,
+    language_cache: Any = None,
+) -> Iterator[tuple[Match, FileTimestamps]]:
+    """
+    Align audio and text files, yielding each match with its FileTimestamps
+    as soon as it has been aligned. Files that fail to align are reported and
+    skipped, so nothing aligned before a failure is lost.
+
+    Without a `language`, it is identified from the first file and assumed
+    for all of them, or with `per_file_language`, identified for each file.
+    `language_clips` is the number of clips of each file LID scores, and
+    identified languages are cached in `language_cache` if there is one.
+
+    With `workers` > 1, files are aligned in that many processes which share
+    the already loaded model, and are yielded in the order they finish.
+    """
+    # These pull in torch and ffmpeg, so only import them once there is
+    # actually something to align.
+    from audio import decode_audio
+    from lid import identify_language
+    from mms.align_utils import get_uroman
+
+    pending = [match for match in matches if match[0] is not None and match[1] is not None]
+    if not pending:
+        return
+
+    spinner = Halo("Aligning...").start()
+    first_audio = None
+
+    if language is None and per_file_language:
+        try:
+            spinner.text = f"Identifying the language of {len(pending)} files..."
+            spinner.start()
+            languages = identify_match_languages(
+                pending, precision, language_clips, language_cache
+            )
         except Exception:
-            spinner.fail("Failed to align.")
+            spinner.fail("Failed to identify languages.")
             print(traceback.format_exc())
             return
 
-        spinner.succeed("Alignment done.")
+        tasks = []
+        for match, file_language in zip(pending, languages):
+            assert match[0] is not None
+            if can_align(file_language):
+                tasks.append((match, file_language))
+            else:
+                spinner.fail(
+                    f"Detected language {file_language} of {match[0][0]} not supported."
+                )
+        spinner.succeed(f"Identified the languages of {len(pending)} files.")
+    else:
+        # Identify the session language. This is time
+        # consuming so we only do it for the first file and assume
+        # all files are the same language.
+        if language is None:
+            first_match = pending[0]
+            assert first_match[0] is not None
+            try:
+                spinner.text = "Identifying language..."
+                spinner.start()
 
-        spinner.text = "Cleaning up..."
-        spinner.start()
-        os.remove(wav_output)
-        spinner.succeed("Cleaned up.")
-
-        file_timestamps.append(
-            {
-                "audio_file": match[0][0],
-                "text_file": match[1][0],
-                "sections": sections,
-            }
-        )
-        progress += 1
+                with tracing.span("decode", file=first_match[0][0]) as span_args:
+                    first_audio = decode_audio(
+                        first_match[0][1], low_memory=low_memory
+                    )
+                    span_args["audio_seconds"] = first_audio.duration
+                with tracing.span("lid", file=first_match[0][0]):
+                    language = identify_language(
+                        first_audio, precision, language_clips, language_cache
+                    )
+            except Exception:
+                spinner.fail("Failed to identify language.")
+                print(traceback.format_exc())
+                return
+
+            if not can_align(language):
+                spinner.fail(f"Detected language {language} not supported.")
+                return
+            else:
+                spinner.succeed(f"Valid language identified as {language}.")
+
+        tasks = [(match, language) for match in pending]
+
+    align_args = {
+        "language": language,
+        "separator": separator,
+        "model": model,
+        "dictionary": dictionary,
+        "max_silence_padding_ms": max_silence_padding_ms,
+        "emission_config": emission_config,
+        "emission_cache": emission_cache,
+        "chunk_seconds": chunk_seconds,
+        "low_memory": low_memory,
+    }
+
+    if workers <= 1:
+        for position, (match, file_language) in enumerate(tasks):
+            assert match[0] is not None
+            try:
+                with tracing.span("align_file", file=match[0][0]):
+                    timestamps = align_match(
+                        match,
+                        **{**align_args, "language": file_language},
+                        audio=first_audio if position == 0 else None,
+                        spinner=spinner,
+                    )
+            except Exception:
+                spinner.fail(f"Failed to align {match[0][0]}.")
+                print(traceback.format_exc())
+                continue
+            finally:
+                # Don't hold on to the first file's audio once it's aligned.
+                first_audio = None
+
+            spinner.succeed("Alignment done.")
+            yield match, timestamps
+        return
+
+    # Forked workers share the model's weights (and the uroman rules) with this
+    # process copy-on-write. Where fork isn't available, move the weights to
+    # shared memory instead.
+    get_uroman()
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context("spawn")
+        model.share_memory()
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    cpu_sets = None
+    if pin_workers:
+        worker_cpu_sets = get_cpu_sets(workers)
+        cpu_sets = context.Queue()
+        for cpu_set in worker_cpu_sets:
+            cpu_sets.put(cpu_set)
+        threads = len(worker_cpu_sets[0])
+
+    spinner.text = f"Aligning {len(tasks)} files with {workers} workers..."
+    spinner.start()
+
+    trace = tracing.tracer is not None
+    with context.Pool(
+        workers,
+        initializer=init_worker,
+        initargs=(align_args, threads, cpu_sets, trace),
+    ) as pool:
+        for match, timestamps, error, events in pool.imap_unordered(
+            align_in_worker, tasks
+        ):
+            assert match[0] is not None
+            if tracing.tracer is not None:
+                tracing.tracer.add_events(events)
+            if error is not None or timestamps is None:
+                spinner.fail(f"Failed to align {match[0][0]}.")
+                print(error)
+            else:
+                spinner.succeed(f"Aligned {match[0][0]}.")
+                yield match, timestamps
+            spinner.start()
 
-    return file_timestamps
+    spinner.stop()
@@ -0,0 +1,74 @@
+"""
+Write aligned files' JSON and SRT outputs on a background thread, so the
+next file can start aligning while the last one is being written.
+"""
+
+import queue
+import threading
+import traceback
+from typing import Any
+
+from halo import Halo
+
+import tracing
+from timestamp_types import FileTimestamps, Match
+from utils import write_outputs
+
+
+class OutputWriter:
+    """
+    Writes each (match, timestamps) put on it to the output folder, and
+    records it in the run's manifest if there is one. At most `max_pending`
+    results wait to be written, so a slow disk holds up alignment instead of
+    results piling up in memory.
+
+    Use it as a context manager: leaving the block writes everything still
+    queued, even if the block raised, so partial progress is kept.
+    """
+
+    def __init__(self, output: str, manifest: Any = None, max_pending: int = 8):
+        self.output = output
+        self.manifest = manifest
+        self.queue: queue.Queue[tuple[Match, FileTimestamps] | None] = queue.Queue(
+            max_pending
+        )
+        self.written = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def put(self, match: Match, timestamps: FileTimestamps):
+        self.queue.put((match, timestamps))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            match, timestamps = item
+            assert match[0] is not None
+            try:
+                with tracing.span("write_outputs", file=match[0][0]):
+                    outputs = write_outputs(self.output, match, timestamps)
+                if self.manifest is not None:
+                    self.manifest.record(match, outputs)
+                self.written += 1
+            except Exception:
+                Halo().fail(f"Failed to write outputs for {match[0][0]}.")
+                print(traceback.format_exc())
+                self.failed += 1
+
+    def close(self):
+        """
+        Wait for everything queued to be written.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()